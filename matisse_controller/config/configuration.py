@@ -17,6 +17,11 @@ DEFAULTS = {
             'upper_limit': 900
         },
         'report_events': False,
+        'event_report': {
+            'flush_interval': 5.0,
+            'max_file_size': 10
+        },
+        'state_polling_interval': 0.5,
         'component_limit_offset': 0.055,
         'scanning': {
             'limit': 15,
@@ -68,6 +73,11 @@ DEFAULTS = {
             'delay': 0.5,
             'tolerance': 0.0005
         },
+        'telemetry': {
+            'full_rate_minutes': 30,
+            'downsample_interval': 60,
+            'downsampled_days': 7
+        },
         'correction': {
             'limit': 10,
             'piezo_etalon_pos_upper': 0.8,
@@ -88,7 +98,10 @@ DEFAULTS = {
     },
     'ple': {
         'target_temperature': -70,
-        'temperature_tolerance': 3.25
+        'temperature_tolerance': 3.25,
+        'dark_frame_directory': 'dark_frames',
+        'calibration_directory': 'calibrations',
+        'backend': 'andor'
     },
     'gui': {
         'status_monitor': {
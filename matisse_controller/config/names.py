@@ -14,6 +14,10 @@ THIN_ETA_RESET_POS = 'matisse.reset_positions.thin_etalon'
 THIN_ETA_RAND_RANGE = 'matisse.scanning.thin_etalon.randomization_range'
 
 REPORT_EVENTS = 'matisse.report_events'
+EVENT_REPORT_FLUSH_INTERVAL = 'matisse.event_report.flush_interval'
+EVENT_REPORT_MAX_FILE_SIZE = 'matisse.event_report.max_file_size'
+
+STATE_POLLING_INTERVAL = 'matisse.state_polling_interval'
 
 COMPONENT_LIMIT_OFFSET = 'matisse.component_limit_offset'
 
@@ -56,6 +60,10 @@ STABILIZATION_FALLING_SPEED = 'matisse.stabilization.falling_speed'
 STABILIZATION_DELAY = 'matisse.stabilization.delay'
 STABILIZATION_TOLERANCE = 'matisse.stabilization.tolerance'
 
+TELEMETRY_FULL_RATE_MINUTES = 'matisse.telemetry.full_rate_minutes'
+TELEMETRY_DOWNSAMPLE_INTERVAL = 'matisse.telemetry.downsample_interval'
+TELEMETRY_DOWNSAMPLED_DAYS = 'matisse.telemetry.downsampled_days'
+
 CORRECTION_LIMIT = 'matisse.correction.limit'
 
 PIEZO_ETA_UPPER_CORRECTION_POS = 'matisse.correction.piezo_etalon_pos_upper'
@@ -70,3 +78,6 @@ REFCELL_LOWER_CORRECTION_POS = 'matisse.correction.refcell_pos_lower'
 
 PLE_TARGET_TEMPERATURE = 'ple.target_temperature'
 PLE_TEMPERATURE_TOLERANCE = 'ple.temperature_tolerance'
+PLE_DARK_FRAME_DIRECTORY = 'ple.dark_frame_directory'
+PLE_CALIBRATION_DIRECTORY = 'ple.calibration_directory'
+PLE_BACKEND = 'ple.backend'
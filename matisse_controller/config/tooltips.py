@@ -10,7 +10,11 @@ BIFI_RESET_POS = 'The position at which to set the birefringent motor during a r
 THIN_ETA_RESET_POS = 'The position at which to set the thin etalon motor during a reset operation, or before a large scan.'
 THIN_ETA_RAND_RANGE = 'Limit for range of thin etalon randomization away from the reset position when starting the wavelength-setting process.'
 
+STATE_POLLING_INTERVAL = 'The delay, in seconds, between each reading of the Matisse state while locking, stabilization, or anything else is waiting for a new one. Otherwise the state is read at the status monitor delay. Takes effect after a restart.'
+
 REPORT_EVENTS = 'Should we log important events (like an automatic correction while stabilizing) to a CSV file?'
+EVENT_REPORT_FLUSH_INTERVAL = 'The maximum delay, in seconds, before a reported event is written to the CSV file.'
+EVENT_REPORT_MAX_FILE_SIZE = 'The size, in MB, at which the event report is moved to a numbered backup and a new report is started.'
 
 COMPONENT_LIMIT_OFFSET = 'How close should a component be to its limit before automatically taking an appropriate action?'
 
@@ -53,7 +57,14 @@ STABILIZATION_FALLING_SPEED = 'The speed at which the RefCell decreases when usi
 STABILIZATION_DELAY = 'How long to wait, in seconds, between each auto-stabilization loop.'
 STABILIZATION_TOLERANCE = 'How much drift is tolerated, in nanometers, when auto-stabilizing.'
 
+TELEMETRY_FULL_RATE_MINUTES = 'How many minutes of stabilization telemetry to keep in memory at full rate.'
+TELEMETRY_DOWNSAMPLE_INTERVAL = 'Length, in seconds, of each interval in the downsampled (min/mean/max) stabilization telemetry.'
+TELEMETRY_DOWNSAMPLED_DAYS = 'How many days of downsampled stabilization telemetry to keep in memory.'
+
 CORRECTION_LIMIT = 'Number of auto-corrections allowed during stabilization before restarting the wavelength-setting process.'
 
 PLE_TARGET_TEMPERATURE = 'Default target temperature at which to cool down the CCD camera.'
 PLE_TEMPERATURE_TOLERANCE = 'How close to the target temperature should we get, in degrees, before continuing with a CCD-related task?'
+PLE_DARK_FRAME_DIRECTORY = 'The folder in which master dark frames are stored, for subtracting background from PLE data.'
+PLE_CALIBRATION_DIRECTORY = 'The folder in which spectrometer calibrations are stored, for converting CCD pixels to wavelengths.'
+PLE_BACKEND = 'Which hardware to use for PLE: the Andor spectrometer and CCD, or simulated ones for testing without them.'
@@ -19,7 +19,7 @@ from matisse_controller.gui.dialogs.single_acquisition_dialog import SingleAcqui
 from matisse_controller.gui.logging_stream import LoggingStream
 from matisse_controller.gui.utils import handled_function, handled_slot
 from matisse_controller.gui.widgets import LoggingArea, StatusMonitor
-from matisse_controller.matisse import Matisse
+from matisse_controller.matisse import Matisse, event_report
 from matisse_controller.shamrock_ple import PLE
 
 
@@ -51,6 +51,8 @@ class ControlApplication(QApplication):
         self.ple_scan_worker: Future = None
         self.ple_analysis_worker: Future = None
         self.single_acquisition_worker: Future = None
+        # The live feed also runs as the single acquisition worker, but keeps the CCD streaming until stopped
+        self.live_feed_worker: Future = None
 
         container = QWidget()
         container.setLayout(self.layout)
@@ -82,6 +84,7 @@ class ControlApplication(QApplication):
         self.clear_log_area_action = console_menu.addAction('Clear Log')
         self.close_plots_action = console_menu.addAction('Close All Plots')
         self.configuration_action = console_menu.addAction('Configuration')
+        self.export_telemetry_action = console_menu.addAction('Export Telemetry')
         reset_menu = console_menu.addMenu('Reset')
         self.reset_all_action = reset_menu.addAction('All')
         self.reset_matisse_motors_action = reset_menu.addAction('Matisse Motors')
@@ -122,9 +125,12 @@ class ControlApplication(QApplication):
 
         ple_menu = menu_bar.addMenu('Shamrock')
         self.start_ple_scan_action = ple_menu.addAction('Start PLE Scan')
+        self.resume_ple_scan_action = ple_menu.addAction('Resume PLE Scan')
         self.analyze_ple_action = ple_menu.addAction('Start PLE Analysis')
+        self.batch_analyze_ple_action = ple_menu.addAction('Start Batch PLE Analysis')
         self.view_existing_analysis_action = ple_menu.addAction('View PLE Analysis')
         self.single_acquisition_action = ple_menu.addAction('View Single Acquisition')
+        self.live_feed_action = ple_menu.addAction('Start Live Feed')
 
         self.control_loop_actions = [self.slow_pz_control_action, self.thin_eta_control_action,
                                      self.piezo_eta_control_action, self.fast_pz_control_action]
@@ -139,6 +145,7 @@ class ControlApplication(QApplication):
         self.clear_log_area_action.triggered.connect(self.clear_log_area)
         self.close_plots_action.triggered.connect(self.close_plots)
         self.configuration_action.triggered.connect(self.open_configuration)
+        self.export_telemetry_action.triggered.connect(self.export_telemetry)
         self.reset_all_action.triggered.connect(self.reset)
         self.reset_matisse_motors_action.triggered.connect(self.reset_motors_only)
         self.reset_matisse_piezos_action.triggered.connect(self.reset_piezos_only)
@@ -175,9 +182,12 @@ class ControlApplication(QApplication):
 
         # Shamrock
         self.start_ple_scan_action.triggered.connect(self.start_ple_scan)
+        self.resume_ple_scan_action.triggered.connect(self.resume_ple_scan)
         self.analyze_ple_action.triggered.connect(self.analyze_ple_data)
+        self.batch_analyze_ple_action.triggered.connect(self.batch_analyze_ple_data)
         self.view_existing_analysis_action.triggered.connect(self.view_existing_analysis)
         self.single_acquisition_action.triggered.connect(self.take_single_acquisition)
+        self.live_feed_action.triggered.connect(self.start_live_feed)
 
     @handled_function
     def setup_widgets(self):
@@ -204,12 +214,17 @@ class ControlApplication(QApplication):
         Don't call this elsewhere unless you know what you're doing.
         """
         self.reset(reset_motors=False, reset_piezos=False)
-        del self.matisse
 
         # Clean up widgets with running threads.
         self.status_monitor.clean_up()
         self.log_area.clean_up()
 
+        if self.matisse:
+            self.matisse.stop_state_polling()
+        del self.matisse
+
+        event_report.close()
+
         PLE.clean_up_globals()
 
         self.log_redirector.__exit__(None, None, None)
@@ -243,6 +258,13 @@ class ControlApplication(QApplication):
         dialog = ConfigurationDialog()
         dialog.exec()
 
+    @handled_slot(bool)
+    def export_telemetry(self, checked):
+        file_path, success = QFileDialog.getSaveFileName(caption='Export Telemetry', filter='NumPy archive (*.npz)')
+        if success:
+            self.matisse.telemetry.export(file_path)
+            print(f"Exported stabilization telemetry to {file_path}.")
+
     @handled_slot(bool)
     def reset(self, checked=False, reset_motors=True, reset_piezos=True, reset_matisse_tasks=True,
               reset_ple_tasks=True):
@@ -297,6 +319,7 @@ class ControlApplication(QApplication):
                 print('Waiting for acquisition to complete.')
                 self.single_acquisition_worker.result()
             self.single_acquisition_worker = None
+            self.live_feed_worker = None
 
         if self.matisse:
             self.matisse.exit_flag = False
@@ -478,6 +501,9 @@ class ControlApplication(QApplication):
         if self.ple_scan_worker and self.ple_scan_worker.running():
             print('WARNING: A PLE scan is currently in progress.')
             return
+        if self.live_feed_worker and self.live_feed_worker.running():
+            print('WARNING: The live feed is using the CCD. Reset PLE tasks to stop it before starting a PLE scan.')
+            return
 
         dialog = PLEScanDialog(parent=self.window)
         if dialog.exec() == QDialog.Accepted:
@@ -486,6 +512,21 @@ class ControlApplication(QApplication):
             self.ple_scan_worker = self.work_executor.submit(self.ple.start_ple_scan, **ple_options)
             self.ple_scan_worker.add_done_callback(utils.raise_error_from_future)
 
+    @handled_slot(bool)
+    def resume_ple_scan(self, checked):
+        if self.ple_scan_worker and self.ple_scan_worker.running():
+            print('WARNING: A PLE scan is currently in progress.')
+            return
+        if self.live_feed_worker and self.live_feed_worker.running():
+            print('WARNING: The live feed is using the CCD. Reset PLE tasks to stop it before resuming a PLE scan.')
+            return
+
+        file_path, success = QFileDialog.getOpenFileName(caption='Select PLE Data', filter='PLE Data (*.npy)')
+        if success:
+            print('Resuming PLE scan.')
+            self.ple_scan_worker = self.work_executor.submit(self.ple.resume_ple_scan, file_path)
+            self.ple_scan_worker.add_done_callback(utils.raise_error_from_future)
+
     @handled_slot(bool)
     def analyze_ple_data(self, checked):
         if self.ple_analysis_worker and self.ple_analysis_worker.running():
@@ -498,6 +539,18 @@ class ControlApplication(QApplication):
             self.ple_analysis_worker = self.work_executor.submit(self.ple.analyze_ple_data, **analysis_options)
             self.ple_analysis_worker.add_done_callback(utils.raise_error_from_future)
 
+    @handled_slot(bool)
+    def batch_analyze_ple_data(self, checked):
+        if self.ple_analysis_worker and self.ple_analysis_worker.running():
+            print('WARNING: A PLE analysis is currently in progress.')
+            return
+
+        dialog = PLEAnalysisDialog(parent=self.window, batch=True)
+        if dialog.exec() == QDialog.Accepted:
+            analysis_options = dialog.get_form_data()
+            self.ple_analysis_worker = self.work_executor.submit(self.ple.batch_analyze_ple_data, **analysis_options)
+            self.ple_analysis_worker.add_done_callback(utils.raise_error_from_future)
+
     @handled_slot(bool)
     def view_existing_analysis(self, checked):
         if self.ple_analysis_worker and self.ple_analysis_worker.running():
@@ -523,6 +576,22 @@ class ControlApplication(QApplication):
                                                                        **acquisition_options)
             self.single_acquisition_worker.add_done_callback(utils.raise_error_from_future)
 
+    @handled_slot(bool)
+    def start_live_feed(self, checked):
+        if self.single_acquisition_worker and self.single_acquisition_worker.running():
+            print('WARNING: An acquisition is currently in progress.')
+            return
+        if self.ple_scan_worker and self.ple_scan_worker.running():
+            print('WARNING: A PLE scan is using the CCD. Wait for it to finish before starting the live feed.')
+            return
+
+        dialog = SingleAcquisitionDialog(parent=self.window, live_feed=True)
+        if dialog.exec() == QDialog.Accepted:
+            live_feed_options = dialog.get_form_data()
+            self.single_acquisition_worker = self.work_executor.submit(self.ple.start_live_feed, **live_feed_options)
+            self.single_acquisition_worker.add_done_callback(utils.raise_error_from_future)
+            self.live_feed_worker = self.single_acquisition_worker
+
     def run_matisse_task(self, function, *args, **kwargs) -> bool:
         """
         Run an asynchronous Matisse-related task in the worker thread pool. Only one such task may be run at a time.
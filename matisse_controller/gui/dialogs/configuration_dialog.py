@@ -5,6 +5,7 @@ import matisse_controller.config as cfg
 import matisse_controller.config.tooltips as tooltips
 import matisse_controller.matisse as matisse
 from matisse_controller.shamrock_ple.ccd import CCD
+from matisse_controller.shamrock_ple.utils import BACKENDS
 
 
 class ConfigurationDialog(QDialog):
@@ -81,6 +82,17 @@ class ConfigurationDialog(QDialog):
         general_layout.addRow('Thin etalon randomization range: ', self.thin_eta_rand_range_field)
         self.report_events_field = QCheckBox()
         general_layout.addRow('Report events? ', self.report_events_field)
+        self.event_report_flush_interval_field = QDoubleSpinBox()
+        self.event_report_flush_interval_field.setMinimum(0.1)
+        general_layout.addRow('Event report flush interval (s): ', self.event_report_flush_interval_field)
+        self.event_report_max_file_size_field = QDoubleSpinBox()
+        self.event_report_max_file_size_field.setMinimum(0.1)
+        self.event_report_max_file_size_field.setMaximum(1024)
+        general_layout.addRow('Event report max file size (MB): ', self.event_report_max_file_size_field)
+        self.state_polling_interval_field = QDoubleSpinBox()
+        self.state_polling_interval_field.setMinimum(0.05)
+        self.state_polling_interval_field.setSingleStep(0.05)
+        general_layout.addRow('State polling interval: ', self.state_polling_interval_field)
         return general_options
 
     def create_gui_options(self):
@@ -106,6 +118,13 @@ class ConfigurationDialog(QDialog):
         self.temperature_tolerance_field = QDoubleSpinBox()
         self.temperature_tolerance_field.setMinimum(3)
         ple_layout.addRow('CCD temperature tolerance: ', self.temperature_tolerance_field)
+        self.dark_frame_directory_field = QLineEdit()
+        ple_layout.addRow('Dark frame folder: ', self.dark_frame_directory_field)
+        self.calibration_directory_field = QLineEdit()
+        ple_layout.addRow('Calibration folder: ', self.calibration_directory_field)
+        self.ple_backend_field = QComboBox()
+        self.ple_backend_field.addItems(BACKENDS)
+        ple_layout.addRow('Hardware backend: ', self.ple_backend_field)
         return ple_options
 
     def create_scan_options(self):
@@ -266,6 +285,18 @@ class ConfigurationDialog(QDialog):
         self.stabilization_tolerance_field.setSingleStep(0.0001)
         self.stabilization_tolerance_field.setMinimum(0.0001)
         locking_layout.addRow('Auto-stabilization tolerance: ', self.stabilization_tolerance_field)
+        self.telemetry_full_rate_minutes_field = QSpinBox()
+        self.telemetry_full_rate_minutes_field.setMinimum(1)
+        self.telemetry_full_rate_minutes_field.setMaximum(24 * 60)
+        locking_layout.addRow('Full-rate telemetry duration (min): ', self.telemetry_full_rate_minutes_field)
+        self.telemetry_downsample_interval_field = QSpinBox()
+        self.telemetry_downsample_interval_field.setMinimum(1)
+        self.telemetry_downsample_interval_field.setMaximum(3600)
+        locking_layout.addRow('Telemetry downsample interval (s): ', self.telemetry_downsample_interval_field)
+        self.telemetry_downsampled_days_field = QSpinBox()
+        self.telemetry_downsampled_days_field.setMinimum(1)
+        self.telemetry_downsampled_days_field.setMaximum(365)
+        locking_layout.addRow('Downsampled telemetry duration (days): ', self.telemetry_downsampled_days_field)
         return locking_options
 
     def set_tooltips(self):
@@ -282,6 +313,9 @@ class ConfigurationDialog(QDialog):
         self.thin_eta_rand_range_field.setToolTip(tooltips.THIN_ETA_RAND_RANGE)
 
         self.report_events_field.setToolTip(tooltips.REPORT_EVENTS)
+        self.event_report_flush_interval_field.setToolTip(tooltips.EVENT_REPORT_FLUSH_INTERVAL)
+        self.event_report_max_file_size_field.setToolTip(tooltips.EVENT_REPORT_MAX_FILE_SIZE)
+        self.state_polling_interval_field.setToolTip(tooltips.STATE_POLLING_INTERVAL)
 
         self.component_limit_offset_field.setToolTip(tooltips.COMPONENT_LIMIT_OFFSET)
 
@@ -324,10 +358,17 @@ class ConfigurationDialog(QDialog):
         self.stabilization_delay_field.setToolTip(tooltips.STABILIZATION_DELAY)
         self.stabilization_tolerance_field.setToolTip(tooltips.STABILIZATION_TOLERANCE)
 
+        self.telemetry_full_rate_minutes_field.setToolTip(tooltips.TELEMETRY_FULL_RATE_MINUTES)
+        self.telemetry_downsample_interval_field.setToolTip(tooltips.TELEMETRY_DOWNSAMPLE_INTERVAL)
+        self.telemetry_downsampled_days_field.setToolTip(tooltips.TELEMETRY_DOWNSAMPLED_DAYS)
+
         self.auto_correction_limit_field.setToolTip(tooltips.CORRECTION_LIMIT)
 
         self.target_temperature_field.setToolTip(tooltips.PLE_TARGET_TEMPERATURE)
         self.temperature_tolerance_field.setToolTip(tooltips.PLE_TEMPERATURE_TOLERANCE)
+        self.dark_frame_directory_field.setToolTip(tooltips.PLE_DARK_FRAME_DIRECTORY)
+        self.calibration_directory_field.setToolTip(tooltips.PLE_CALIBRATION_DIRECTORY)
+        self.ple_backend_field.setToolTip(tooltips.PLE_BACKEND)
 
     def set_current_values_from_config(self):
         self.matisse_device_id_field.setText(cfg.get(cfg.MATISSE_DEVICE_ID))
@@ -346,6 +387,9 @@ class ConfigurationDialog(QDialog):
         self.thin_eta_rand_range_field.setValue(cfg.get(cfg.THIN_ETA_RAND_RANGE))
 
         self.report_events_field.setChecked(cfg.get(cfg.REPORT_EVENTS))
+        self.event_report_flush_interval_field.setValue(cfg.get(cfg.EVENT_REPORT_FLUSH_INTERVAL))
+        self.event_report_max_file_size_field.setValue(cfg.get(cfg.EVENT_REPORT_MAX_FILE_SIZE))
+        self.state_polling_interval_field.setValue(cfg.get(cfg.STATE_POLLING_INTERVAL))
 
         self.scan_limit_field.setValue(cfg.get(cfg.SCAN_LIMIT))
 
@@ -383,6 +427,10 @@ class ConfigurationDialog(QDialog):
         self.stabilization_delay_field.setValue(cfg.get(cfg.STABILIZATION_DELAY))
         self.stabilization_tolerance_field.setValue(cfg.get(cfg.STABILIZATION_TOLERANCE))
 
+        self.telemetry_full_rate_minutes_field.setValue(cfg.get(cfg.TELEMETRY_FULL_RATE_MINUTES))
+        self.telemetry_downsample_interval_field.setValue(cfg.get(cfg.TELEMETRY_DOWNSAMPLE_INTERVAL))
+        self.telemetry_downsampled_days_field.setValue(cfg.get(cfg.TELEMETRY_DOWNSAMPLED_DAYS))
+
         self.auto_correction_limit_field.setValue(cfg.get(cfg.CORRECTION_LIMIT))
 
         self.pz_eta_upper_correction_pos_field.setValue(cfg.get(cfg.PIEZO_ETA_UPPER_CORRECTION_POS))
@@ -397,6 +445,9 @@ class ConfigurationDialog(QDialog):
 
         self.target_temperature_field.setValue(cfg.get(cfg.PLE_TARGET_TEMPERATURE))
         self.temperature_tolerance_field.setValue(cfg.get(cfg.PLE_TEMPERATURE_TOLERANCE))
+        self.dark_frame_directory_field.setText(cfg.get(cfg.PLE_DARK_FRAME_DIRECTORY))
+        self.calibration_directory_field.setText(cfg.get(cfg.PLE_CALIBRATION_DIRECTORY))
+        self.ple_backend_field.setCurrentText(cfg.get(cfg.PLE_BACKEND))
 
     def add_buttons(self):
         button_box = QDialogButtonBox(QDialogButtonBox.RestoreDefaults | QDialogButtonBox.Save |
@@ -430,6 +481,9 @@ class ConfigurationDialog(QDialog):
         cfg.set(cfg.THIN_ETA_RAND_RANGE, self.thin_eta_rand_range_field.value())
 
         cfg.set(cfg.REPORT_EVENTS, self.report_events_field.isChecked())
+        cfg.set(cfg.EVENT_REPORT_FLUSH_INTERVAL, self.event_report_flush_interval_field.value())
+        cfg.set(cfg.EVENT_REPORT_MAX_FILE_SIZE, self.event_report_max_file_size_field.value())
+        cfg.set(cfg.STATE_POLLING_INTERVAL, self.state_polling_interval_field.value())
 
         cfg.set(cfg.SCAN_LIMIT, self.scan_limit_field.value())
 
@@ -467,6 +521,10 @@ class ConfigurationDialog(QDialog):
         cfg.set(cfg.STABILIZATION_DELAY, self.stabilization_delay_field.value())
         cfg.set(cfg.STABILIZATION_TOLERANCE, self.stabilization_tolerance_field.value())
 
+        cfg.set(cfg.TELEMETRY_FULL_RATE_MINUTES, self.telemetry_full_rate_minutes_field.value())
+        cfg.set(cfg.TELEMETRY_DOWNSAMPLE_INTERVAL, self.telemetry_downsample_interval_field.value())
+        cfg.set(cfg.TELEMETRY_DOWNSAMPLED_DAYS, self.telemetry_downsampled_days_field.value())
+
         cfg.set(cfg.CORRECTION_LIMIT, self.auto_correction_limit_field.value())
 
         cfg.set(cfg.PIEZO_ETA_UPPER_CORRECTION_POS, self.pz_eta_upper_correction_pos_field.value())
@@ -481,6 +539,9 @@ class ConfigurationDialog(QDialog):
 
         cfg.set(cfg.PLE_TARGET_TEMPERATURE, self.target_temperature_field.value())
         cfg.set(cfg.PLE_TEMPERATURE_TOLERANCE, self.temperature_tolerance_field.value())
+        cfg.set(cfg.PLE_DARK_FRAME_DIRECTORY, self.dark_frame_directory_field.text())
+        cfg.set(cfg.PLE_CALIBRATION_DIRECTORY, self.calibration_directory_field.text())
+        cfg.set(cfg.PLE_BACKEND, self.ple_backend_field.currentText())
 
         cfg.save()
         self.close()
@@ -2,16 +2,26 @@ import os
 
 from PyQt5.QtCore import pyqtSlot
 from PyQt5.QtWidgets import *
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from matplotlib.figure import Figure
 
 import matisse_controller.config as cfg
+from matisse_controller.shamrock_ple import dark_frames
+from matisse_controller.shamrock_ple.analysis import PrefixSumIndex
 
 
 class PLEAnalysisDialog(QDialog):
-    """A dialog for setting options needed to analyze a PLE scan."""
+    """
+    A dialog for setting options needed to analyze a PLE scan. Once a data file is selected, a preview of the integrated
+    counts is updated as the integration window changes.
 
-    def __init__(self, *args, **kwargs):
+    In batch mode, a folder of PLE scans is selected instead, for use with `PLE.batch_analyze_ple_data`.
+    """
+
+    def __init__(self, *args, batch=False, **kwargs):
         super().__init__(*args, **kwargs)
-        self.setWindowTitle('PLE Analysis Options')
+        self.batch = batch
+        self.setWindowTitle('Batch PLE Analysis Options' if batch else 'PLE Analysis Options')
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
         self.setup_form()
@@ -20,6 +30,8 @@ class PLEAnalysisDialog(QDialog):
         self.setMinimumWidth(300)
         self.data_file_path = None
         self.background_file_path = None
+        self.prefix_sum_index = None
+        self.background_data = None
 
     def setup_form(self):
         form_layout = QFormLayout()
@@ -32,7 +44,7 @@ class PLEAnalysisDialog(QDialog):
         self.data_file_label = QLabel()
         data_file_selection_layout.addWidget(self.data_file_button)
         data_file_selection_layout.addWidget(self.data_file_label)
-        form_layout.addRow('PLE Data: ', data_file_selection_layout)
+        form_layout.addRow('PLE Data Folder: ' if self.batch else 'PLE Data: ', data_file_selection_layout)
 
         self.integration_start_field = QDoubleSpinBox()
         self.integration_start_field.setMinimum(cfg.get(cfg.WAVELENGTH_LOWER_LIMIT))
@@ -56,9 +68,20 @@ class PLEAnalysisDialog(QDialog):
 
         self.layout.addLayout(form_layout)
 
+        self.preview_figure = Figure(figsize=(5, 3), tight_layout=True)
+        self.preview_canvas = FigureCanvasQTAgg(self.preview_figure)
+        self.preview_axes = self.preview_figure.add_subplot()
+        self.preview_axes.set_xlabel('Wavelength (nm)')
+        self.preview_axes.set_ylabel('Counts')
+        self.preview_line, = self.preview_axes.plot([], [])
+        self.layout.addWidget(self.preview_canvas)
+        self.preview_canvas.setVisible(not self.batch)
+
     def setup_slots(self):
         self.data_file_button.clicked.connect(self.select_data_file)
         self.bkgd_file_button.clicked.connect(self.select_background_file)
+        self.integration_start_field.valueChanged.connect(self.update_preview)
+        self.integration_end_field.valueChanged.connect(self.update_preview)
 
     def add_buttons(self):
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
@@ -70,7 +93,7 @@ class PLEAnalysisDialog(QDialog):
         return {
             # The keys here MUST match parameter names in the PLE class
             'analysis_name': self.analysis_name_field.text(),
-            'data_file_path': self.data_file_path,
+            'data_path' if self.batch else 'data_file_path': self.data_file_path,
             'integration_start': self.integration_start_field.value(),
             'integration_end': self.integration_end_field.value(),
             'background_file_path': self.background_file_path
@@ -78,14 +101,47 @@ class PLEAnalysisDialog(QDialog):
 
     @pyqtSlot(bool)
     def select_data_file(self, checked):
+        if self.batch:
+            self.data_file_path = QFileDialog.getExistingDirectory(caption='Select PLE Data Folder')
+            self.data_file_label.setText(os.path.basename(self.data_file_path))
+            return
         self.data_file_path = QFileDialog.getOpenFileName(caption='Select Data File',
-                                                          filter='Pickled Data (*.pickle)')[0]
+                                                          filter='PLE Data (*.npy);;Pickled Data (*.pickle)')[0]
         self.data_file_label.setText(os.path.basename(self.data_file_path))
+        self.prefix_sum_index = None
+        if self.data_file_path:
+            try:
+                self.prefix_sum_index = PrefixSumIndex.load(self.data_file_path)
+            except Exception as err:
+                print(f"WARNING: Unable to load PLE data for preview. {err}")
+        self.update_preview()
 
     @pyqtSlot(bool)
     def select_background_file(self, checked):
         self.background_file_path = QFileDialog.getOpenFileName(caption='Select Background File')[0]
         self.bkgd_file_label.setText(os.path.basename(self.background_file_path))
+        self.background_data = None
+        if self.background_file_path:
+            try:
+                self.background_data = dark_frames.load_background(self.background_file_path)
+            except Exception as err:
+                print(f"WARNING: Unable to load background data for preview. {err}")
+        self.update_preview()
+
+    @pyqtSlot(float)
+    def update_preview(self, value=None):
+        """Plot the integrated counts for the current integration window, using the prefix sum index of the data."""
+        if self.prefix_sum_index is None:
+            self.preview_line.set_data([], [])
+        else:
+            spectral_axis = self.prefix_sum_index.spectral_axis()
+            window = spectral_axis.integration_window(self.integration_start_field.value(),
+                                                      self.integration_end_field.value())
+            results = self.prefix_sum_index.integrate([window], self.background_data)
+            self.preview_line.set_data(results['wavelength'], results['counts'][:, 0])
+        self.preview_axes.relim()
+        self.preview_axes.autoscale_view()
+        self.preview_canvas.draw_idle()
 
 
 def main():
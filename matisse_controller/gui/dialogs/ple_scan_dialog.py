@@ -91,9 +91,42 @@ class PLEScanDialog(QDialog):
         self.integration_end_field.setEnabled(False)
         form_layout.addRow('Integration end (nm): ', self.integration_end_field)
 
+        self.fine_scan_field = QCheckBox()
+        self.fine_scan_field.setToolTip('Keep the laser locked, and step between nearby wavelengths by moving the\n'
+                                        'RefCell alone. The laser is fully retuned whenever the wavelength moves\n'
+                                        'further than the small wavelength drift, or the RefCell reaches a limit.')
+        form_layout.addRow('Fine scan with RefCell only? ', self.fine_scan_field)
+
+        self.adaptive_field = QCheckBox()
+        self.adaptive_field.setToolTip('After the first pass, add wavelengths wherever the integrated counts change\n'
+                                       'quickly or exceed the threshold, until the resolution is reached.')
+        form_layout.addRow('Refine around resonances? ', self.adaptive_field)
+        self.adaptive_resolution_field = QDoubleSpinBox()
+        self.adaptive_resolution_field.setMinimum(10 ** -cfg.get(cfg.WAVEMETER_PRECISION))
+        self.adaptive_resolution_field.setDecimals(cfg.get(cfg.WAVEMETER_PRECISION))
+        self.adaptive_resolution_field.setSingleStep(10 ** -cfg.get(cfg.WAVEMETER_PRECISION))
+        self.adaptive_resolution_field.setEnabled(False)
+        form_layout.addRow('Refinement resolution (nm): ', self.adaptive_resolution_field)
+        self.adaptive_change_fraction_field = QDoubleSpinBox()
+        self.adaptive_change_fraction_field.setRange(0, 1)
+        self.adaptive_change_fraction_field.setSingleStep(0.05)
+        self.adaptive_change_fraction_field.setValue(0.1)
+        self.adaptive_change_fraction_field.setToolTip('Refine wherever the counts change by more than this fraction\n'
+                                                       'of their full range between neighboring wavelengths.')
+        self.adaptive_change_fraction_field.setEnabled(False)
+        form_layout.addRow('Refinement change fraction: ', self.adaptive_change_fraction_field)
+        self.adaptive_threshold_field = QDoubleSpinBox()
+        self.adaptive_threshold_field.setRange(0, 1e12)
+        self.adaptive_threshold_field.setDecimals(0)
+        self.adaptive_threshold_field.setToolTip('Refine wherever the counts exceed this value. Set to 0 to disable.')
+        self.adaptive_threshold_field.setEnabled(False)
+        form_layout.addRow('Refinement threshold (counts): ', self.adaptive_threshold_field)
+
     def setup_slots(self):
         self.scan_location_button.clicked.connect(self.select_scan_location)
         self.plot_analysis_field.stateChanged.connect(self.toggle_integration_fields)
+        self.adaptive_field.stateChanged.connect(self.toggle_integration_fields)
+        self.adaptive_field.stateChanged.connect(self.toggle_adaptive_fields)
 
     def add_buttons(self):
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
@@ -114,7 +147,12 @@ class PLEScanDialog(QDialog):
             'grating_grooves': int(self.grating_grooves_field.currentText()),
             'plot_analysis': self.plot_analysis_field.isChecked(),
             'integration_start': self.integration_start_field.value(),
-            'integration_end': self.integration_end_field.value()
+            'integration_end': self.integration_end_field.value(),
+            'adaptive': self.adaptive_field.isChecked(),
+            'adaptive_resolution': self.adaptive_resolution_field.value(),
+            'adaptive_change_fraction': self.adaptive_change_fraction_field.value(),
+            'adaptive_threshold': self.adaptive_threshold_field.value() or None,
+            'fine_scan': self.fine_scan_field.isChecked()
         }
 
     @pyqtSlot(bool)
@@ -125,8 +163,16 @@ class PLEScanDialog(QDialog):
 
     @pyqtSlot(int)
     def toggle_integration_fields(self, state):
-        self.integration_start_field.setEnabled(state == Qt.Checked)
-        self.integration_end_field.setEnabled(state == Qt.Checked)
+        # Adaptive scans also need to integrate each spectrum as it is acquired
+        enabled = self.plot_analysis_field.isChecked() or self.adaptive_field.isChecked()
+        self.integration_start_field.setEnabled(enabled)
+        self.integration_end_field.setEnabled(enabled)
+
+    @pyqtSlot(int)
+    def toggle_adaptive_fields(self, state):
+        self.adaptive_resolution_field.setEnabled(state == Qt.Checked)
+        self.adaptive_change_fraction_field.setEnabled(state == Qt.Checked)
+        self.adaptive_threshold_field.setEnabled(state == Qt.Checked)
 
 
 def main():
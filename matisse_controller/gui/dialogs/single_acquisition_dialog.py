@@ -8,11 +8,12 @@ import matisse_controller.shamrock_ple.ple as ple
 
 
 class SingleAcquisitionDialog(QDialog):
-    """A dialog for setting options needed to perform a single CCD acquisition."""
+    """A dialog for setting options needed to perform a single CCD acquisition, or to start a live feed."""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, live_feed=False, **kwargs):
         super().__init__(*args, **kwargs)
-        self.setWindowTitle('Single Acquisition Parameters')
+        self.live_feed = live_feed
+        self.setWindowTitle('Live Feed Parameters' if live_feed else 'Single Acquisition Parameters')
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
         self.setup_form()
@@ -23,17 +24,19 @@ class SingleAcquisitionDialog(QDialog):
 
     def setup_form(self):
         form_layout = QFormLayout()
-        data_file_selection_layout = QHBoxLayout()
-        self.data_file_button = QPushButton('Select File')
-        self.data_file_label = QLabel()
-        data_file_selection_layout.addWidget(self.data_file_button)
-        data_file_selection_layout.addWidget(self.data_file_label)
-        form_layout.addRow('Existing Data: ', data_file_selection_layout)
-
-        line = QFrame()
-        line.setFrameShape(QFrame.HLine)
-        line.setFrameShadow(QFrame.Sunken)
-        form_layout.addRow(line)
+        # A live feed always reads from the CCD
+        if not self.live_feed:
+            data_file_selection_layout = QHBoxLayout()
+            self.data_file_button = QPushButton('Select File')
+            self.data_file_label = QLabel()
+            data_file_selection_layout.addWidget(self.data_file_button)
+            data_file_selection_layout.addWidget(self.data_file_label)
+            form_layout.addRow('Existing Data: ', data_file_selection_layout)
+
+            line = QFrame()
+            line.setFrameShape(QFrame.HLine)
+            line.setFrameShadow(QFrame.Sunken)
+            form_layout.addRow(line)
 
         self.exposure_time_field = QDoubleSpinBox()
         self.exposure_time_field.setMinimum(0)
@@ -57,7 +60,8 @@ class SingleAcquisitionDialog(QDialog):
         form_layout.addRow('Grating grooves: ', self.grating_grooves_field)
 
     def setup_slots(self):
-        self.data_file_button.clicked.connect(self.select_data_file)
+        if not self.live_feed:
+            self.data_file_button.clicked.connect(self.select_data_file)
 
     def add_buttons(self):
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
@@ -66,19 +70,21 @@ class SingleAcquisitionDialog(QDialog):
         self.layout.addWidget(button_box)
 
     def get_form_data(self):
-        return {
+        form_data = {
             # The keys here MUST match parameter names in the PLE class
             'exposure_time': self.exposure_time_field.value(),
             'center_wavelength': self.center_wavelength_field.value(),
             'grating_grooves': int(self.grating_grooves_field.currentText()),
-            'data_file': self.data_file_path,
             'cool_down': False
         }
+        if not self.live_feed:
+            form_data['data_file'] = self.data_file_path
+        return form_data
 
     @pyqtSlot(bool)
     def select_data_file(self, checked):
         self.data_file_path, success = QFileDialog.getOpenFileName(caption='Select Data File',
-                                                          filter='Text file (*.txt)')
+                                                          filter='Text file (*.txt);;PLE Data (*.npy)')
         self.data_file_label.setText(os.path.basename(self.data_file_path))
 
 
@@ -5,14 +5,16 @@ from PyQt5.QtCore import QThread, pyqtSignal
 
 import matisse_controller.config as cfg
 import matisse_controller.matisse as matisse
+import matisse_controller.shamrock_ple.ple as ple
 from matisse_controller.gui.threads import ExitFlag
 from matisse_controller.gui.utils import red_text, orange_text, green_text
 
 
 class StatusUpdateThread(QThread):
     """
-    A QThread that periodically reads several pieces of state data and emits all of it in one HTML-formatted string.
-    The interval between successive updates is specified by a configuration option.
+    A QThread that periodically takes the latest snapshot from the Matisse state poller and emits all of it in one
+    HTML-formatted string, along with the CCD temperature once the CCD is initialized. The interval between successive
+    updates is specified by a configuration option.
 
     Some messages are colored, like for components that are at or nearing their limits.
 
@@ -20,6 +22,9 @@ class StatusUpdateThread(QThread):
     """
     status_read = pyqtSignal(str)
 
+    # Extra time to wait for a snapshot from the Matisse state poller before giving up, in seconds
+    STATE_TIMEOUT = 5
+
     def __init__(self, matisse, messages: Queue, *args, **kwargs):
         """
         Parameters
@@ -37,16 +42,20 @@ class StatusUpdateThread(QThread):
         self.messages = messages
 
     def run(self):
+        snapshots = None
         while True:
             if self.messages.qsize() == 0:
                 try:
-                    bifi_pos = self.matisse.query('MOTBI:POS?', numeric_result=True)
-                    thin_eta_pos = self.matisse.query('MOTTE:POS?', numeric_result=True)
-                    refcell_pos, pz_eta_pos, slow_pz_pos = self.matisse.get_stabilizing_piezo_positions()
-                    is_stabilizing = self.matisse.is_stabilizing()
-                    is_scanning = self.matisse.is_scanning()
-                    is_locked = self.matisse.laser_locked()
-                    wavemeter_value = self.matisse.wavemeter_raw_value()
+                    if snapshots is None:
+                        snapshots = self.matisse.state_poller.subscribe()
+                    state = snapshots.get(timeout=cfg.get(cfg.STATUS_MONITOR_DELAY) + StatusUpdateThread.STATE_TIMEOUT)
+                    bifi_pos = state.bifi_pos
+                    thin_eta_pos = state.thin_etalon_pos
+                    refcell_pos, pz_eta_pos, slow_pz_pos = state.stabilizing_piezo_positions
+                    is_stabilizing = state.is_stabilizing
+                    is_scanning = state.is_scanning
+                    is_locked = state.laser_locked
+                    wavemeter_value = state.wavemeter_raw_value
 
                     bifi_pos_text = f"BiFi:{bifi_pos}"
                     thin_eta_pos_text = f"Thin Eta:{thin_eta_pos}"
@@ -83,12 +92,19 @@ class StatusUpdateThread(QThread):
                         pz_eta_pos_text = orange_text(pz_eta_pos_text)
 
                     status = f"{bifi_pos_text} | {thin_eta_pos_text} | {pz_eta_pos_text} | {slow_pz_pos_text} | {refcell_pos_text} | {stabilizing_text} | {scanning_text} | {locked_text} | {wavemeter_text}"
+
+                    ccd = ple.ccd
+                    if ccd is not None and ccd.cooling is not None and ccd.cooling.latest_reading is not None:
+                        ccd_temperature_text = f"CCD:{ccd.cooling.latest_reading[1]:.1f} °C"
+                        status += f" | {green_text(ccd_temperature_text) if ccd.temperature_ok else orange_text(ccd_temperature_text)}"
                 except Exception:
                     status = red_text('Error reading system status. Please restart if this issue persists.')
                 self.status_read.emit(status)
                 time.sleep(cfg.get(cfg.STATUS_MONITOR_DELAY))
             else:
                 break
+        if snapshots is not None:
+            self.matisse.state_poller.unsubscribe(snapshots)
 
     def stop(self):
         self.messages.put(ExitFlag())
@@ -1,14 +1,31 @@
-"""A module providing functions to report wavelength drift and other important events to a CSV file."""
+"""
+A module providing functions to report wavelength drift and other important events to a CSV file.
+
+Events are written asynchronously by an `EventReportWriter`, so that reporting an event never blocks the control loops
+that produce them. Each event is also added to an indexed `matisse_controller.matisse.event_store.EventStore`, which is
+much faster to query than the CSV report.
+"""
 
 import csv
-import os.path
+import os
+import queue
+import threading
+import time
 from datetime import datetime
 from enum import Enum
+from queue import Queue
+
+import matisse_controller.config as cfg
+from matisse_controller.matisse import event_store
+from matisse_controller.matisse.event_store import EventStore
 
 FILE_NAME = 'matisse_event_report.csv'
 FIELDS = ['timestamp', 'event_type', 'current_wavelength', 'bifi_pos', 'thin_etalon_pos', 'refcell_pos',
           'piezo_etalon_pos', 'slow_piezo_pos', 'is_stabilizing', 'is_locked', 'other_comments']
 
+_writer = None
+_writer_lock = threading.Lock()
+
 
 class EventType(Enum):
     """An enumeration of different event types. The assigned value goes in each row of the CSV report."""
@@ -16,12 +33,126 @@ class EventType(Enum):
     LOCK_CORRECTION = 'lock_correction'
     STABILIZATION_CORRECTION = 'stabilization_correction'
     STABILIZATION_LIMIT_EXCEEDED = 'stabilization_correction_limit_exceeded'
+    LARGE_DRIFT_CORRECTION = 'large_drift_correction'
     WAVELENGTH_DRIFT = 'wavelength_drift'
 
 
-def log_event(event_type: EventType, matisse, current_wavelength: float, other_comments=''):
+class EventReportWriter(threading.Thread):
     """
-    Write an event to the Matisse event report CSV file.
+    A thread that appends event rows to the CSV report and the event store in batches. Rows are accepted through a
+    bounded queue, and are written whenever enough of them have accumulated or the flush interval has passed. Once the
+    CSV report grows past a maximum size, it is rotated to a numbered backup file and a new report is started.
+    """
+
+    MAX_QUEUE_SIZE = 1000
+    BATCH_SIZE = 50
+    NUM_BACKUPS = 5
+
+    def __init__(self, file_name: str, store_file_name: str, flush_interval: float, max_file_size: int,
+                 messages: Queue, *args, **kwargs):
+        """
+        Parameters
+        ----------
+        file_name : str
+            the name of the CSV file to write
+        store_file_name : str
+            the name of the event store database to write
+        flush_interval : float
+            the maximum time, in seconds, that an event can wait in the queue before being written
+        max_file_size : int
+            the size, in bytes, past which the report is rotated
+        messages
+            a message queue
+        *args
+            args to pass to `Thread.__init__`
+        **kwargs
+            kwargs to pass to `Thread.__init__`
+        """
+        super().__init__(*args, **kwargs)
+        self.file_name = file_name
+        self.store_file_name = store_file_name
+        self.store = None
+        self.flush_interval = flush_interval
+        self.max_file_size = max_file_size
+        self.messages = messages
+        self.rows = Queue(maxsize=EventReportWriter.MAX_QUEUE_SIZE)
+        self.num_dropped = 0
+
+    def run(self):
+        # SQLite connections can only be used by the thread that created them
+        try:
+            self.store = EventStore(self.store_file_name)
+        except Exception as err:
+            print(f"WARNING: Unable to open event store {self.store_file_name}. {err}")
+        batch = []
+        last_flush = time.time()
+        while self.messages.qsize() == 0:
+            try:
+                batch.append(self.rows.get(timeout=max(last_flush + self.flush_interval - time.time(), 0.01)))
+            except queue.Empty:
+                pass
+            if len(batch) >= EventReportWriter.BATCH_SIZE or time.time() >= last_flush + self.flush_interval:
+                self.write(batch)
+                batch = []
+                last_flush = time.time()
+
+        # Write anything that arrived before we were told to stop
+        while True:
+            try:
+                batch.append(self.rows.get_nowait())
+            except queue.Empty:
+                break
+        self.write(batch)
+        if self.store:
+            self.store.close()
+
+    def submit(self, row: dict):
+        """Queue a row to be written. If the queue is full, the row is dropped with a warning."""
+        try:
+            self.rows.put_nowait(row)
+        except queue.Full:
+            self.num_dropped += 1
+            print(f"WARNING: Event report queue is full, dropped {self.num_dropped} event(s) so far.")
+
+    def write(self, batch: list):
+        if not batch:
+            return
+        try:
+            if os.path.exists(self.file_name) and os.path.getsize(self.file_name) >= self.max_file_size:
+                self.rotate()
+            with open(self.file_name, 'a', newline='') as csv_file:
+                writer = csv.DictWriter(csv_file, FIELDS)
+                if csv_file.tell() == 0:
+                    writer.writeheader()
+                writer.writerows({**row, 'timestamp': datetime.fromtimestamp(row['timestamp']).strftime(
+                    event_store.CSV_TIMESTAMP_FORMAT)} for row in batch)
+        except OSError as err:
+            print(f"WARNING: Unable to write {len(batch)} event(s) to {self.file_name}. {err}")
+        if self.store:
+            try:
+                self.store.insert(batch)
+            except Exception as err:
+                print(f"WARNING: Unable to add {len(batch)} event(s) to {self.store_file_name}. {err}")
+
+    def rotate(self):
+        """Shift the report and its backups along by one, discarding the oldest backup."""
+        base_name, extension = os.path.splitext(self.file_name)
+        for index in range(EventReportWriter.NUM_BACKUPS - 1, 0, -1):
+            backup_name = f"{base_name}.{index}{extension}"
+            if os.path.exists(backup_name):
+                os.replace(backup_name, f"{base_name}.{index + 1}{extension}")
+        os.replace(self.file_name, f"{base_name}.1{extension}")
+
+    def stop(self):
+        """Write any queued events and wait for the thread to exit."""
+        self.messages.put('stop')
+        self.join()
+
+
+def log_event(event_type: EventType, matisse, current_wavelength: float, other_comments='', state=None):
+    """
+    Queue an event to be written to the Matisse event report CSV file. The positions of Matisse components are taken
+    from a recent state snapshot, rather than queried again.
 
     Parameters
     ----------
@@ -32,25 +163,46 @@ def log_event(event_type: EventType, matisse, current_wavelength: float, other_c
         the wavelength at which this event occurred
     other_comments : str
         additional information to include with the event
+    state : matisse_controller.matisse.state_poller.MatisseState
+        the snapshot to take component positions from, defaults to the most recent one
+    """
+    if state is None:
+        state = matisse.latest_state()
+    get_writer().submit({
+        'timestamp': time.time(),
+        'event_type': event_type.value,
+        'current_wavelength': current_wavelength,
+        'bifi_pos': state.bifi_pos,
+        'thin_etalon_pos': state.thin_etalon_pos,
+        'refcell_pos': state.refcell_pos,
+        'piezo_etalon_pos': state.piezo_etalon_pos,
+        'slow_piezo_pos': state.slow_piezo_pos,
+        'is_stabilizing': matisse.is_stabilizing(),
+        'is_locked': state.laser_locked,
+        'other_comments': other_comments
+    })
+
+
+def get_writer() -> EventReportWriter:
+    """
+    Returns
+    -------
+    EventReportWriter
+        the writer for the event report, which is started the first time it is needed
     """
-    with open(FILE_NAME, 'a', newline='') as csv_file:
-        writer = csv.DictWriter(csv_file, FIELDS)
-        if os.path.getsize(FILE_NAME) == 0:
-            writer.writeheader()
-        bifi_pos = matisse.query('MOTBI:POS?', numeric_result=True)
-        thin_eta_pos = matisse.query('MOTTE:POS?', numeric_result=True)
-        refcell_pos, pz_eta_pos, slow_pz_pos = matisse.get_stabilizing_piezo_positions()
-        event_details = {
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'event_type': event_type.value,
-            'current_wavelength': current_wavelength,
-            'bifi_pos': bifi_pos,
-            'thin_etalon_pos': thin_eta_pos,
-            'refcell_pos': refcell_pos,
-            'piezo_etalon_pos': pz_eta_pos,
-            'slow_piezo_pos': slow_pz_pos,
-            'is_stabilizing': matisse.is_stabilizing(),
-            'is_locked': matisse.laser_locked(),
-            'other_comments': other_comments
-        }
-        writer.writerow(event_details)
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = EventReportWriter(FILE_NAME, event_store.FILE_NAME, cfg.get(cfg.EVENT_REPORT_FLUSH_INTERVAL),
+                                        int(cfg.get(cfg.EVENT_REPORT_MAX_FILE_SIZE) * 1024 ** 2), Queue(), daemon=True)
+            _writer.start()
+        return _writer
+
+
+def close():
+    """Write any queued events and stop the event report writer, if it is running."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None and _writer.is_alive():
+            _writer.stop()
+        _writer = None
@@ -0,0 +1,194 @@
+"""
+Provides an indexed SQLite store for reported events, which can be queried without loading the whole event history.
+"""
+
+import csv
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+
+FILE_NAME = 'matisse_event_report.sqlite3'
+
+# Columns of the events table, in the same order as event_report.FIELDS
+COLUMNS = [('timestamp', 'REAL NOT NULL'), ('event_type', 'TEXT NOT NULL'), ('current_wavelength', 'REAL'),
+           ('bifi_pos', 'REAL'), ('thin_etalon_pos', 'REAL'), ('refcell_pos', 'REAL'), ('piezo_etalon_pos', 'REAL'),
+           ('slow_piezo_pos', 'REAL'), ('is_stabilizing', 'INTEGER'), ('is_locked', 'INTEGER'),
+           ('other_comments', 'TEXT')]
+COLUMN_NAMES = [name for name, _ in COLUMNS]
+
+EVENT_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('event_type', 'U64'),
+    ('current_wavelength', np.float64),
+    ('bifi_pos', np.float64),
+    ('thin_etalon_pos', np.float64),
+    ('refcell_pos', np.float64),
+    ('piezo_etalon_pos', np.float64),
+    ('slow_piezo_pos', np.float64),
+    ('is_stabilizing', np.bool_),
+    ('is_locked', np.bool_),
+    ('other_comments', object)
+])
+
+CSV_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class EventStore:
+    """
+    An SQLite database of reported events, indexed on timestamp, event type, and wavelength.
+
+    Timestamps are stored in seconds since the epoch. An `EventStore` may only be used on the thread that created it.
+    """
+
+    def __init__(self, file_name: str = FILE_NAME):
+        """
+        Parameters
+        ----------
+        file_name : str
+            the database file to open, which is created if it doesn't exist
+        """
+        self.connection = sqlite3.connect(file_name)
+        columns = ', '.join(f"{name} {column_type}" for name, column_type in COLUMNS)
+        with self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS events ({columns})")
+            self.connection.execute('CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS events_type_timestamp ON events (event_type, timestamp)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS events_wavelength ON events (current_wavelength)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def insert(self, rows: list):
+        """
+        Add events to the store in a single transaction.
+
+        Parameters
+        ----------
+        rows : list of dict
+            events keyed by column name, as built by `matisse_controller.matisse.event_report.log_event`. Timestamps may
+            be seconds since the epoch, datetime objects, or strings in the CSV report format.
+        """
+        values = [tuple(EventStore._to_column_value(name, row.get(name)) for name in COLUMN_NAMES) for row in rows]
+        placeholders = ', '.join('?' * len(COLUMN_NAMES))
+        with self.connection:
+            self.connection.executemany(f"INSERT INTO events ({', '.join(COLUMN_NAMES)}) VALUES ({placeholders})",
+                                        values)
+
+    def query(self, start: float = None, end: float = None, event_types=None, wavelength_range=None) -> np.ndarray:
+        """
+        Fetch events matching all of the given conditions.
+
+        Parameters
+        ----------
+        start : float
+            the earliest timestamp to include, in seconds since the epoch
+        end : float
+            the latest timestamp to include, in seconds since the epoch
+        event_types
+            an iterable of `matisse_controller.matisse.event_report.EventType` (or their values) to include
+        wavelength_range : (float, float)
+            the lowest and highest wavelengths to include
+
+        Returns
+        -------
+        ndarray
+            a structured array with dtype `EVENT_DTYPE`, ordered by timestamp. Missing values are NaN.
+        """
+        where, parameters = EventStore._conditions(start, end, event_types, wavelength_range)
+        rows = self.connection.execute(f"SELECT {', '.join(COLUMN_NAMES)} FROM events {where} ORDER BY timestamp",
+                                       parameters).fetchall()
+        events = np.empty(len(rows), dtype=EVENT_DTYPE)
+        if rows:
+            columns = list(zip(*rows))
+            for name, column in zip(COLUMN_NAMES, columns):
+                if EVENT_DTYPE[name] == np.float64:
+                    events[name] = np.array(column, dtype=np.float64)  # None becomes NaN
+                elif EVENT_DTYPE[name] == np.bool_:
+                    events[name] = [bool(value) for value in column]
+                else:
+                    events[name] = column
+        return events
+
+    def count(self, interval: float, start: float = None, end: float = None, event_types=None, wavelength_range=None):
+        """
+        Count the events matching the given conditions (see `EventStore.query`) in consecutive time intervals, for
+        example the number of stabilization corrections per hour near a certain wavelength.
+
+        Parameters
+        ----------
+        interval : float
+            the length of each interval, in seconds
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            the start time of each interval that contains at least one event, and the number of events in it
+        """
+        where, parameters = EventStore._conditions(start, end, event_types, wavelength_range)
+        rows = self.connection.execute(f"SELECT CAST(timestamp / ? AS INTEGER) AS bucket, COUNT(*) FROM events {where} "
+                                       'GROUP BY bucket ORDER BY bucket', [interval] + parameters).fetchall()
+        buckets = np.array([bucket for bucket, _ in rows], dtype=np.float64)
+        return buckets * interval, np.array([num_events for _, num_events in rows], dtype=np.int64)
+
+    def import_csv(self, file_name: str) -> int:
+        """
+        Copy every event from a CSV event report into the store. Only do this once per report, otherwise the events
+        will be duplicated.
+
+        Parameters
+        ----------
+        file_name : str
+            the name of the CSV report to import
+
+        Returns
+        -------
+        int
+            the number of events imported
+        """
+        with open(file_name, newline='') as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        self.insert(rows)
+        return len(rows)
+
+    @staticmethod
+    def _conditions(start, end, event_types, wavelength_range):
+        clauses = []
+        parameters = []
+        if start is not None:
+            clauses.append('timestamp >= ?')
+            parameters.append(start)
+        if end is not None:
+            clauses.append('timestamp <= ?')
+            parameters.append(end)
+        if event_types is not None:
+            event_types = [getattr(event_type, 'value', event_type) for event_type in event_types]
+            clauses.append(f"event_type IN ({', '.join('?' * len(event_types))})")
+            parameters.extend(event_types)
+        if wavelength_range is not None:
+            clauses.append('current_wavelength BETWEEN ? AND ?')
+            parameters.extend(wavelength_range)
+        return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', parameters
+
+    @staticmethod
+    def _to_column_value(name, value):
+        if value is None or value == '':
+            return None
+        if name == 'timestamp':
+            if isinstance(value, datetime):
+                return value.timestamp()
+            if isinstance(value, str):
+                return datetime.strptime(value, CSV_TIMESTAMP_FORMAT).timestamp()
+            return float(value)
+        if name in ('event_type', 'other_comments'):
+            return str(value)
+        if name in ('is_stabilizing', 'is_locked'):
+            return int(value == 'True') if isinstance(value, str) else int(bool(value))
+        value = float(value)
+        return None if np.isnan(value) else value
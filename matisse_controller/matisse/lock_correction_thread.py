@@ -1,17 +1,100 @@
 import threading
 import time
+from collections import deque
+from enum import Enum
 from queue import Queue
 
+import numpy as np
+
 import matisse_controller.config as cfg
 from matisse_controller.matisse.control_loops_on import ControlLoopsOn
 from matisse_controller.matisse.event_report import log_event, EventType
 
 
+class LockState(Enum):
+    UNLOCKED = 'unlocked'
+    ACQUIRING = 'acquiring'
+    LOCKED = 'locked'
+    CORRECTING = 'correcting'
+    FAILED = 'failed'
+
+
+class LockMetrics:
+    """
+    A record of timestamped lock state transitions, kept across lock correction threads. Used to measure how long it
+    takes to obtain a lock and how often automatic corrections are needed.
+    """
+
+    MAX_TRANSITIONS = 10_000
+
+    def __init__(self):
+        self.transitions = deque(maxlen=LockMetrics.MAX_TRANSITIONS)
+        self.lock = threading.Lock()
+
+    def record_transition(self, old_state: LockState, new_state: LockState, timestamp: float):
+        with self.lock:
+            self.transitions.append((timestamp, old_state, new_state))
+
+    def times_to_lock(self) -> np.ndarray:
+        """
+        Returns
+        -------
+        ndarray
+            the number of seconds between starting to acquire a lock and obtaining it, for each lock obtained
+        """
+        with self.lock:
+            transitions = list(self.transitions)
+        durations = []
+        acquiring_since = None
+        for timestamp, old_state, new_state in transitions:
+            if new_state == LockState.ACQUIRING:
+                acquiring_since = timestamp
+            elif new_state == LockState.LOCKED and old_state == LockState.ACQUIRING and acquiring_since is not None:
+                durations.append(timestamp - acquiring_since)
+                acquiring_since = None
+        return np.array(durations)
+
+    def correction_times(self) -> np.ndarray:
+        """
+        Returns
+        -------
+        ndarray
+            the timestamps of every automatic correction made while the laser was locked
+        """
+        with self.lock:
+            return np.array([timestamp for timestamp, _, new_state in self.transitions
+                             if new_state == LockState.CORRECTING])
+
+    def corrections_per_hour(self, window: float = 3600) -> float:
+        """
+        Parameters
+        ----------
+        window : float
+            how far back to look, in seconds
+
+        Returns
+        -------
+        float
+            the rate of automatic corrections within the given window
+        """
+        corrections = self.correction_times()
+        return np.count_nonzero(corrections >= time.time() - window) * 3600 / window
+
+
 class LockCorrectionThread(threading.Thread):
     """
-    A thread that runs while the fast piezo attempts to obtain a lock. Exits if the laser cannot lock within a certain
-    timeout, or if a component reaches its limit while trying to lock. If the laser locks within the timeout, but a
-    component has reached its limit, it makes an automatic correction to the slow piezo, piezo etalon, and RefCell.
+    A thread that runs while the fast piezo attempts to obtain a lock. It is a state machine driven by the snapshots
+    published by the Matisse state poller:
+
+    - ACQUIRING: waiting for the fast piezo to lock. Moves to FAILED if the laser cannot lock within a certain timeout,
+      or if a component reaches its limit while trying to lock.
+    - LOCKED: if a component has reached its limit, moves to CORRECTING. If the lock is lost, moves back to ACQUIRING.
+    - CORRECTING: an automatic correction is made to the slow piezo, piezo etalon, and RefCell. The next snapshot taken
+      after the correction decides whether the laser is still locked.
+    - FAILED: the thread exits.
+    - UNLOCKED: the thread has not started, or was stopped.
+
+    Every transition is timestamped and recorded in `matisse_controller.matisse.matisse.Matisse.lock_metrics`.
     """
 
     UNABLE_TO_LOCK_MESSAGE = 'Try manually stabilizing the laser output power. Alternatively, try setting the ' \
@@ -35,43 +118,69 @@ class LockCorrectionThread(threading.Thread):
         self.matisse = matisse
         self.messages = messages
         self.timeout = timeout
-        self.timer = threading.Timer(self.timeout, self.quit_unless_locked)
+        self.state = LockState.UNLOCKED
+        self.acquiring_since = None
 
     def run(self):
         with ControlLoopsOn(self.matisse):
-            self.timer.start()
-            while True:
-                if self.messages.qsize() == 0:
-                    if self.matisse.fast_piezo_locked():
-                        self.timer.cancel()
-                        if self.matisse.is_any_limit_reached():
-                            print('WARNING: A component has hit a limit while the laser is locked. '
-                                  'Attempting automatic corrections.')
-                            if cfg.get(cfg.REPORT_EVENTS):
-                                current_wavelength = self.matisse.wavemeter_wavelength()
-                                log_event(EventType.LOCK_CORRECTION, self.matisse, current_wavelength,
-                                          'component hit a limit while laser was locked')
-                            self.matisse.reset_stabilization_piezos()
-                    else:
-                        self.restart_timer()
-                        if self.matisse.is_any_limit_reached():
-                            print('WARNING: A component has hit a limit before the laser could lock. '
-                                  'Stopping control loops. ' + LockCorrectionThread.UNABLE_TO_LOCK_MESSAGE)
-                            self.timer.cancel()
-                            break
-
-                    time.sleep(1)
-                else:
-                    self.timer.cancel()
-                    break
-
-    def quit_unless_locked(self):
-        if not self.matisse.fast_piezo_locked():
-            print('WARNING: Locking failed. Timeout expired while trying to obtain lock. ' +
-                  LockCorrectionThread.UNABLE_TO_LOCK_MESSAGE)
-            self.messages.put('stop')
-
-    def restart_timer(self):
-        if not self.timer.is_alive():
-            self.timer = threading.Timer(self.timeout, self.quit_unless_locked)
-            self.timer.start()
+            self.transition(LockState.ACQUIRING, time.time())
+            # Only trust snapshots of the Matisse state taken after our own changes
+            newer_than = self.acquiring_since
+            while self.messages.qsize() == 0 and self.state != LockState.FAILED:
+                state = self.matisse.latest_state(newer_than)
+                newer_than = state.timestamp
+                if self.handle_state(state):
+                    newer_than = time.time()
+        if self.state != LockState.FAILED:
+            self.transition(LockState.UNLOCKED, time.time())
+
+    def handle_state(self, state) -> bool:
+        """
+        Advance the state machine using a new snapshot of the Matisse state.
+
+        Parameters
+        ----------
+        state : matisse_controller.matisse.state_poller.MatisseState
+
+        Returns
+        -------
+        bool
+            whether a change was made to the Matisse, making all earlier snapshots outdated
+        """
+        if self.state == LockState.ACQUIRING:
+            if state.fast_piezo_locked:
+                self.transition(LockState.LOCKED, state.timestamp)
+            elif state.is_any_limit_reached():
+                print('WARNING: A component has hit a limit before the laser could lock. Stopping control loops. ' +
+                      LockCorrectionThread.UNABLE_TO_LOCK_MESSAGE)
+                self.transition(LockState.FAILED, state.timestamp)
+            elif state.timestamp - self.acquiring_since > self.timeout:
+                print('WARNING: Locking failed. Timeout expired while trying to obtain lock. ' +
+                      LockCorrectionThread.UNABLE_TO_LOCK_MESSAGE)
+                self.transition(LockState.FAILED, state.timestamp)
+        elif self.state == LockState.LOCKED:
+            if not state.fast_piezo_locked:
+                self.transition(LockState.ACQUIRING, state.timestamp)
+            elif state.is_any_limit_reached():
+                self.transition(LockState.CORRECTING, state.timestamp)
+                self.correct(state)
+                return True
+        elif self.state == LockState.CORRECTING:
+            self.transition(LockState.LOCKED if state.fast_piezo_locked else LockState.ACQUIRING, state.timestamp)
+        return False
+
+    def correct(self, state):
+        print('WARNING: A component has hit a limit while the laser is locked. Attempting automatic corrections.')
+        if cfg.get(cfg.REPORT_EVENTS):
+            log_event(EventType.LOCK_CORRECTION, self.matisse, state.wavelength,
+                      'component hit a limit while laser was locked', state)
+        self.matisse.telemetry.record(state.wavelength, positions=state.stabilizing_piezo_positions,
+                                      event=EventType.LOCK_CORRECTION, timestamp=state.timestamp)
+        self.matisse.reset_stabilization_piezos()
+
+    def transition(self, new_state: LockState, timestamp: float):
+        """Move to a new state, recording the time of the transition."""
+        if new_state == LockState.ACQUIRING:
+            self.acquiring_since = timestamp
+        self.matisse.lock_metrics.record_transition(self.state, new_state, timestamp)
+        self.state = new_state
@@ -10,9 +10,12 @@ import matisse_controller.config as cfg
 from matisse_controller.matisse.constants import *
 from matisse_controller.matisse.control_loops_on import ControlLoopsOn
 from matisse_controller.matisse.event_report import log_event, EventType
-from matisse_controller.matisse.lock_correction_thread import LockCorrectionThread
+from matisse_controller.matisse.lock_correction_thread import LockCorrectionThread, LockMetrics, LockState
 from matisse_controller.matisse.plotting import BirefringentFilterScanPlotProcess, ThinEtalonScanPlotProcess
 from matisse_controller.matisse.stabilization_thread import StabilizationThread
+from matisse_controller.matisse.state_poller import MatisseState, StatePoller, parse_wavemeter_value
+from matisse_controller.matisse.telemetry import TelemetryRecorder
+from matisse_controller.matisse.wavelength_setting import WavelengthPhase, WavelengthSetting
 from matisse_controller.wavemaster import WaveMaster
 
 
@@ -32,13 +35,20 @@ class Matisse:
             self._force_large_scan = True
             self._restart_set_wavelength = False
             self.is_setting_wavelength = False
+            self.wavelength_setting = None
+            # (RefCell position, wavelength) pairs measured while fine tuning since the laser was last tuned another way
+            self._refcell_tuning_points = []
             self.is_scanning_bifi = False
             self.is_scanning_thin_etalon = False
             self.stabilization_auto_corrections = 0
+            self.telemetry = Matisse.create_telemetry_recorder()
+            self.lock_metrics = LockMetrics()
             self.query('ERROR:CLEAR')  # start with a clean slate
             self.query('MOTORBIREFRINGENT:CLEAR')
             self.query('MOTORTHINETALON:CLEAR')
             self._wavemeter = WaveMaster(cfg.get(cfg.WAVEMETER_PORT))
+            self.state_poller = StatePoller(self, cfg.get(cfg.STATE_POLLING_INTERVAL), queue.Queue(), daemon=True)
+            self.state_poller.start()
         except VisaIOError as ioerr:
             raise IOError("Can't reach Matisse. Make sure it's on and connected via USB.") from ioerr
 
@@ -49,6 +59,20 @@ class Matisse:
             # No instrument to close
             pass
 
+    @staticmethod
+    def create_telemetry_recorder() -> TelemetryRecorder:
+        """
+        Returns
+        -------
+        TelemetryRecorder
+            a telemetry recorder sized according to the telemetry configuration options
+        """
+        downsample_interval = cfg.get(cfg.TELEMETRY_DOWNSAMPLE_INTERVAL)
+        # Stabilization records at most one sample per loop
+        full_rate_capacity = cfg.get(cfg.TELEMETRY_FULL_RATE_MINUTES) * 60 / cfg.get(cfg.STABILIZATION_DELAY)
+        downsampled_capacity = cfg.get(cfg.TELEMETRY_DOWNSAMPLED_DAYS) * 24 * 60 * 60 / downsample_interval
+        return TelemetryRecorder(full_rate_capacity, downsampled_capacity, downsample_interval)
+
     def query(self, command: str, numeric_result=False, raise_on_error=True):
         """
         Send a command to the Matisse and return the response.
@@ -74,20 +98,105 @@ class Matisse:
         str or float
             The response from the Matisse to the given command
         """
+        result = self.query_many([command], raise_on_error)[0]
+        if numeric_result and not result.startswith('!ERROR'):
+            result: float = float(result.split()[1])
+        return result
+
+    def query_many(self, commands, raise_on_error=True) -> list:
+        """
+        Send several commands to the Matisse back-to-back, acquiring exclusive access to the instrument only once.
+        Responses are returned as they were received, without any numeric conversion.
+
+        Parameters
+        ----------
+        commands
+            an iterable of commands to send, in order
+        raise_on_error : bool
+            whether to raise a Python error if Matisse error occurs
+
+        Returns
+        -------
+        list of str
+            The responses from the Matisse to each of the given commands
+        """
         try:
             with Matisse.matisse_lock:
-                result: str = self._instrument.query(command).strip()
+                results = [self._instrument.query(command).strip() for command in commands]
         except VisaIOError as ioerr:
             raise IOError("Couldn't execute command. Check Matisse is on and connected via USB.") from ioerr
 
-        if result.startswith('!ERROR'):
-            if raise_on_error:
-                err_codes = self.query('ERROR:CODE?')
-                self.query('ERROR:CLEAR')
-                raise RuntimeError("Error executing Matisse command '" + command + "' " + err_codes)
-        elif numeric_result:
-            result: float = float(result.split()[1])
-        return result
+        if raise_on_error:
+            for command, result in zip(commands, results):
+                if result.startswith('!ERROR'):
+                    err_codes = self.query('ERROR:CODE?')
+                    self.query('ERROR:CLEAR')
+                    raise RuntimeError("Error executing Matisse command '" + command + "' " + err_codes)
+        return results
+
+    def read_state(self) -> MatisseState:
+        """
+        Read the positions, control loop status, lock status, and scan status of the Matisse in a single batch of
+        queries, along with the current wavemeter display.
+
+        Prefer `Matisse.latest_state` to avoid sending these queries again if a recent snapshot is good enough.
+
+        Returns
+        -------
+        MatisseState
+            an immutable snapshot of the state of the Matisse
+        """
+        timestamp = time.time()
+        (bifi_pos, thin_eta_pos, refcell_pos, slow_pz_pos, pz_eta_pos, slow_pz_control, thin_eta_control,
+         pz_eta_control, fast_pz_control, fast_pz_lock, scan_status, scan_mode) = self.query_many([
+            'MOTBI:POS?', 'MOTTE:POS?', 'SCAN:NOW?', 'SLOWPIEZO:NOW?', 'PIEZOETALON:BASELINE?',
+            'SLOWPIEZO:CONTROLSTATUS?', 'THINETALON:CONTROLSTATUS?', 'PIEZOETALON:CONTROLSTATUS?',
+            'FASTPIEZO:CONTROLSTATUS?', 'FASTPIEZO:LOCK?', 'SCAN:STATUS?', 'SCAN:MODE?'
+        ])
+        wavemeter_value = self.wavemeter_raw_value()
+        return MatisseState(timestamp=timestamp,
+                            wavelength=parse_wavemeter_value(wavemeter_value),
+                            wavemeter_raw_value=wavemeter_value,
+                            bifi_pos=float(bifi_pos.split()[1]),
+                            thin_etalon_pos=float(thin_eta_pos.split()[1]),
+                            refcell_pos=float(refcell_pos.split()[1]),
+                            piezo_etalon_pos=float(pz_eta_pos.split()[1]),
+                            slow_piezo_pos=float(slow_pz_pos.split()[1]),
+                            slow_piezo_control='RUN' in slow_pz_control,
+                            thin_etalon_control='RUN' in thin_eta_control,
+                            piezo_etalon_control='RUN' in pz_eta_control,
+                            fast_piezo_control='RUN' in fast_pz_control,
+                            fast_piezo_locked='TRUE' in fast_pz_lock,
+                            is_scanning='RUN' in scan_status,
+                            scan_mode=int(float(scan_mode.split()[1])),
+                            is_stabilizing=self.is_stabilizing())
+
+    def latest_state(self, newer_than: float = 0) -> MatisseState:
+        """
+        Get the most recent snapshot published by the state poller, waiting for a new one if needed.
+
+        If the state poller isn't running, the state is read directly from the Matisse instead.
+
+        Parameters
+        ----------
+        newer_than : float
+            a time in seconds since the epoch. The snapshot returned will have been taken after this time.
+
+        Returns
+        -------
+        MatisseState
+            a snapshot of the state of the Matisse
+        """
+        if self.state_poller.is_alive():
+            state = self.state_poller.wait_for_state(newer_than, timeout=cfg.get(cfg.STATE_POLLING_INTERVAL) * 10)
+            if state is not None:
+                return state
+        return self.read_state()
+
+    def stop_state_polling(self):
+        """Stop the state poller thread. No more state snapshots will be published after this."""
+        if self.state_poller.is_alive():
+            self.state_poller.stop()
 
     def wavemeter_wavelength(self) -> float:
         """
@@ -107,7 +216,7 @@ class Matisse:
         """
         return self._wavemeter.get_raw_value()
 
-    def set_wavelength(self, wavelength: float):
+    def set_wavelength(self, wavelength: float) -> WavelengthSetting:
         """
         Configure the Matisse to output a given wavelength.
 
@@ -146,16 +255,28 @@ class Matisse:
         A scan may decide it needs to start the process over again for some other reason, like the thin etalon moving to
         a location with mostly noise.
 
+        This method returns once stabilization has started. Wait on the returned handle to know when stabilization
+        first brings the wavelength within cfg.STABILIZATION_TOLERANCE.
+
         Parameters
         ----------
         wavelength : float
             the desired wavelength
+
+        Returns
+        -------
+        WavelengthSetting
+            a handle that is done once the wavelength is reached, or cancelled if setting the wavelength is interrupted
         """
         self.is_setting_wavelength = True
         assert cfg.get(cfg.WAVELENGTH_LOWER_LIMIT) < wavelength < cfg.get(cfg.WAVELENGTH_UPPER_LIMIT), \
             'Target wavelength out of range.'
 
+        if self.wavelength_setting is not None:
+            self.wavelength_setting.cancel()
+        setting = self.wavelength_setting = WavelengthSetting(wavelength)
         self.target_wavelength = wavelength
+        self.forget_refcell_tuning_points()
 
         if self.is_lock_correction_on():
             self.stop_laser_lock_correction()
@@ -204,8 +325,9 @@ class Matisse:
 
             # Restart/exit conditions
             if self.exit_flag:
+                setting.cancel()
                 self.is_setting_wavelength = False
-                return
+                return setting
             if self._restart_set_wavelength:
                 self._restart_set_wavelength = False
                 print('Restarting wavelength-setting process.')
@@ -229,20 +351,85 @@ class Matisse:
                 self._force_large_scan = False
                 break
 
+        setting.enter_phase(WavelengthPhase.LOCKING)
         self.start_laser_lock_correction()
         print('Attempting to lock laser...')
         while not self.laser_locked():
             if self.exit_flag:
+                setting.cancel()
                 self.is_setting_wavelength = False
-                return
+                return setting
             if not self.is_lock_correction_on():
                 print('Lock failed, trying again.')
                 self.set_recommended_fast_piezo_setpoint()
                 self.start_laser_lock_correction()
             time.sleep(1)
+        setting.enter_phase(WavelengthPhase.STABILIZING)
         self.stabilize_on()
 
         self.is_setting_wavelength = False
+        return setting
+
+    def fine_tune_wavelength(self, wavelength: float) -> WavelengthSetting:
+        """
+        Move to a nearby wavelength using only the reference cell, without unlocking the laser or stopping
+        stabilization. This is much faster than `Matisse.set_wavelength`, but only works within a single mode-hop-free
+        range, so it's meant for small steps.
+
+        After the first step, the RefCell is moved straight to the position estimated from the wavelengths measured at
+        previous steps, and the stabilization thread takes care of the rest.
+
+        Parameters
+        ----------
+        wavelength : float
+            the desired wavelength
+
+        Returns
+        -------
+        WavelengthSetting
+            a handle that is done once the wavelength is reached, or None if the wavelength can't be reached this way.
+            This happens if the laser isn't locked and stabilizing, the wavelength is further than
+            cfg.SMALL_WAVELENGTH_DRIFT from the current one, or the RefCell would have to move past its limits. Use
+            `Matisse.set_wavelength` instead in those cases.
+        """
+        assert cfg.get(cfg.WAVELENGTH_LOWER_LIMIT) < wavelength < cfg.get(cfg.WAVELENGTH_UPPER_LIMIT), \
+            'Target wavelength out of range.'
+
+        state = self.latest_state()
+        if not (state.laser_locked and self.is_stabilizing()) or np.isnan(state.wavelength) or \
+                state.is_any_limit_reached():
+            return None
+        if abs(wavelength - state.wavelength) > cfg.get(cfg.SMALL_WAVELENGTH_DRIFT):
+            return None
+
+        self._refcell_tuning_points.append((state.refcell_pos, state.wavelength))
+        refcell_pos, current_wavelength = self._refcell_tuning_points[-1]
+        first_refcell_pos, first_wavelength = self._refcell_tuning_points[0]
+        new_refcell_pos = None
+        if abs(refcell_pos - first_refcell_pos) > 0.001:
+            nm_per_refcell_unit = (current_wavelength - first_wavelength) / (refcell_pos - first_refcell_pos)
+            if nm_per_refcell_unit != 0:
+                new_refcell_pos = refcell_pos + (wavelength - current_wavelength) / nm_per_refcell_unit
+                offset = cfg.get(cfg.COMPONENT_LIMIT_OFFSET)
+                if not REFERENCE_CELL_LOWER_LIMIT + offset < new_refcell_pos < REFERENCE_CELL_UPPER_LIMIT - offset:
+                    return None
+
+        if self.wavelength_setting is not None:
+            self.wavelength_setting.cancel()
+        setting = self.wavelength_setting = WavelengthSetting(wavelength)
+        setting.enter_phase(WavelengthPhase.STABILIZING)
+        self.target_wavelength = wavelength
+        if new_refcell_pos is not None:
+            self.stop_scan()
+            self.query(f"SCAN:NOW {new_refcell_pos}")
+        return setting
+
+    def forget_refcell_tuning_points(self):
+        """
+        Forget the RefCell positions measured by `Matisse.fine_tune_wavelength`. Call this whenever the laser is tuned
+        some other way, since the wavelength per RefCell position measured before no longer applies.
+        """
+        self._refcell_tuning_points = []
 
     def reset_motors(self):
         """Move the birefringent filter and thin etalon motors to their configured reset positions."""
@@ -689,14 +876,20 @@ class Matisse:
         current_pz_eta_pos = self.query('PIEZOETALON:BASELINE?', numeric_result=True)
         return current_refcell_pos, current_pz_eta_pos, current_slow_pz_pos
 
-    def is_any_limit_reached(self):
+    def is_any_limit_reached(self, positions=None):
         """
+        Parameters
+        ----------
+        positions : (float, float, float)
+            previously measured positions of the stabilization piezos, as given by `get_stabilizing_piezo_positions`. If
+            not given, the positions are queried from the Matisse.
+
         Returns
         -------
         bool
             whether any of the stabilization piezos are very close to their limits
         """
-        refcell_pos, pz_eta_pos, slow_pz_pos = self.get_stabilizing_piezo_positions()
+        refcell_pos, pz_eta_pos, slow_pz_pos = positions or self.get_stabilizing_piezo_positions()
         offset = cfg.get(cfg.COMPONENT_LIMIT_OFFSET)
         return not (REFERENCE_CELL_LOWER_LIMIT + offset < refcell_pos < REFERENCE_CELL_UPPER_LIMIT - offset
                     and SLOW_PIEZO_LOWER_LIMIT + offset < slow_pz_pos < SLOW_PIEZO_UPPER_LIMIT - offset
@@ -716,6 +909,7 @@ class Matisse:
         """
         current_refcell_pos, current_pz_eta_pos, current_slow_pz_pos = self.get_stabilizing_piezo_positions()
         current_wavelength = self.wavemeter_wavelength()
+        self.forget_refcell_tuning_points()
 
         offset = cfg.get(cfg.COMPONENT_LIMIT_OFFSET)
         if (current_refcell_pos > REFERENCE_CELL_UPPER_LIMIT - offset
@@ -817,3 +1011,14 @@ class Matisse:
             whether the lock correction thread is running
         """
         return self._lock_correction_thread is not None and self._lock_correction_thread.is_alive()
+
+    def lock_state(self) -> LockState:
+        """
+        Returns
+        -------
+        LockState
+            the current state of the lock correction thread, or the state it ended in
+        """
+        if self._lock_correction_thread is None:
+            return LockState.UNLOCKED
+        return self._lock_correction_thread.state
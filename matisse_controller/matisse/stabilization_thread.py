@@ -2,9 +2,12 @@ import threading
 import time
 from queue import Queue
 
+import numpy as np
+
 import matisse_controller.config as cfg
 import matisse_controller.matisse as matisse
 from matisse_controller.matisse.event_report import log_event, EventType
+from matisse_controller.matisse.telemetry import NOT_SCANNING
 
 
 class StabilizationThread(threading.Thread):
@@ -35,58 +38,81 @@ class StabilizationThread(threading.Thread):
         If a larger drift in wavelength occurs, we might have fallen into a dip on the power diode curve. To correct
         this, a small BiFi scan and a small thin etalon scan will be performed.
 
+        Wavelength and positions are taken from snapshots published by the Matisse state poller. Each iteration is
+        recorded to the Matisse telemetry recorder. The first time the wavelength is within tolerance, the handle
+        returned by `matisse_controller.matisse.matisse.Matisse.set_wavelength` is marked as done.
+
         Exit if anything is pushed to the message queue.
         """
+        # Each iteration waits for a snapshot of the Matisse state taken after the previous one, or after our changes
+        newer_than = time.time()
         while True:
             if self.messages.qsize() == 0:
-                current_wavelength = self._matisse.wavemeter_wavelength()
+                state = self._matisse.latest_state(newer_than)
+                newer_than = state.timestamp
+                if np.isnan(state.wavelength):
+                    # The wavemeter isn't displaying a measurement right now, try again later
+                    time.sleep(cfg.get(cfg.STABILIZATION_DELAY))
+                    continue
+                current_wavelength = state.wavelength
                 drift = round(current_wavelength - self._matisse.target_wavelength, cfg.get(cfg.WAVEMETER_PRECISION))
+                positions = state.stabilizing_piezo_positions
+                scan_direction = NOT_SCANNING
+                event = None
                 # TODO: This threshold is large, maybe add another config option for this condition
                 if abs(drift) > cfg.get(cfg.LARGE_WAVELENGTH_DRIFT):
-                    # TODO: Consider logging this event to the event report
                     print(f"WARNING: Wavelength drifted by {drift} nm during stabilization. Making corrections.")
+                    event = EventType.LARGE_DRIFT_CORRECTION
                     self._matisse.stop_scan()
+                    if cfg.get(cfg.REPORT_EVENTS):
+                        log_event(event, self._matisse, current_wavelength, f"wavelength drifted by {drift} nm", state)
                     if self._matisse.is_lock_correction_on():
                         self._matisse.stop_laser_lock_correction()
                     # TODO: Skip BiFi scan if drift is small enough, kind of like in Matisse.set_wavelength
                     self._matisse.birefringent_filter_scan(scan_range=cfg.get(cfg.BIFI_SCAN_RANGE_SMALL))
                     self._matisse.thin_etalon_scan(scan_range=cfg.get(cfg.THIN_ETA_SCAN_RANGE_SMALL))
+                    self._matisse.forget_refcell_tuning_points()
                     self._matisse.start_laser_lock_correction()
+                    newer_than = time.time()
                 elif abs(drift) > cfg.get(cfg.STABILIZATION_TOLERANCE):
                     if drift > 0:
                         # measured wavelength is too high
-                        print(f"Wavelength too high, decreasing. Drift is {drift} nm. Refcell is at {self._matisse.query('SCAN:NOW?', numeric_result=True)}")
-                        if not self._matisse.is_any_limit_reached():
-                            if cfg.get(cfg.REPORT_EVENTS):
-                                log_event(EventType.WAVELENGTH_DRIFT, self._matisse, current_wavelength,
-                                          f"wavelength drifted by {drift} nm")
-                            self._matisse.start_scan(matisse.SCAN_MODE_DOWN)
-                        else:
-                            self.do_stabilization_correction(current_wavelength)
+                        print(f"Wavelength too high, decreasing. Drift is {drift} nm. Refcell is at {positions[0]}")
+                        scan_direction = matisse.SCAN_MODE_DOWN
                     else:
                         # measured wavelength is too low
-                        print(f"Wavelength too low, increasing.  Drift is {drift} nm. Refcell is at {self._matisse.query('SCAN:NOW?', numeric_result=True)}")
-                        if not self._matisse.is_any_limit_reached():
-                            if cfg.get(cfg.REPORT_EVENTS):
-                                log_event(EventType.WAVELENGTH_DRIFT, self._matisse, current_wavelength,
-                                          f"wavelength drifted by {drift} nm")
-                            self._matisse.start_scan(matisse.SCAN_MODE_UP)
-                        else:
-                            self.do_stabilization_correction(current_wavelength)
+                        print(f"Wavelength too low, increasing.  Drift is {drift} nm. Refcell is at {positions[0]}")
+                        scan_direction = matisse.SCAN_MODE_UP
+
+                    if not state.is_any_limit_reached():
+                        event = EventType.WAVELENGTH_DRIFT
+                        if cfg.get(cfg.REPORT_EVENTS):
+                            log_event(event, self._matisse, current_wavelength, f"wavelength drifted by {drift} nm", state)
+                        self._matisse.start_scan(scan_direction)
+                    else:
+                        scan_direction = NOT_SCANNING
+                        event = EventType.STABILIZATION_CORRECTION
+                        self.do_stabilization_correction(current_wavelength, state)
+                        newer_than = time.time()
                 else:
                     self._matisse.stop_scan()
                     # print(f"Within tolerance. Drift is {drift}")
+                    setting = self._matisse.wavelength_setting
+                    if setting is not None and setting.target_wavelength == self._matisse.target_wavelength:
+                        setting.finish()
+                self._matisse.telemetry.record(current_wavelength, drift, positions, scan_direction, event,
+                                              timestamp=state.timestamp)
                 time.sleep(cfg.get(cfg.STABILIZATION_DELAY))
             else:
                 self._matisse.stop_scan()
                 break
 
-    def do_stabilization_correction(self, wavelength):
+    def do_stabilization_correction(self, wavelength, state=None):
         """Reset the stabilization piezos and optionally log the correction event."""
         print('WARNING: A component has hit a limit while adjusting the RefCell. Attempting automatic corrections.')
         self._matisse.stop_scan()
         if cfg.get(cfg.REPORT_EVENTS):
             log_event(EventType.STABILIZATION_CORRECTION, self._matisse, wavelength,
-                      'component hit a limit while auto-stabilization was on')
+                      'component hit a limit while auto-stabilization was on', state)
         self._matisse.reset_stabilization_piezos()
         self._matisse.stabilization_auto_corrections += 1
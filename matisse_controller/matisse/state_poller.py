@@ -0,0 +1,243 @@
+"""Provides a thread that periodically reads the state of the Matisse and publishes it to any interested components."""
+
+import queue
+import threading
+import time
+from queue import Queue
+
+import numpy as np
+
+import matisse_controller.config as cfg
+from matisse_controller.matisse.constants import *
+
+
+class MatisseState:
+    """
+    An immutable, timestamped snapshot of the state of the Matisse and the wavemeter.
+
+    The timestamp marks the moment just before the first query was sent, so every value in the snapshot was read after
+    that time.
+    """
+
+    __slots__ = ['timestamp', 'wavelength', 'wavemeter_raw_value', 'bifi_pos', 'thin_etalon_pos', 'refcell_pos',
+                 'piezo_etalon_pos', 'slow_piezo_pos', 'slow_piezo_control', 'thin_etalon_control',
+                 'piezo_etalon_control', 'fast_piezo_control', 'fast_piezo_locked', 'is_scanning', 'scan_mode',
+                 'is_stabilizing']
+
+    def __init__(self, **values):
+        for name in MatisseState.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError('MatisseState snapshots cannot be modified.')
+
+    def __delattr__(self, name):
+        raise AttributeError('MatisseState snapshots cannot be modified.')
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in MatisseState.__slots__)
+        return f"MatisseState({values})"
+
+    @property
+    def stabilizing_piezo_positions(self):
+        """Positions of the RefCell, piezo etalon, and slow piezo, in the same order as the Matisse API."""
+        return self.refcell_pos, self.piezo_etalon_pos, self.slow_piezo_pos
+
+    @property
+    def all_control_loops_on(self):
+        return (self.slow_piezo_control and self.thin_etalon_control and self.piezo_etalon_control
+                and self.fast_piezo_control)
+
+    @property
+    def laser_locked(self):
+        return self.all_control_loops_on and self.fast_piezo_locked
+
+    @property
+    def age(self):
+        """The number of seconds since this snapshot was taken."""
+        return time.time() - self.timestamp
+
+    def is_any_limit_reached(self, offset: float = None):
+        """
+        Parameters
+        ----------
+        offset : float
+            how close a piezo must be to its limit to be considered at the limit, defaults to cfg.COMPONENT_LIMIT_OFFSET
+
+        Returns
+        -------
+        bool
+            whether any of the stabilization piezos were very close to their limits
+        """
+        if offset is None:
+            offset = cfg.get(cfg.COMPONENT_LIMIT_OFFSET)
+        return not (REFERENCE_CELL_LOWER_LIMIT + offset < self.refcell_pos < REFERENCE_CELL_UPPER_LIMIT - offset
+                    and SLOW_PIEZO_LOWER_LIMIT + offset < self.slow_piezo_pos < SLOW_PIEZO_UPPER_LIMIT - offset
+                    and PIEZO_ETALON_LOWER_LIMIT + offset < self.piezo_etalon_pos < PIEZO_ETALON_UPPER_LIMIT - offset)
+
+
+class StatePoller(threading.Thread):
+    """
+    A thread that reads the full state of the Matisse at regular intervals, and publishes each snapshot to subscribers.
+
+    Subscribers may receive snapshots through a queue (holding only the most recent snapshots), through a callback run
+    on this thread, or by waiting for a snapshot newer than a given time. This lets every component share one stream of
+    queries to the Matisse instead of polling it independently.
+
+    The state is read every cfg.STATUS_MONITOR_DELAY seconds, which is as often as the status monitor needs it. While
+    anything is waiting for a new snapshot, like the stabilization and lock correction threads, it's read at the
+    shorter polling interval instead, so the Matisse only gets queried quickly while something needs it.
+    """
+
+    def __init__(self, matisse, interval: float, messages: Queue, *args, **kwargs):
+        """
+        Parameters
+        ----------
+        matisse : matisse_controller.matisse.matisse.Matisse
+        interval : float
+            the time to wait between each reading while anything is waiting for a new snapshot, usually
+            cfg.STATE_POLLING_INTERVAL
+        messages
+            a message queue
+        *args
+            args to pass to `Thread.__init__`
+        **kwargs
+            kwargs to pass to `Thread.__init__`
+        """
+        super().__init__(*args, **kwargs)
+        self.matisse = matisse
+        self.interval = interval
+        self.messages = messages
+        self.latest: MatisseState = None
+        self._subscriber_queues = []
+        self._callbacks = []
+        self._subscriber_lock = threading.Lock()
+        self._new_state = threading.Condition()
+        # The number of threads blocked in wait_for_state, which make the Matisse get polled at the shorter interval
+        self._num_waiters = 0
+        self._wake = threading.Event()
+
+    def run(self):
+        while self.messages.qsize() == 0:
+            try:
+                self.publish(self.matisse.read_state())
+            except Exception as err:
+                print(f"WARNING: Unable to read Matisse state. {err}")
+            last_read_time = time.time()
+            while self.messages.qsize() == 0:
+                self._wake.clear()
+                interval = self.interval if self._num_waiters > 0 else cfg.get(cfg.STATUS_MONITOR_DELAY)
+                remaining_time = last_read_time + interval - time.time()
+                if remaining_time <= 0:
+                    break
+                # Wake up early if something starts waiting for a new snapshot, or the poller is stopped
+                self._wake.wait(remaining_time)
+
+    def publish(self, state: MatisseState):
+        """Make the given snapshot available to all subscribers."""
+        with self._new_state:
+            self.latest = state
+            self._new_state.notify_all()
+
+        with self._subscriber_lock:
+            subscriber_queues = list(self._subscriber_queues)
+            callbacks = list(self._callbacks)
+
+        for subscriber_queue in subscriber_queues:
+            # Slow subscribers only care about the most recent snapshots, so discard the oldest
+            while True:
+                try:
+                    subscriber_queue.put_nowait(state)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+        for callback in callbacks:
+            try:
+                callback(state)
+            except Exception as err:
+                print(f"WARNING: Error in Matisse state subscriber {callback}. {err}")
+
+    def subscribe(self, callback=None, maxsize=1):
+        """
+        Start receiving snapshots of the Matisse state.
+
+        Parameters
+        ----------
+        callback
+            a function to call with each new `MatisseState`. This runs on the polling thread, so keep it fast.
+        maxsize : int
+            if no callback is given, the number of recent snapshots to hold in the returned queue
+
+        Returns
+        -------
+        Queue or function
+            the queue which receives new snapshots, or the given callback. Pass this to `unsubscribe` when finished.
+        """
+        with self._subscriber_lock:
+            if callback:
+                self._callbacks.append(callback)
+                return callback
+            else:
+                subscriber_queue = Queue(maxsize=maxsize)
+                self._subscriber_queues.append(subscriber_queue)
+                return subscriber_queue
+
+    def unsubscribe(self, subscriber):
+        """Stop publishing snapshots to a queue or callback returned by `subscribe`."""
+        with self._subscriber_lock:
+            if subscriber in self._subscriber_queues:
+                self._subscriber_queues.remove(subscriber)
+            if subscriber in self._callbacks:
+                self._callbacks.remove(subscriber)
+
+    def wait_for_state(self, newer_than: float = 0, timeout: float = None) -> MatisseState:
+        """
+        Block until a snapshot taken after a given time is available.
+
+        Parameters
+        ----------
+        newer_than : float
+            a time in seconds since the epoch. Use the current time to wait for a snapshot that reflects any changes you
+            have just made.
+        timeout : float
+            the maximum time to wait, in seconds
+
+        Returns
+        -------
+        MatisseState
+            the most recent snapshot, or None if no suitable snapshot arrived within the timeout
+        """
+        def is_new_enough():
+            return self.latest is not None and self.latest.timestamp > newer_than
+
+        with self._new_state:
+            if not is_new_enough():
+                self._num_waiters += 1
+                self._wake.set()
+                try:
+                    self._new_state.wait_for(is_new_enough, timeout)
+                finally:
+                    self._num_waiters -= 1
+            return self.latest if is_new_enough() else None
+
+    def stop(self):
+        """Stop polling the Matisse and wait for the thread to exit."""
+        self.messages.put('stop')
+        self._wake.set()
+        self.join()
+
+
+def parse_wavemeter_value(raw_value: str) -> float:
+    """
+    Returns
+    -------
+    float
+        the wavelength shown on the wavemeter display, or NaN if the display does not show a measurement
+    """
+    try:
+        return float(raw_value)
+    except ValueError:
+        return np.nan
@@ -0,0 +1,209 @@
+"""Provides a fixed-memory recorder for stabilization and lock correction telemetry."""
+
+import threading
+import time
+
+import numpy as np
+
+from matisse_controller.matisse.event_report import EventType
+
+# Value stored in the scan_direction column when the device is not scanning
+NOT_SCANNING = -1
+
+# Event codes stored in the event column. Zero means no event occurred for that sample.
+EVENT_CODES = {event_type: code for code, event_type in enumerate(EventType, start=1)}
+EVENT_TYPES = {code: event_type for event_type, code in EVENT_CODES.items()}
+
+# Values which are reduced to min/mean/max when downsampling
+SAMPLED_FIELDS = ['drift', 'refcell_pos', 'piezo_etalon_pos', 'slow_piezo_pos']
+
+FULL_RATE_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('wavelength', np.float64),
+    ('drift', np.float64),
+    ('refcell_pos', np.float64),
+    ('piezo_etalon_pos', np.float64),
+    ('slow_piezo_pos', np.float64),
+    ('scan_direction', np.int8),
+    ('event', np.int8)
+])
+
+DOWNSAMPLED_DTYPE = np.dtype([('timestamp', np.float64), ('num_samples', np.int32), ('num_events', np.int32)] +
+                             [(f"{field}_{stat}", np.float64) for field in SAMPLED_FIELDS
+                              for stat in ['min', 'mean', 'max']])
+
+
+class RingBuffer:
+    """A preallocated numpy ring of structured records that overwrites the oldest entries once full."""
+
+    def __init__(self, capacity: int, dtype: np.dtype):
+        self.data = np.zeros(max(int(capacity), 1), dtype=dtype)
+        self.index = 0
+        self.size = 0
+
+    def append(self, record: tuple):
+        self.data[self.index] = record
+        self.index = (self.index + 1) % len(self.data)
+        self.size = min(self.size + 1, len(self.data))
+
+    def ordered(self) -> np.ndarray:
+        """
+        Returns
+        -------
+        ndarray
+            a copy of all records currently in the ring, oldest first
+        """
+        if self.size < len(self.data):
+            return self.data[:self.size].copy()
+        return np.concatenate((self.data[self.index:], self.data[:self.index]))
+
+    def clear(self):
+        self.index = 0
+        self.size = 0
+
+
+class TelemetryRecorder:
+    """
+    Keeps a full-rate record of the stabilization piezos, wavelength drift, scan direction, and correction events for a
+    limited amount of time, as well as a downsampled (min/mean/max) record that covers a much longer period. Memory
+    usage is fixed when the recorder is created.
+
+    All methods are thread-safe.
+    """
+
+    def __init__(self, full_rate_capacity: int, downsampled_capacity: int, downsample_interval: float):
+        """
+        Parameters
+        ----------
+        full_rate_capacity : int
+            the number of samples to keep at full rate
+        downsampled_capacity : int
+            the number of downsampled intervals to keep
+        downsample_interval : float
+            the length of each downsampled interval, in seconds
+        """
+        self.lock = threading.Lock()
+        self.full_rate = RingBuffer(full_rate_capacity, FULL_RATE_DTYPE)
+        self.downsampled = RingBuffer(downsampled_capacity, DOWNSAMPLED_DTYPE)
+        self.downsample_interval = downsample_interval
+        self._reset_interval(None)
+
+    def record(self, wavelength=np.nan, drift=np.nan, positions=(np.nan, np.nan, np.nan), scan_direction=NOT_SCANNING,
+               event: EventType = None, timestamp: float = None):
+        """
+        Record a single telemetry sample.
+
+        Parameters
+        ----------
+        wavelength : float
+            the measured wavelength, if known
+        drift : float
+            the difference between the measured wavelength and the target wavelength, if known
+        positions : (float, float, float)
+            the positions of the RefCell, piezo etalon, and slow piezo, as given by
+            `matisse_controller.matisse.matisse.Matisse.get_stabilizing_piezo_positions`
+        scan_direction : int
+            `SCAN_MODE_UP`, `SCAN_MODE_DOWN`, or `NOT_SCANNING`
+        event : EventType
+            the event that occurred at the time of this sample, if any
+        timestamp : float
+            the time of the sample in seconds since the epoch, defaults to the current time
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        refcell_pos, pz_eta_pos, slow_pz_pos = positions
+        event_code = EVENT_CODES[event] if event else 0
+        values = np.array([drift, refcell_pos, pz_eta_pos, slow_pz_pos], dtype=np.float64)
+
+        with self.lock:
+            self.full_rate.append((timestamp, wavelength, drift, refcell_pos, pz_eta_pos, slow_pz_pos, scan_direction,
+                                   event_code))
+
+            if self._interval_start is not None and timestamp >= self._interval_start + self.downsample_interval:
+                self._flush_interval()
+            if self._interval_start is None:
+                self._reset_interval(timestamp - timestamp % self.downsample_interval)
+
+            valid = ~np.isnan(values)
+            self._mins = np.fmin(self._mins, values)
+            self._maxes = np.fmax(self._maxes, values)
+            self._sums[valid] += values[valid]
+            self._counts += valid
+            self._num_samples += 1
+            self._num_events += event_code != 0
+
+    def query(self, start: float = None, end: float = None, downsampled=False) -> np.ndarray:
+        """
+        Fetch recorded telemetry within a given time range.
+
+        Parameters
+        ----------
+        start : float
+            the earliest timestamp to include, in seconds since the epoch
+        end : float
+            the latest timestamp to include, in seconds since the epoch
+        downsampled : bool
+            whether to query the downsampled tier instead of the full-rate samples. The interval currently being
+            accumulated is included.
+
+        Returns
+        -------
+        ndarray
+            a structured array of samples, oldest first. Event codes map to event types through `EVENT_TYPES`.
+        """
+        with self.lock:
+            if downsampled:
+                records = self.downsampled.ordered()
+                if self._num_samples > 0:
+                    records = np.append(records, np.array([self._interval_record()], dtype=DOWNSAMPLED_DTYPE))
+            else:
+                records = self.full_rate.ordered()
+
+        mask = np.ones(len(records), dtype=bool)
+        if start is not None:
+            mask &= records['timestamp'] >= start
+        if end is not None:
+            mask &= records['timestamp'] <= end
+        return records[mask]
+
+    def export(self, file_name: str):
+        """
+        Save all recorded telemetry to a compressed .npz file, containing the arrays 'full_rate' and 'downsampled',
+        and an array 'event_types' mapping event codes (by index) to event type names.
+
+        Parameters
+        ----------
+        file_name : str
+            the name of the file to write
+        """
+        event_types = [''] + [event_type.value for event_type in EVENT_CODES.keys()]
+        np.savez_compressed(file_name, full_rate=self.query(), downsampled=self.query(downsampled=True),
+                            event_types=np.array(event_types))
+
+    def clear(self):
+        """Remove all recorded telemetry."""
+        with self.lock:
+            self.full_rate.clear()
+            self.downsampled.clear()
+            self._reset_interval(None)
+
+    def _flush_interval(self):
+        self.downsampled.append(self._interval_record())
+        self._reset_interval(None)
+
+    def _interval_record(self) -> tuple:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self._sums / self._counts
+        stats = []
+        for minimum, mean, maximum in zip(self._mins, means, self._maxes):
+            stats.extend([minimum, mean, maximum])
+        return (self._interval_start, self._num_samples, self._num_events, *stats)
+
+    def _reset_interval(self, interval_start):
+        self._interval_start = interval_start
+        self._mins = np.full(len(SAMPLED_FIELDS), np.nan)
+        self._maxes = np.full(len(SAMPLED_FIELDS), np.nan)
+        self._sums = np.zeros(len(SAMPLED_FIELDS))
+        self._counts = np.zeros(len(SAMPLED_FIELDS), dtype=np.int64)
+        self._num_samples = 0
+        self._num_events = 0
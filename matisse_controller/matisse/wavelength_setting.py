@@ -0,0 +1,108 @@
+import threading
+import time
+from enum import Enum
+
+
+class WavelengthPhase(Enum):
+    TUNING = 'tuning'
+    LOCKING = 'locking'
+    STABILIZING = 'stabilizing'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+
+
+class WavelengthSetting:
+    """
+    A completion handle for a call to `matisse_controller.matisse.matisse.Matisse.set_wavelength`.
+
+    The handle moves through the phases of setting the wavelength (tuning the BiFi and thin etalon, locking, then
+    stabilizing to the target), and is done once the stabilization thread first measures the wavelength within its
+    tolerance. Other threads can wait on it instead of polling the wavemeter, and the time at which each phase was
+    reached is kept, so it's easy to see where the time between wavelengths goes.
+    """
+
+    def __init__(self, target_wavelength: float):
+        """
+        Parameters
+        ----------
+        target_wavelength : float
+            the wavelength being set
+        """
+        self.target_wavelength = target_wavelength
+        self.phase = WavelengthPhase.TUNING
+        self.phase_times = {WavelengthPhase.TUNING: time.time()}
+        self._condition = threading.Condition()
+
+    def enter_phase(self, phase: WavelengthPhase):
+        """Move on to the given phase, notifying anyone waiting if it's the last one. Finished handles don't change."""
+        with self._condition:
+            if self.done():
+                return
+            self.phase = phase
+            self.phase_times[phase] = time.time()
+            if self.done():
+                self._condition.notify_all()
+
+    def finish(self):
+        """Mark the target wavelength as reached."""
+        self.enter_phase(WavelengthPhase.DONE)
+
+    def cancel(self):
+        """Mark the wavelength as abandoned, like when set_wavelength is interrupted or called again."""
+        self.enter_phase(WavelengthPhase.CANCELLED)
+
+    def done(self) -> bool:
+        """
+        Returns
+        -------
+        bool
+            whether the wavelength was reached or abandoned
+        """
+        return self.phase in (WavelengthPhase.DONE, WavelengthPhase.CANCELLED)
+
+    def succeeded(self) -> bool:
+        return self.phase == WavelengthPhase.DONE
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Block until the wavelength has been reached or abandoned.
+
+        Parameters
+        ----------
+        timeout : float
+            the maximum number of seconds to wait, or None to wait indefinitely
+
+        Returns
+        -------
+        bool
+            whether the handle is done, which is False if the timeout passed first
+        """
+        with self._condition:
+            return self._condition.wait_for(self.done, timeout)
+
+    def phase_durations(self) -> dict:
+        """
+        Returns
+        -------
+        dict
+            the number of seconds spent in each phase reached so far, keyed by phase. The current phase is measured up
+            to now, unless the handle is done.
+        """
+        with self._condition:
+            phase_times = sorted(self.phase_times.items(), key=lambda item: item[1])
+        end_times = [start for _, start in phase_times[1:]] + [time.time()]
+        return {phase: end - start for (phase, start), end in zip(phase_times, end_times)
+                if phase not in (WavelengthPhase.DONE, WavelengthPhase.CANCELLED)}
+
+    def elapsed(self) -> float:
+        """The number of seconds since setting the wavelength started, up to when it was done if it's done."""
+        with self._condition:
+            end = self.phase_times.get(self.phase, time.time()) if self.done() else time.time()
+            return end - self.phase_times[WavelengthPhase.TUNING]
+
+    def describe_phases(self) -> str:
+        """A short description of how long each phase took, like 'tuning 12.3 s, locking 1.0 s, stabilizing 4.5 s'."""
+        return ', '.join(f"{phase.value} {duration:.1f} s" for phase, duration in self.phase_durations().items())
+
+    def __repr__(self):
+        return f"WavelengthSetting({self.target_wavelength} nm, {self.phase.value}, {self.describe_phases()})"
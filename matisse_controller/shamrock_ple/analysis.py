@@ -0,0 +1,333 @@
+"""Provides vectorized integration of the spectra taken during a PLE scan."""
+
+import glob
+import os
+import pickle
+
+import numpy as np
+
+from matisse_controller.shamrock_ple.ple_data import PLEData, INDEX_EXTENSION, select_track
+from matisse_controller.shamrock_ple.spectral_axis import SpectralAxis, BUILT_IN_CALIBRATION
+
+# How many times its noise the change in counts across an interval must exceed for adaptive scans to refine it
+MIN_CHANGE_SIGNIFICANCE = 4
+
+
+def load_scan(data_file_path: str, track: int = None):
+    """
+    Load every acquired spectrum of a PLE scan into a single 2-D array.
+
+    Parameters
+    ----------
+    data_file_path : str
+        the path to PLE data (see `matisse_controller.shamrock_ple.ple_data.PLEData`) or a legacy .pickle file
+    track : int
+        the track (or image row) to load from scans with several tracks, or None to add up every track
+
+    Returns
+    -------
+    (ndarray, ndarray, float, int)
+        the laser wavelengths, a (number of wavelengths x number of pixels) array of spectra, and the center wavelength
+        and grating grooves used by the spectrometer
+    """
+    if PLEData.exists(data_file_path):
+        ple_data = PLEData(data_file_path)
+        return ple_data.wavelengths, ple_data.track_spectra(track), ple_data.center_wavelength, ple_data.grating_grooves
+    else:
+        with open(data_file_path, 'rb') as data_file:
+            scans = pickle.load(data_file)
+        if not isinstance(scans, dict) or 'center_wavelength' not in scans:
+            raise ValueError(f"'{data_file_path}' does not contain PLE scan data.")
+        center_wavelength = scans.pop('center_wavelength')
+        grating_grooves = scans.pop('grating_grooves')
+        wavelengths = np.fromiter(scans.keys(), dtype=np.float64, count=len(scans))
+        spectra = np.array(list(scans.values()))
+        return wavelengths, spectra, center_wavelength, grating_grooves
+
+
+def integration_noise(spectrum: np.ndarray, start_pixel: int, end_pixel: int) -> float:
+    """
+    Estimate the standard deviation of the counts of a raw spectrum integrated over a pixel window. This adds up the
+    noise floor of each pixel (read noise and dark current), measured from the scatter between neighboring pixels, and
+    the shot noise of the counts above the median level of the spectrum.
+
+    Parameters
+    ----------
+    spectrum : ndarray
+        the counts for each pixel, or for each track and pixel, before any background is subtracted
+    start_pixel : int
+        the first pixel of the window
+    end_pixel : int
+        the pixel after the last one in the window, like a slice
+
+    Returns
+    -------
+    float
+        the estimated standard deviation of the integrated counts
+    """
+    spectrum = np.asarray(spectrum, dtype=np.float64)
+    spectrum = spectrum.reshape(-1, spectrum.shape[-1])
+    window = spectrum[:, start_pixel:end_pixel]
+    excess = np.clip(window - np.median(spectrum, axis=1, keepdims=True), 0, None)
+    variance = np.sum(excess)
+    if window.shape[1] > 1:
+        # Spectra are smooth from one pixel to the next, so the difference between neighbors is mostly noise. The
+        # median absolute value of a normal distribution is 0.6745 standard deviations.
+        floor = np.median(np.abs(np.diff(window, axis=1)), axis=1) / (0.6745 * np.sqrt(2))
+        variance += np.sum(floor ** 2) * window.shape[1]
+    return float(np.sqrt(variance))
+
+
+def find_refinement_wavelengths(wavelengths, counts, resolution: float, change_fraction: float,
+                                threshold: float = None, decimals: int = None, noise=None) -> np.ndarray:
+    """
+    Choose the wavelengths to add to an adaptive PLE scan. The midpoint of an interval between two neighboring
+    wavelengths is chosen if the integrated counts change quickly across it, or if either end is above the threshold,
+    unless the interval is already narrower than the target resolution.
+
+    Parameters
+    ----------
+    wavelengths
+        the wavelengths acquired so far, in any order
+    counts
+        the integrated counts at each wavelength
+    resolution : float
+        the smallest interval to refine, in nm
+    change_fraction : float
+        the change in counts across an interval, as a fraction of the full range of counts, above which the interval
+        is refined
+    threshold : float
+        the counts above which an interval is refined, or None to ignore how many counts there are
+    decimals : int
+        the number of decimal places to round new wavelengths to
+    noise
+        the standard deviation of the counts at each wavelength (see `integration_noise`). If given, a change must
+        also exceed MIN_CHANGE_SIGNIFICANCE times its noise to be refined, so scans without any resonance aren't
+        refined just because the full range of counts is all noise.
+
+    Returns
+    -------
+    ndarray
+        the new wavelengths, in ascending order, excluding any that have already been acquired
+    """
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.float64)
+    if len(wavelengths) < 2:
+        return np.empty(0)
+    order = np.argsort(wavelengths)
+    wavelengths, counts = wavelengths[order], counts[order]
+
+    changes = np.abs(np.diff(counts))
+    min_changes = change_fraction * np.ptp(counts)
+    if noise is not None:
+        noise = np.asarray(noise, dtype=np.float64)[order]
+        min_changes = np.maximum(min_changes, MIN_CHANGE_SIGNIFICANCE * np.hypot(noise[:-1], noise[1:]))
+    refine = changes > min_changes
+    if threshold is not None:
+        refine |= np.maximum(counts[:-1], counts[1:]) >= threshold
+    # Halving an interval must not go below the resolution (allowing for floating point error in the widths)
+    refine &= np.diff(wavelengths) / 2 >= resolution * (1 - 1e-6)
+
+    midpoints = (wavelengths[:-1][refine] + wavelengths[1:][refine]) / 2
+    if decimals is not None:
+        midpoints = np.round(midpoints, decimals)
+    return np.setdiff1d(midpoints, wavelengths)
+
+
+def results_dtype(num_windows: int) -> np.dtype:
+    return np.dtype([('wavelength', np.float64), ('counts', np.float64, (num_windows,))])
+
+
+def batch_results_dtype(num_windows: int) -> np.dtype:
+    return np.dtype([('scan', 'U256'), ('wavelength', np.float64), ('counts', np.float64, (num_windows,))])
+
+
+def find_scan_files(data_path: str) -> list:
+    """
+    Parameters
+    ----------
+    data_path : str
+        a directory containing PLE scans, or a glob pattern matching PLE scan files
+
+    Returns
+    -------
+    list
+        the sorted paths of the PLE data and legacy .pickle files that were found, one per scan
+    """
+    if os.path.isdir(data_path):
+        file_paths = glob.glob(os.path.join(data_path, '*.npy')) + glob.glob(os.path.join(data_path, '*.pickle'))
+    else:
+        file_paths = glob.glob(data_path)
+    scan_paths = set()
+    for file_path in file_paths:
+        if file_path.endswith('.pickle'):
+            scan_paths.add(file_path)
+        elif PLEData.exists(file_path):
+            scan_paths.add(PLEData.base_path_of(file_path))
+    return sorted(scan_paths)
+
+
+def analyze_scan_file(data_file_path: str, wavelength_windows, background: np.ndarray, track: int = None):
+    """
+    Integrate a single PLE scan over several wavelength windows. Used as the worker function for batch analysis.
+
+    Parameters
+    ----------
+    data_file_path : str
+        the path to the scan data
+    wavelength_windows
+        a sequence of (start wavelength, end wavelength) pairs, in nm
+    background : ndarray
+        counts for each pixel to subtract from every spectrum, or None
+    track : int
+        the track to integrate in scans with several tracks, or None to add up every track
+
+    Returns
+    -------
+    ndarray
+        the results of `PrefixSumIndex.integrate`
+    """
+    index = PrefixSumIndex.load(data_file_path, track)
+    spectral_axis = index.spectral_axis()
+    pixel_windows = [spectral_axis.integration_window(start, end) for start, end in wavelength_windows]
+    return index.integrate(pixel_windows, background)
+
+
+class PrefixSumIndex:
+    """
+    Cumulative sums of every spectrum in a PLE scan along the pixel axis. Once built, the integral of any pixel window
+    for every wavelength takes a single subtraction per spectrum.
+
+    The index is saved next to the scan data, and rebuilt automatically if the scan data has changed since.
+    """
+
+    EXTENSION = '.prefix.npz'
+
+    def __init__(self, wavelengths: np.ndarray, prefix_sums: np.ndarray, center_wavelength: float,
+                 grating_grooves: int, horizontal_binning=1, first_column=0, track: int = None,
+                 calibration_version=BUILT_IN_CALIBRATION):
+        """
+        Parameters
+        ----------
+        wavelengths : ndarray
+            the laser wavelength of each spectrum
+        prefix_sums : ndarray
+            a (number of wavelengths x number of pixels + 1) array, where prefix_sums[:, n] is the sum of the first n
+            pixels of each spectrum
+        center_wavelength : float
+            the center wavelength used by the spectrometer
+        grating_grooves : int
+            the grating grooves used by the spectrometer
+        horizontal_binning : int
+            the number of CCD columns binned into each pixel
+        first_column : int
+            the first CCD column read out, counting from 0
+        track : int
+            the track the spectra were taken from, or None if every track was added up
+        calibration_version : int
+            the version of the spectrometer calibration the spectra were taken with
+        """
+        self.wavelengths = wavelengths
+        self.prefix_sums = prefix_sums
+        self.center_wavelength = center_wavelength
+        self.grating_grooves = grating_grooves
+        self.horizontal_binning = horizontal_binning
+        self.first_column = first_column
+        self.track = track
+        self.calibration_version = calibration_version
+
+    @staticmethod
+    def build(wavelengths: np.ndarray, spectra: np.ndarray, center_wavelength: float, grating_grooves: int,
+              **readout):
+        """
+        Compute the prefix sums of the given (number of wavelengths x number of pixels) array of spectra. Any other
+        kwargs are passed to `PrefixSumIndex.__init__`.
+        """
+        prefix_sums = np.zeros((spectra.shape[0], spectra.shape[1] + 1), dtype=np.int64)
+        np.cumsum(spectra, axis=1, dtype=np.int64, out=prefix_sums[:, 1:])
+        return PrefixSumIndex(np.array(wavelengths, dtype=np.float64), prefix_sums, center_wavelength, grating_grooves,
+                              **readout)
+
+    @staticmethod
+    def load(data_file_path: str, track: int = None) -> 'PrefixSumIndex':
+        """
+        Load the index for the given scan data, building and saving it first if needed.
+
+        Parameters
+        ----------
+        data_file_path : str
+            the path to PLE data (see `matisse_controller.shamrock_ple.ple_data.PLEData`) or a legacy .pickle file
+        track : int
+            the track to index in scans with several tracks, or None to add up every track
+        """
+        readout = {'track': track}
+        if PLEData.exists(data_file_path):
+            base_path = PLEData.base_path_of(data_file_path)
+            # The PLE data index is written last whenever a spectrum is acquired
+            source_mtime = os.path.getmtime(base_path + INDEX_EXTENSION)
+            ple_data = PLEData(base_path)
+            readout.update(horizontal_binning=ple_data.horizontal_binning, first_column=ple_data.first_column,
+                           calibration_version=ple_data.calibration_version)
+        else:
+            base_path = os.path.splitext(data_file_path)[0]
+            source_mtime = os.path.getmtime(data_file_path)
+        track_suffix = '' if track is None else f".track{track}"
+        index_file_path = base_path + track_suffix + PrefixSumIndex.EXTENSION
+
+        if os.path.exists(index_file_path):
+            with np.load(index_file_path) as index_file:
+                if index_file['source_mtime'] == source_mtime:
+                    return PrefixSumIndex(index_file['wavelengths'], index_file['prefix_sums'],
+                                          index_file['center_wavelength'].item(),
+                                          index_file['grating_grooves'].item(), **readout)
+
+        index = PrefixSumIndex.build(*load_scan(data_file_path, track), **readout)
+        try:
+            np.savez(index_file_path, wavelengths=index.wavelengths, prefix_sums=index.prefix_sums,
+                     center_wavelength=index.center_wavelength, grating_grooves=index.grating_grooves,
+                     source_mtime=source_mtime)
+        except OSError as err:
+            print(f"WARNING: Unable to save PLE prefix sum index to {index_file_path}. {err}")
+        return index
+
+    @property
+    def num_pixels(self) -> int:
+        return self.prefix_sums.shape[1] - 1
+
+    def spectral_axis(self) -> SpectralAxis:
+        """The wavelength of each pixel of the indexed spectra."""
+        return SpectralAxis.get(self.center_wavelength, self.grating_grooves, self.calibration_version,
+                                num_pixels=self.num_pixels, horizontal_binning=self.horizontal_binning,
+                                first_column=self.first_column)
+
+    def integrate(self, pixel_windows, background: np.ndarray = None) -> np.ndarray:
+        """
+        Integrate every spectrum over several pixel windows, optionally subtracting background. Windows are clipped to
+        the indexed pixels.
+
+        Parameters
+        ----------
+        pixel_windows
+            a sequence of (start pixel, end pixel) pairs. The end pixel is excluded, like a slice.
+        background : ndarray
+            counts for each pixel to subtract from every spectrum, or for each track and pixel, in which case the
+            background of the indexed track is used
+
+        Returns
+        -------
+        ndarray
+            a structured array with one record per wavelength, holding the 'wavelength' and the integrated 'counts' for
+            each window, in the same order as pixel_windows
+        """
+        if background is not None and np.ndim(background) > 1:
+            background = select_track(background, self.track)
+        pixel_windows = np.clip(np.asarray(pixel_windows, dtype=np.intp).reshape(-1, 2), 0, self.num_pixels)
+        starts = pixel_windows[:, 0]
+        ends = np.maximum(pixel_windows[:, 1], starts)  # Like a slice, a backwards window is empty
+        results = np.empty(len(self.wavelengths), dtype=results_dtype(len(pixel_windows)))
+        results['wavelength'] = self.wavelengths
+        results['counts'] = self.prefix_sums[:, ends] - self.prefix_sums[:, starts]
+        if background is not None:
+            background_sums = np.concatenate(([0], np.cumsum(background, dtype=np.float64)))
+            results['counts'] -= background_sums[ends] - background_sums[starts]
+        return results
@@ -0,0 +1,347 @@
+"""
+Provides a library of spectrometer calibrations, which convert CCD columns to wavelengths with a polynomial fitted to
+the positions of known reference lines, like those of a neon or argon lamp.
+
+Calibrations are stored as .npz files in cfg.PLE_CALIBRATION_DIRECTORY, one per grating, center wavelength and version,
+and are kept in memory once loaded. Versions are numbered in order for each grating, so a version always refers to the
+same calibration, and spectra can be converted again later with the calibration they were taken with. Version 0 is the
+built-in calibration, made of Shamrock.GRATINGS_NM_PER_PIXEL and Shamrock.GRATINGS_OFFSET_NM.
+"""
+
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from numpy.polynomial import polynomial
+
+import matisse_controller.config as cfg
+from matisse_controller.shamrock_ple.shamrock import Shamrock
+
+EXTENSION = '.npz'
+# Wavelengths in air, in nm, of bright lines of common reference lamps
+ARGON_LINES_NM = [696.543, 706.722, 714.704, 727.294, 738.398, 750.387, 751.465, 763.511, 772.376, 794.818, 800.616,
+                  801.479, 810.369, 811.531]
+NEON_LINES_NM = [703.241, 717.394, 724.517, 743.890, 747.244, 748.887, 753.577, 754.404]
+BUILT_IN_VERSION = 0
+DEFAULT_DEGREE = 3
+# The furthest a center wavelength can be from a calibrated one to use its calibration, in nm
+MAX_CENTER_WAVELENGTH_DISTANCE = 10
+# How far a reference line can be from where the current calibration puts it, in pixels
+SEARCH_RADIUS = 15
+# How many times the shot noise of the surrounding counts a reference line must stand out by to be used
+MIN_LINE_SIGNIFICANCE = 5
+
+_FILE_NAME_PATTERN = re.compile(r'^calibration_(\d+)grv_([\d.]+)nm_v(\d+)' + re.escape(EXTENSION) + '$')
+
+_cache = {}
+# For each grating, the (center wavelength, file path) of each calibration version in the calibration directory
+_catalog = None
+_catalog_directory = None
+_lock = threading.RLock()
+
+
+class Calibration:
+    """
+    A polynomial that converts a position on the CCD to a wavelength, for a given grating and center wavelength.
+
+    Positions are measured in CCD columns from the center of the CCD (see
+    `matisse_controller.shamrock_ple.spectral_axis.SpectralAxis.centered_columns`), and the polynomial gives the
+    difference between the wavelength at that position and the center wavelength.
+    """
+
+    # The number of Newton iterations used to convert wavelengths to positions, which is plenty for smooth dispersion
+    INVERSION_ITERATIONS = 5
+
+    def __init__(self, coefficients, grating_grooves: int, center_wavelength: float, version: int = None,
+                 residual_rms: float = 0, num_lines: int = 0, created: float = None):
+        """
+        Parameters
+        ----------
+        coefficients
+            the coefficients of the polynomial, lowest degree first, in nm per column to the power of the degree
+        grating_grooves : int
+            the number of grooves of the calibrated grating
+        center_wavelength : float
+            the center wavelength the spectrometer was set to while calibrating
+        version : int
+            the version of the calibration, or None if it hasn't been saved
+        residual_rms : float
+            the root mean square difference between the fitted and known reference wavelengths, in nm
+        num_lines : int
+            the number of reference lines the polynomial was fitted to
+        created : float
+            the time the reference spectrum was taken, in seconds since the epoch, defaults to now
+        """
+        self.coefficients = np.array(coefficients, dtype=np.float64)
+        self.coefficients.flags.writeable = False
+        self.grating_grooves = int(grating_grooves)
+        self.center_wavelength = float(center_wavelength)
+        self.version = version
+        self.residual_rms = residual_rms
+        self.num_lines = num_lines
+        self.created = time.time() if created is None else created
+        self._derivative = polynomial.polyder(self.coefficients) if len(self.coefficients) > 1 else np.zeros(1)
+
+    @staticmethod
+    def fit(positions, wavelengths, center_wavelength: float, grating_grooves: int,
+            degree: int = DEFAULT_DEGREE) -> 'Calibration':
+        """
+        Fit a polynomial to the measured positions of reference lines with known wavelengths.
+
+        Parameters
+        ----------
+        positions
+            the position of each reference line, in columns from the center of the CCD
+        wavelengths
+            the known wavelength of each reference line, in nm
+        center_wavelength : float
+            the center wavelength the spectrometer was set to
+        grating_grooves : int
+            the number of grooves of the spectrometer grating
+        degree : int
+            the degree of the polynomial, which needs at least one more line than the degree
+
+        Returns
+        -------
+        Calibration
+            the fitted calibration, which has no version until it is saved
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        if len(positions) <= degree:
+            raise ValueError(f"At least {degree + 1} reference lines are needed to fit a polynomial of degree "
+                             f"{degree}, but only {len(positions)} were found.")
+        coefficients = polynomial.polyfit(positions, wavelengths - center_wavelength, degree)
+        residuals = polynomial.polyval(positions, coefficients) + center_wavelength - wavelengths
+        return Calibration(coefficients, grating_grooves, center_wavelength,
+                           residual_rms=float(np.sqrt(np.mean(residuals ** 2))), num_lines=len(positions))
+
+    @staticmethod
+    def built_in(grating_grooves: int, center_wavelength: float) -> 'Calibration':
+        """The linear calibration made of Shamrock.GRATINGS_NM_PER_PIXEL and Shamrock.GRATINGS_OFFSET_NM."""
+        coefficients = [Shamrock.GRATINGS_OFFSET_NM[grating_grooves], Shamrock.GRATINGS_NM_PER_PIXEL[grating_grooves]]
+        return Calibration(coefficients, grating_grooves, center_wavelength, BUILT_IN_VERSION, created=0)
+
+    def to_wavelengths(self, positions, center_wavelength: float = None) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        positions
+            a position in columns from the center of the CCD, or an array of them
+        center_wavelength : float
+            the center wavelength the spectrometer was set to, which defaults to the calibrated one
+
+        Returns
+        -------
+        ndarray
+            the wavelength at each position, in nm
+        """
+        if center_wavelength is None:
+            center_wavelength = self.center_wavelength
+        return polynomial.polyval(np.asarray(positions, dtype=np.float64), self.coefficients) + center_wavelength
+
+    def to_positions(self, wavelengths, center_wavelength: float = None) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        wavelengths
+            a wavelength in nm, or an array of them
+        center_wavelength : float
+            the center wavelength the spectrometer was set to, which defaults to the calibrated one
+
+        Returns
+        -------
+        ndarray
+            the position of each wavelength, in columns from the center of the CCD (which may fall outside the CCD)
+        """
+        if center_wavelength is None:
+            center_wavelength = self.center_wavelength
+        offsets = np.asarray(wavelengths, dtype=np.float64) - center_wavelength
+        if len(self.coefficients) <= 2:
+            return (offsets - self.coefficients[0]) / self.coefficients[-1]
+        # Start from the linear part of the polynomial, then refine with Newton's method
+        positions = (offsets - self.coefficients[0]) / self.coefficients[1]
+        for _ in range(Calibration.INVERSION_ITERATIONS):
+            positions = positions - (polynomial.polyval(positions, self.coefficients) - offsets) / \
+                        polynomial.polyval(positions, self._derivative)
+        return positions
+
+    @property
+    def key(self) -> tuple:
+        return self.grating_grooves, self.version
+
+    def describe(self) -> str:
+        """A short description of the calibration, like 'v3 (1200 grv at 740 nm, 8 lines, 2.1 pm RMS)'."""
+        if self.version == BUILT_IN_VERSION:
+            return f"built-in calibration ({self.grating_grooves} grv)"
+        return f"v{self.version} ({self.grating_grooves} grv at {self.center_wavelength:g} nm, " \
+               f"{self.num_lines} lines, {self.residual_rms * 1000:.1f} pm RMS)"
+
+    @staticmethod
+    def load(file_path: str) -> 'Calibration':
+        with np.load(file_path) as calibration_file:
+            return Calibration(calibration_file['coefficients'], calibration_file['grating_grooves'].item(),
+                               calibration_file['center_wavelength'].item(), calibration_file['version'].item(),
+                               calibration_file['residual_rms'].item(), calibration_file['num_lines'].item(),
+                               calibration_file['created'].item())
+
+    def save(self, file_path: str):
+        np.savez(file_path, coefficients=self.coefficients, grating_grooves=self.grating_grooves,
+                 center_wavelength=self.center_wavelength, version=self.version, residual_rms=self.residual_rms,
+                 num_lines=self.num_lines, created=self.created)
+
+
+def find_reference_lines(spectrum, reference_wavelengths, spectral_axis, search_radius: int = SEARCH_RADIUS):
+    """
+    Locate known reference lines in a spectrum, to sub-pixel precision, near where the given spectral axis puts them.
+    Each line is only searched for up to halfway to the next line, so close pairs of lines aren't mistaken for each
+    other.
+
+    Parameters
+    ----------
+    spectrum
+        the counts of each pixel, with background already subtracted if it isn't flat
+    reference_wavelengths
+        the known wavelengths of the reference lines, in nm
+    spectral_axis : matisse_controller.shamrock_ple.spectral_axis.SpectralAxis
+        the current spectral axis of the spectrum
+    search_radius : int
+        the number of pixels on either side of the expected position of each line to search
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        the positions of the lines that were found, in columns from the center of the CCD, and their known wavelengths
+    """
+    spectrum = np.asarray(spectrum, dtype=np.float64)
+    reference_wavelengths = np.sort(np.asarray(reference_wavelengths, dtype=np.float64))
+    expected_pixels = spectral_axis.to_pixels(reference_wavelengths)
+    gaps = np.abs(np.diff(expected_pixels))
+    radii = np.minimum(np.concatenate(([search_radius], gaps // 2)), np.concatenate((gaps // 2, [search_radius])))
+    positions, wavelengths = [], []
+    for wavelength, expected_pixel, radius in zip(reference_wavelengths, expected_pixels, radii):
+        # Lamps have many lines, so lines that aren't on the CCD at all are expected
+        if not 0 <= expected_pixel < len(spectrum):
+            continue
+        start_pixel = max(expected_pixel - min(radius, search_radius), 0)
+        end_pixel = min(expected_pixel + min(radius, search_radius) + 1, len(spectrum))
+        if end_pixel - start_pixel < 3:
+            print(f"WARNING: Reference line at {wavelength} nm is too close to another line or the edge of the CCD.")
+            continue
+        window = spectrum[start_pixel:end_pixel]
+        peak = int(np.argmax(window))
+        background = np.median(window)
+        if peak in (0, len(window) - 1) or \
+                window[peak] - background < MIN_LINE_SIGNIFICANCE * np.sqrt(max(background, 1)):
+            print(f"WARNING: Reference line at {wavelength} nm not found.")
+            continue
+        # The vertex of the parabola through the peak and its neighbors
+        left, center, right = window[peak - 1:peak + 2]
+        curvature = left - 2 * center + right
+        shift = 0.5 * (left - right) / curvature if curvature != 0 else 0
+        positions.append(spectral_axis.centered_columns(start_pixel + peak + shift))
+        wavelengths.append(wavelength)
+    return np.array(positions, dtype=np.float64), np.array(wavelengths, dtype=np.float64)
+
+
+def file_path_of(grating_grooves: int, center_wavelength: float, version: int) -> str:
+    """The path of the given calibration version, in the configured calibration directory."""
+    file_name = f"calibration_{int(grating_grooves)}grv_{float(center_wavelength):g}nm_v{int(version)}{EXTENSION}"
+    return os.path.join(cfg.get(cfg.PLE_CALIBRATION_DIRECTORY), file_name)
+
+
+def catalog() -> dict:
+    """
+    Returns
+    -------
+    dict
+        for each grating, a dict of the (center wavelength, file path) of each saved calibration, keyed by version. The
+        calibration directory is only listed again if it changes in the configuration.
+    """
+    global _catalog, _catalog_directory
+    directory = cfg.get(cfg.PLE_CALIBRATION_DIRECTORY)
+    with _lock:
+        if _catalog is None or _catalog_directory != directory:
+            _catalog = {}
+            _catalog_directory = directory
+            file_names = os.listdir(directory) if os.path.isdir(directory) else []
+            for file_name in file_names:
+                match = _FILE_NAME_PATTERN.match(file_name)
+                if match:
+                    grating_grooves, center_wavelength, version = match.groups()
+                    _catalog.setdefault(int(grating_grooves), {})[int(version)] = \
+                        (float(center_wavelength), os.path.join(directory, file_name))
+        return _catalog
+
+
+def latest_version(grating_grooves: int, center_wavelength: float) -> int:
+    """
+    Returns
+    -------
+    int
+        the latest version calibrated at the center wavelength closest to the given one, if it is within
+        MAX_CENTER_WAVELENGTH_DISTANCE, or BUILT_IN_VERSION if there is none
+    """
+    versions = catalog().get(int(grating_grooves), {})
+    nearby_versions = [(abs(center - center_wavelength), -version) for version, (center, _) in versions.items()
+                       if abs(center - center_wavelength) <= MAX_CENTER_WAVELENGTH_DISTANCE]
+    if not nearby_versions:
+        return BUILT_IN_VERSION
+    return -min(nearby_versions)[1]
+
+
+def find(grating_grooves: int, center_wavelength: float, version: int = None) -> Calibration:
+    """
+    Parameters
+    ----------
+    grating_grooves : int
+        the number of grooves of the spectrometer grating
+    center_wavelength : float
+        the center wavelength the spectrometer was set to
+    version : int
+        the version of the calibration to use, or None for the latest one (see `latest_version`)
+
+    Returns
+    -------
+    Calibration
+        the requested calibration, or the built-in one if it doesn't exist
+    """
+    if version is None:
+        version = latest_version(grating_grooves, center_wavelength)
+    if version == BUILT_IN_VERSION:
+        return Calibration.built_in(grating_grooves, center_wavelength)
+    versions = catalog().get(int(grating_grooves), {})
+    if version not in versions:
+        print(f"WARNING: No calibration v{version} for the {grating_grooves} grv grating, using the built-in one.")
+        return Calibration.built_in(grating_grooves, center_wavelength)
+    return load(versions[version][1])
+
+
+def save(calibration: Calibration) -> str:
+    """
+    Add a calibration to the library as the next version for its grating, which is assigned to calibration.version.
+
+    Returns
+    -------
+    str
+        the path the calibration was saved to
+    """
+    with _lock:
+        versions = catalog().setdefault(calibration.grating_grooves, {})
+        calibration.version = max(versions.keys(), default=BUILT_IN_VERSION) + 1
+        file_path = file_path_of(calibration.grating_grooves, calibration.center_wavelength, calibration.version)
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        calibration.save(file_path)
+        versions[calibration.version] = (calibration.center_wavelength, file_path)
+        _cache[file_path] = calibration
+    return file_path
+
+
+def load(file_path: str) -> Calibration:
+    """Load the calibration in the given file, or return it from memory if it has been loaded before."""
+    with _lock:
+        if file_path not in _cache:
+            _cache[file_path] = Calibration.load(file_path)
+        return _cache[file_path]
@@ -1,33 +1,94 @@
 import time
+from collections import deque
+from concurrent import futures
 from ctypes import *
 
 import numpy as np
 
 import matisse_controller.config as cfg
 from matisse_controller.shamrock_ple.constants import *
+from matisse_controller.shamrock_ple.cooling import CoolingManager
 from matisse_controller.shamrock_ple.utils import load_lib
 
 
-# TODO: Add action to give live feed from CCD
+class FrameBufferPool:
+    """
+    A fixed number of preallocated frame buffers, handed out in turn so the CCD can read data straight into them
+    without allocating or copying anything.
+
+    A buffer is reused once every other buffer in the pool has been handed out, so anything holding on to a frame for
+    longer than that must copy it. Size the pool for the number of frames that can be in use at once.
+    """
+
+    def __init__(self, num_buffers: int, shape, dtype=np.int32):
+        """
+        Parameters
+        ----------
+        num_buffers : int
+            the number of buffers to allocate
+        shape
+            the shape of each buffer
+        dtype
+            the data type of each buffer
+        """
+        self.buffers = np.empty((num_buffers, *np.atleast_1d(shape)), dtype=dtype)
+        self.next_index = 0
+
+    @property
+    def shape(self) -> tuple:
+        return self.buffers.shape[1:]
+
+    def get(self) -> np.ndarray:
+        """The next buffer in the pool, which may still contain old data."""
+        buffer = self.buffers[self.next_index]
+        self.next_index = (self.next_index + 1) % len(self.buffers)
+        return buffer
+
+
 class CCD:
     LIBRARY_NAME = 'atmcd64d.dll'
     WIDTH = 1024
     HEIGHT = 256
     MIN_TEMP = -120
     MAX_TEMP = -10
+    # How often to check for new frames while streaming acquisitions, in seconds
+    STREAM_POLL_INTERVAL = 0.005
+    # How often to print the temperature while waiting for the CCD to cool down, in seconds
+    COOLING_REPORT_INTERVAL = 10
+    # How often to check the status of an acquisition once it should have finished, in seconds
+    COMPLETION_POLL_INTERVAL = 0.002
+    # The longest to sleep at once while waiting for an acquisition, so the exit flag is still noticed, in seconds
+    EXIT_CHECK_INTERVAL = 0.5
+    MAX_RECORDED_ACQUISITIONS = 1000
+    # The most frames to read out of the circular buffer at once while streaming acquisitions
+    MAX_STREAM_BATCH_SIZE = 64
 
     def __init__(self):
         try:
             self.lib = load_lib(CCD.LIBRARY_NAME)
             self.lib.Initialize()
-            self.lib.SetTemperature(c_int(cfg.get(cfg.PLE_TARGET_TEMPERATURE)))
-            self.lib.CoolerON()
-            self.temperature_ok = False
+            self.cooling = None
             self.exit_flag = False
+            self.exposure_time = None
+            self.acquisition_mode = ACQ_MODE_SINGLE
+            self.readout_mode = READ_MODE_FVB
+            self.frame_shape = (CCD.WIDTH,)
+            self.horizontal_binning = 1
+            self.first_column = 0
+            self.num_dropped_frames = 0
+            self.expected_acquisition_time = 0
+            # (expected, actual) number of seconds taken by each recent single acquisition
+            self.acquisition_times = deque(maxlen=CCD.MAX_RECORDED_ACQUISITIONS)
+            self.buffer_pool = None
 
             num_cameras = c_long()
             self.lib.GetAvailableCameras(pointer(num_cameras))
             assert num_cameras.value > 0, 'No CCD camera found.'
+
+            # Start cooling right away, so the CCD is usually cold by the time anything is acquired
+            self.cooling = CoolingManager(self.lib, daemon=True)
+            self.cooling.start()
+            self.start_cooling(cfg.get(cfg.PLE_TARGET_TEMPERATURE))
         except OSError as err:
             raise RuntimeError('Unable to initialize Andor CCD API.') from err
 
@@ -35,10 +96,17 @@ class CCD:
         self.shutdown()
 
     def setup(self, exposure_time: float, acquisition_mode=ACQ_MODE_SINGLE, readout_mode=READ_MODE_FVB,
-              temperature=-70, cool_down=True):
+              temperature=-70, cool_down=True, horizontal_binning=1, vertical_binning=1, num_tracks=1,
+              track_height=None, track_offset=0, roi=None):
         """
         Perform setup procedures on CCD, like cooling down to a given temperature and setting acquisition parameters.
 
+        Cooling down happens in the background (see `CCD.start_cooling`), so if cooling was started earlier, this only
+        waits for whatever cooling is left.
+
+        Acquisitions are 1-D in FVB and single-track mode, (number of tracks x width) in multi-track mode, and
+        (height x width) in image mode, after binning. See `CCD.frame_shape_of`.
+
         Parameters
         ----------
         exposure_time
@@ -51,34 +119,146 @@ class CCD:
             the desired temperature in degrees centigrade at which to configure the CCD (default is -70)
         cool_down
             whether to cool down the CCD at all (sometimes we don't care, like when taking a single acquisition)
+        horizontal_binning
+            the number of neighboring columns to bin into each pixel, which must divide the width that is read out
+        vertical_binning
+            the number of neighboring rows to bin into each pixel in image mode, which must divide the height that is
+            read out
+        num_tracks
+            the number of tracks to read out in multi-track mode
+        track_height
+            the number of rows in each track in single-track and multi-track mode, defaults to the height of the CCD
+            divided by the number of tracks
+        track_offset
+            the number of rows to shift the tracks up (or down, if negative) from the center of the CCD
+        roi
+            the region to read out in image mode, as (first column, last column, first row, last row), counting from 1
+            and including the last column and row. Defaults to the whole CCD.
         """
+        frame_shape = CCD.frame_shape_of(readout_mode, horizontal_binning, vertical_binning, num_tracks, roi)
         self.exit_flag = False
         if cool_down:
-            min_temp, max_temp = c_int(), c_int()
-            self.lib.GetTemperatureRange(pointer(min_temp), pointer(max_temp))
-            min_temp, max_temp = min_temp.value, max_temp.value
-            assert min_temp < temperature < max_temp, f"Temperature must be set between {min_temp} and {max_temp}"
-
-            self.lib.SetTemperature(c_int(temperature))
-            self.lib.CoolerON()
+            cooled = self.start_cooling(temperature)
             # Cooler stops when temp is within 3 degrees of target, so wait until it's close
             # CCD normally takes a few minutes to fully cool down
-            while not self.temperature_ok:
+            last_report_time = 0
+            while not cooled.done():
                 if self.exit_flag:
                     return
-                current_temp = self.get_temperature()
-                print(f"Cooling CCD. Current temperature is {round(current_temp, 2)} °C")
-                self.temperature_ok = current_temp < temperature + cfg.get(cfg.PLE_TEMPERATURE_TOLERANCE)
-                time.sleep(10)
+                if time.time() - last_report_time >= CCD.COOLING_REPORT_INTERVAL:
+                    print(f"Cooling CCD. Current temperature is {self.cooling.describe_latest_reading()}")
+                    last_report_time = time.time()
+                futures.wait([cooled], timeout=CCD.EXIT_CHECK_INTERVAL)
+            if cooled.cancelled():
+                return
 
         print('Configuring acquisition parameters.')
         self.lib.SetAcquisitionMode(c_int(acquisition_mode))
         self.lib.SetReadMode(c_int(readout_mode))
+        if track_height is None:
+            track_height = CCD.HEIGHT // num_tracks
+        if readout_mode == READ_MODE_FVB:
+            self.lib.SetFVBHBin(c_int(horizontal_binning))
+        elif readout_mode == READ_MODE_SINGLE_TRACK:
+            self.lib.SetSingleTrack(c_int(CCD.HEIGHT // 2 + 1 + track_offset), c_int(track_height))
+            self.lib.SetSingleTrackHBin(c_int(horizontal_binning))
+        elif readout_mode == READ_MODE_MULTI_TRACK:
+            bottom, gap = c_int(), c_int()
+            self.lib.SetMultiTrack(c_int(num_tracks), c_int(track_height), c_int(track_offset), pointer(bottom),
+                                   pointer(gap))
+            self.lib.SetMultiTrackHBin(c_int(horizontal_binning))
+        elif readout_mode == READ_MODE_IMAGE:
+            first_column, last_column, first_row, last_row = roi or (1, CCD.WIDTH, 1, CCD.HEIGHT)
+            self.lib.SetImage(c_int(horizontal_binning), c_int(vertical_binning), c_int(first_column),
+                              c_int(last_column), c_int(first_row), c_int(last_row))
         self.lib.SetVSSpeed(c_int(1))
         self.lib.SetTriggerMode(c_int(TRIGGER_MODE_INTERNAL))
         self.lib.SetExposureTime(c_float(exposure_time))
+        self.exposure_time = exposure_time
+        self.acquisition_mode = acquisition_mode
+        self.readout_mode = readout_mode
+        self.frame_shape = frame_shape
+        self.horizontal_binning = horizontal_binning
+        self.first_column = CCD.first_column_of(readout_mode, roi)
+        self.expected_acquisition_time = self.get_expected_acquisition_time()
         print('CCD ready for acquisition.')
 
+    @staticmethod
+    def frame_shape_of(readout_mode=READ_MODE_FVB, horizontal_binning=1, vertical_binning=1, num_tracks=1,
+                       roi=None) -> tuple:
+        """
+        Parameters
+        ----------
+        readout_mode, horizontal_binning, vertical_binning, num_tracks, roi
+            see `CCD.setup`
+
+        Returns
+        -------
+        tuple
+            the shape of the acquisitions read out with the given settings
+        """
+        if readout_mode == READ_MODE_IMAGE:
+            first_column, last_column, first_row, last_row = roi or (1, CCD.WIDTH, 1, CCD.HEIGHT)
+            assert 1 <= first_column <= last_column <= CCD.WIDTH and 1 <= first_row <= last_row <= CCD.HEIGHT, \
+                f"Image region must be within the {CCD.WIDTH}x{CCD.HEIGHT} CCD."
+            width, height = last_column - first_column + 1, last_row - first_row + 1
+        else:
+            assert readout_mode in (READ_MODE_FVB, READ_MODE_SINGLE_TRACK, READ_MODE_MULTI_TRACK), \
+                f"Unsupported readout mode {readout_mode}."
+            width, height = CCD.WIDTH, 1
+        assert width % horizontal_binning == 0, 'Horizontal binning must divide the width that is read out.'
+        assert height % vertical_binning == 0, 'Vertical binning must divide the height that is read out.'
+        num_pixels = width // horizontal_binning
+        if readout_mode == READ_MODE_IMAGE:
+            return height // vertical_binning, num_pixels
+        elif readout_mode == READ_MODE_MULTI_TRACK:
+            assert 0 < num_tracks <= CCD.HEIGHT, f"Number of tracks must be between 1 and {CCD.HEIGHT}."
+            return num_tracks, num_pixels
+        else:
+            return num_pixels,
+
+    @staticmethod
+    def first_column_of(readout_mode=READ_MODE_FVB, roi=None) -> int:
+        """The index of the first column read out with the given settings (see `CCD.setup`), counting from 0."""
+        if readout_mode == READ_MODE_IMAGE and roi:
+            return roi[0] - 1
+        return 0
+
+    def start_cooling(self, temperature: int) -> futures.Future:
+        """
+        Start cooling the CCD to the given temperature in the background, so other things can be set up in the meantime.
+
+        Parameters
+        ----------
+        temperature : int
+            the desired temperature in degrees centigrade
+
+        Returns
+        -------
+        Future
+            a future that is done once the CCD is within cfg.PLE_TEMPERATURE_TOLERANCE of the temperature, with the
+            temperature it reached as its result
+        """
+        min_temp, max_temp = c_int(), c_int()
+        self.lib.GetTemperatureRange(pointer(min_temp), pointer(max_temp))
+        min_temp, max_temp = min_temp.value, max_temp.value
+        assert min_temp < temperature < max_temp, f"Temperature must be set between {min_temp} and {max_temp}"
+        return self.cooling.cool_to(temperature)
+
+    @property
+    def temperature_ok(self) -> bool:
+        """Whether the CCD has reached the temperature it was last set to cool down to."""
+        return self.cooling is not None and self.cooling.ready
+
+    def temperature_readings(self) -> np.ndarray:
+        """
+        Returns
+        -------
+        ndarray
+            an (N x 3) array of the recent (timestamp, temperature, status) readings taken while cooling, oldest first
+        """
+        return np.array(self.cooling.readings, dtype=np.float64).reshape(-1, 3)
+
     def get_temperature(self) -> float:
         """
         Returns
@@ -90,38 +270,209 @@ class CCD:
         self.lib.GetTemperatureF(pointer(temperature))
         return temperature.value
 
-    def take_acquisition(self, num_points=1024) -> np.ndarray:
+    def get_expected_acquisition_time(self) -> float:
+        """
+        Returns
+        -------
+        float
+            the number of seconds the camera needs for the exposure and readout of a single acquisition, with the
+            current settings
+        """
+        exposure, accumulate, kinetic = c_float(), c_float(), c_float()
+        if self.lib.GetAcquisitionTimings(pointer(exposure), pointer(accumulate), pointer(kinetic)) != \
+                CCDErrorCode.DRV_SUCCESS.value:
+            return 0
+        readout = c_float()
+        if self.lib.GetReadOutTime(pointer(readout)) != CCDErrorCode.DRV_SUCCESS.value:
+            readout.value = 0
+        return exposure.value + readout.value
+
+    def acquisition_latencies(self) -> np.ndarray:
+        """
+        Returns
+        -------
+        ndarray
+            the number of seconds each recent single acquisition took beyond the expected exposure and readout time
+        """
+        times = np.array(self.acquisition_times, dtype=np.float64).reshape(-1, 2)
+        return times[:, 1] - times[:, 0]
+
+    def allocate_buffers(self, num_buffers: int):
+        """
+        Preallocate a pool of buffers for `CCD.take_acquisition` to read into, instead of allocating a new array for
+        every acquisition. Buffers have the frame shape of the current readout settings, so call this after
+        `CCD.setup`. See `FrameBufferPool` for how long each frame stays valid.
+
+        Parameters
+        ----------
+        num_buffers
+            the number of acquisitions that may be in use at once
+        """
+        if self.buffer_pool is None or len(self.buffer_pool.buffers) != num_buffers or \
+                self.buffer_pool.shape != self.frame_shape:
+            self.buffer_pool = FrameBufferPool(num_buffers, self.frame_shape)
+
+    def take_acquisition(self, out: np.ndarray = None) -> np.ndarray:
         """
+        Take a single acquisition. Since the exposure and readout times are known, this sleeps until the acquisition
+        should be finished, then checks its status often so the data is read as soon as it's ready. The time taken is
+        recorded in `CCD.acquisition_times`.
+
+        The data is read straight into the given buffer, the next buffer in the pool set up by
+        `CCD.allocate_buffers`, or a new array, in that order of preference.
+
         Parameters
         ----------
-        num_points
-            the number of pixels to read from the CCD camera - in FVB mode, this is the width of the screen.
+        out
+            a C-contiguous int32 array with the frame shape of the current readout settings to read the data into
 
         Returns
         -------
         ndarray
-            an array of counts for each pixel on the CCD screen
+            an array of counts for each pixel read out, with shape `CCD.frame_shape`. This is a view of the buffer that
+            was read into, reversed along the wavelength axis. If the acquisition is aborted by setting
+            `CCD.exit_flag`, nothing is read and None is returned.
         """
+        if out is not None:
+            assert out.dtype == np.int32 and out.shape == self.frame_shape and out.flags.c_contiguous, \
+                'Output buffer must be a C-contiguous int32 array with the shape of a frame.'
+            buffer = out
+        elif self.buffer_pool is not None and self.buffer_pool.shape == self.frame_shape:
+            buffer = self.buffer_pool.get()
+        else:
+            buffer = np.empty(self.frame_shape, dtype=np.int32)
+
         self.exit_flag = False
+        start_time = time.time()
         self.lib.StartAcquisition()
-        acquisition_array_type = c_int32 * num_points
-        data = acquisition_array_type()
+        expected_end_time = start_time + self.expected_acquisition_time
+        while not self.exit_flag and time.time() < expected_end_time:
+            time.sleep(max(min(expected_end_time - time.time(), CCD.EXIT_CHECK_INTERVAL), 0))
         # self.lib.WaitForAcquisition() does not work, so use a loop instead and check the status.
-        while True:
-            if self.exit_flag:
-                break
+        while not self.exit_flag:
             status = c_int()
             self.lib.GetStatus(pointer(status))
             if status.value == CCDErrorCode.DRV_IDLE.value:
                 break
-            else:
-                time.sleep(1)
-        self.lib.GetAcquiredData(data, c_int(num_points))
-        data = np.flip(np.array(data, dtype=np.int32))  # Data comes out backwards!
-        return data
+            time.sleep(CCD.COMPLETION_POLL_INTERVAL)
+        if self.exit_flag:
+            # The buffer would only hold a partial frame, or whatever was left in it from an earlier one
+            if self.is_acquiring():
+                self.lib.AbortAcquisition()
+            return None
+        self.acquisition_times.append((self.expected_acquisition_time, time.time() - start_time))
+        self.lib.GetAcquiredData(buffer.ctypes.data_as(POINTER(c_int32)), c_ulong(buffer.size))
+        return np.flip(buffer, axis=-1)  # Data comes out backwards!
+
+    def stream_acquisitions(self, num_frames: int = None, kinetic_cycle_time: float = 0):
+        """
+        Acquire a kinetic series of frames, or keep acquiring until stopped if no number of frames is given, yielding
+        each frame as soon as the CCD has stored it in its circular buffer. Exposure and readout settings are the ones
+        given to `CCD.setup`.
+
+        New frames are read out in batches, so a consumer that is briefly slower than the camera catches up without
+        losing frames. If it falls so far behind that frames are overwritten in the circular buffer, those frames are
+        skipped and counted in `CCD.num_dropped_frames`.
+
+        To stop early, set `CCD.exit_flag`, or stop iterating over the generator and close it.
+
+        Frames are views into a buffer that is reused for each batch, so they are only valid until the generator is
+        advanced past the end of the batch. Copy any frames that need to be kept for longer.
+
+        Parameters
+        ----------
+        num_frames
+            the number of frames to acquire, or None to run until stopped
+        kinetic_cycle_time
+            the time between the start of each frame, in seconds. 0 means as fast as the camera can go.
+
+        Yields
+        ------
+        (float, ndarray)
+            the approximate time at which each frame's exposure ended, in seconds since the epoch, and the counts for
+            each pixel, with shape `CCD.frame_shape`
+        """
+        self.exit_flag = False
+        self.num_dropped_frames = 0
+        if num_frames:
+            self.lib.SetAcquisitionMode(c_int(ACQ_MODE_KINETICS))
+            self.lib.SetNumberAccumulations(c_int(1))
+            self.lib.SetNumberKinetics(c_int(num_frames))
+        else:
+            self.lib.SetAcquisitionMode(c_int(ACQ_MODE_UNTIL_ABORT))
+        self.lib.SetKineticCycleTime(c_float(kinetic_cycle_time))
+        # The camera may not be able to go as fast as requested, so ask what it will actually do
+        exposure, accumulate, kinetic = c_float(), c_float(), c_float()
+        self.lib.GetAcquisitionTimings(pointer(exposure), pointer(accumulate), pointer(kinetic))
+
+        batch = np.empty((CCD.MAX_STREAM_BATCH_SIZE, *self.frame_shape), dtype=np.int32)
+        # Andor image indices start at 1
+        next_index = 1
+        self.lib.StartAcquisition()
+        start_time = time.time()
+        try:
+            while not self.exit_flag and not (num_frames and next_index > num_frames):
+                first, last = c_long(), c_long()
+                result = self.lib.GetNumberNewImages(pointer(first), pointer(last))
+                if result != CCDErrorCode.DRV_SUCCESS.value or last.value < next_index:
+                    if not self.is_acquiring():
+                        break
+                    time.sleep(CCD.STREAM_POLL_INTERVAL)
+                    continue
+                if first.value > next_index:
+                    self.num_dropped_frames += first.value - next_index
+                    next_index = first.value
+
+                last_index = min(last.value, next_index + CCD.MAX_STREAM_BATCH_SIZE - 1)
+                frames = batch[:last_index - next_index + 1]
+                valid_first, valid_last = c_long(), c_long()
+                result = self.lib.GetImages(c_long(next_index), c_long(last_index),
+                                            frames.ctypes.data_as(POINTER(c_int32)), c_ulong(frames.size),
+                                            pointer(valid_first), pointer(valid_last))
+                if result != CCDErrorCode.DRV_SUCCESS.value:
+                    # The frames were overwritten while we were reading them
+                    self.num_dropped_frames += len(frames)
+                else:
+                    for index, frame in enumerate(frames, start=next_index):
+                        timestamp = start_time + (index - 1) * kinetic.value + exposure.value
+                        yield timestamp, np.flip(frame, axis=-1)  # Data comes out backwards!
+                next_index = last_index + 1
+        finally:
+            if self.is_acquiring():
+                self.lib.AbortAcquisition()
+            self.lib.SetAcquisitionMode(c_int(self.acquisition_mode))
+
+    def get_most_recent_frame(self) -> np.ndarray:
+        """
+        Read the newest frame in the circular buffer while streaming acquisitions, skipping any older ones.
+
+        Returns
+        -------
+        ndarray
+            an array of counts for each pixel read out, with shape `CCD.frame_shape`, or None if no frame has been
+            acquired yet
+        """
+        data = np.empty(self.frame_shape, dtype=np.int32)
+        result = self.lib.GetMostRecentImage(data.ctypes.data_as(POINTER(c_int32)), c_ulong(data.size))
+        if result != CCDErrorCode.DRV_SUCCESS.value:
+            return None
+        return np.flip(data, axis=-1)
+
+    def is_acquiring(self) -> bool:
+        """
+        Returns
+        -------
+        bool
+            whether the CCD is in the middle of an acquisition
+        """
+        status = c_int()
+        self.lib.GetStatus(pointer(status))
+        return status.value == CCDErrorCode.DRV_ACQUIRING.value
 
     def shutdown(self):
         """Run CCD-related cleanup and shutdown procedures."""
+        if self.cooling is not None:
+            self.cooling.stop()
         self.lib.CoolerOFF()
         # TODO: Before shutting it down, we should wait for temp to hit -20 °C, otherwise it rises too fast
         # In practice, of course, we don't do this :)
@@ -0,0 +1,125 @@
+"""
+Provides a thread that cools the CCD in the background and records its temperature, so the spectrometer and laser can be
+set up while the CCD cools down.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from ctypes import c_float, c_int, pointer
+
+import matisse_controller.config as cfg
+from matisse_controller.shamrock_ple.constants import CCDErrorCode
+
+
+class CoolingManager(threading.Thread):
+    """
+    A thread that reads the CCD temperature at a fixed interval, and resolves a future once the CCD is within
+    cfg.PLE_TEMPERATURE_TOLERANCE of its target temperature.
+
+    Every reading is kept as a (timestamp, temperature, status) tuple, where status is the `CCDErrorCode` returned by
+    GetTemperatureF, like DRV_TEMPERATURE_STABILIZED or DRV_TEMPERATURE_NOT_REACHED.
+    """
+
+    # How often to read the temperature, in seconds
+    POLL_INTERVAL = 1.0
+    MAX_RECORDED_READINGS = 3600
+
+    def __init__(self, lib, *args, **kwargs):
+        """
+        Parameters
+        ----------
+        lib
+            the Andor CCD library, already initialized
+        *args
+            args to pass to `Thread.__init__`
+        **kwargs
+            kwargs to pass to `Thread.__init__`
+        """
+        super().__init__(*args, **kwargs)
+        self.lib = lib
+        self.target_temperature = None
+        self.readings = deque(maxlen=CoolingManager.MAX_RECORDED_READINGS)
+        self._cooled = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            temperature = c_float()
+            status = self.lib.GetTemperatureF(pointer(temperature))
+            reading = (time.time(), temperature.value, status)
+            self.readings.append(reading)
+            with self._lock:
+                cooled = self._cooled
+                if cooled is not None and not cooled.done() and \
+                        temperature.value < self.target_temperature + cfg.get(cfg.PLE_TEMPERATURE_TOLERANCE):
+                    cooled.set_result(temperature.value)
+            self._wake.wait(CoolingManager.POLL_INTERVAL)
+
+    def cool_to(self, temperature: int) -> Future:
+        """
+        Turn on the cooler and start cooling the CCD to the given temperature, without waiting for it.
+
+        Parameters
+        ----------
+        temperature : int
+            the target temperature, in degrees centigrade
+
+        Returns
+        -------
+        Future
+            a future whose result is the temperature of the CCD once it's within cfg.PLE_TEMPERATURE_TOLERANCE of the
+            target. If the target is changed before then, the same future waits for the new target instead.
+        """
+        with self._lock:
+            if self._cooled is None or (self._cooled.done() and temperature != self.target_temperature):
+                self._cooled = Future()
+            self.target_temperature = temperature
+            self.lib.SetTemperature(c_int(temperature))
+            self.lib.CoolerON()
+            cooled = self._cooled
+        # Check the temperature now instead of at the next interval, in case the CCD is already cold enough
+        self._wake.set()
+        return cooled
+
+    @property
+    def cooled(self) -> Future:
+        """The future for the current target temperature, or None if cooling hasn't been started."""
+        return self._cooled
+
+    @property
+    def ready(self) -> bool:
+        """Whether the CCD has reached its current target temperature."""
+        cooled = self._cooled
+        return cooled is not None and cooled.done() and not cooled.cancelled()
+
+    @property
+    def latest_reading(self) -> tuple:
+        """The most recent (timestamp, temperature, status) reading, or None if the temperature hasn't been read yet."""
+        return self.readings[-1] if self.readings else None
+
+    def describe_latest_reading(self) -> str:
+        """A short description of the latest reading, like '-65.2 °C (DRV_TEMPERATURE_NOT_REACHED)'."""
+        reading = self.latest_reading
+        if reading is None:
+            return 'no reading yet'
+        _, temperature, status = reading
+        try:
+            status = CCDErrorCode(status).name
+        except ValueError:
+            pass
+        return f"{round(temperature, 2)} °C ({status})"
+
+    def stop(self):
+        """Stop reading the temperature and wait for the thread to exit, cancelling anything still waiting to cool."""
+        self._stopped.set()
+        self._wake.set()
+        with self._lock:
+            if self._cooled is not None:
+                self._cooled.cancel()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
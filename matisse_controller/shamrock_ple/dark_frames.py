@@ -0,0 +1,179 @@
+"""
+Provides a library of master dark frames for subtracting background from CCD acquisitions.
+
+A master dark is the per-pixel mean and standard deviation of several frames taken with the shutter closed (or the
+laser blocked). Master darks are stored as .npz files in cfg.PLE_DARK_FRAME_DIRECTORY, one per combination of exposure
+time, CCD temperature, readout mode and grating, and are kept in memory once loaded.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+import matisse_controller.config as cfg
+
+EXTENSION = '.npz'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class MasterDark:
+    """The mean and standard deviation of each pixel over several dark frames, and the settings they were taken with."""
+
+    def __init__(self, mean: np.ndarray, sigma: np.ndarray, num_frames: int, exposure_time: float, temperature: int,
+                 readout_mode: int, grating_grooves: int, created: float = None):
+        """
+        Parameters
+        ----------
+        mean : ndarray
+            the mean counts of each pixel
+        sigma : ndarray
+            the standard deviation of the counts of each pixel
+        num_frames : int
+            the number of frames that were averaged
+        exposure_time : float
+            the exposure time of each frame, in seconds
+        temperature : int
+            the temperature the CCD was set to, in degrees centigrade
+        readout_mode : int
+            the CCD readout mode
+        grating_grooves : int
+            the number of grooves of the spectrometer grating
+        created : float
+            the time the frames were taken, in seconds since the epoch, defaults to now
+        """
+        self.mean = mean
+        self.sigma = sigma
+        self.mean.flags.writeable = False
+        self.sigma.flags.writeable = False
+        self.num_frames = num_frames
+        self.exposure_time = exposure_time
+        self.temperature = temperature
+        self.readout_mode = readout_mode
+        self.grating_grooves = grating_grooves
+        self.created = time.time() if created is None else created
+
+    @staticmethod
+    def reduce(frames, exposure_time: float, temperature: int, readout_mode: int,
+               grating_grooves: int) -> 'MasterDark':
+        """
+        Combine dark frames into a master dark, one frame at a time so they never all need to be in memory.
+
+        Parameters
+        ----------
+        frames
+            an iterable of arrays of counts, like the acquisitions from the CCD
+        exposure_time, temperature, readout_mode, grating_grooves
+            see `MasterDark.__init__`
+
+        Returns
+        -------
+        MasterDark
+            the master dark for the given frames, or None if there were no frames
+        """
+        # Welford's algorithm, which is numerically stable even for large counts
+        num_frames = 0
+        mean = None
+        sum_of_squares = None
+        for frame in frames:
+            frame = np.asarray(frame, dtype=np.float64)
+            num_frames += 1
+            if mean is None:
+                mean = frame.copy()
+                sum_of_squares = np.zeros_like(frame)
+            else:
+                delta = frame - mean
+                mean += delta / num_frames
+                sum_of_squares += delta * (frame - mean)
+        if num_frames == 0:
+            return None
+        sigma = np.sqrt(sum_of_squares / (num_frames - 1)) if num_frames > 1 else np.zeros_like(mean)
+        return MasterDark(mean, sigma, num_frames, exposure_time, temperature, readout_mode, grating_grooves)
+
+    @property
+    def key(self) -> tuple:
+        return key_of(self.exposure_time, self.temperature, self.readout_mode, self.grating_grooves)
+
+    @staticmethod
+    def load(file_path: str) -> 'MasterDark':
+        with np.load(file_path) as dark_file:
+            return MasterDark(dark_file['mean'], dark_file['sigma'], dark_file['num_frames'].item(),
+                              dark_file['exposure_time'].item(), dark_file['temperature'].item(),
+                              dark_file['readout_mode'].item(), dark_file['grating_grooves'].item(),
+                              dark_file['created'].item())
+
+    def save(self, file_path: str):
+        np.savez(file_path, mean=self.mean, sigma=self.sigma, num_frames=self.num_frames,
+                 exposure_time=self.exposure_time, temperature=self.temperature, readout_mode=self.readout_mode,
+                 grating_grooves=self.grating_grooves, created=self.created)
+
+
+def key_of(exposure_time: float, temperature: int, readout_mode: int, grating_grooves: int) -> tuple:
+    """The settings that identify a master dark, normalized so that equal settings give equal keys."""
+    return round(float(exposure_time), 6), int(temperature), int(readout_mode), int(grating_grooves)
+
+
+def file_path_of(exposure_time: float, temperature: int, readout_mode: int, grating_grooves: int) -> str:
+    """The path of the master dark for the given settings, in the configured dark frame directory."""
+    exposure_time, temperature, readout_mode, grating_grooves = key_of(exposure_time, temperature, readout_mode,
+                                                                       grating_grooves)
+    file_name = f"dark_{exposure_time:g}s_{temperature}C_read{readout_mode}_{grating_grooves}grv{EXTENSION}"
+    return os.path.join(cfg.get(cfg.PLE_DARK_FRAME_DIRECTORY), file_name)
+
+
+def save(master_dark: MasterDark) -> str:
+    """
+    Add a master dark to the library, replacing any with the same settings.
+
+    Returns
+    -------
+    str
+        the path the master dark was saved to
+    """
+    file_path = file_path_of(*master_dark.key)
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    master_dark.save(file_path)
+    with _cache_lock:
+        _cache[file_path] = master_dark
+    return file_path
+
+
+def load(file_path: str) -> MasterDark:
+    """Load the master dark in the given file, or return it from memory if it has been loaded before."""
+    with _cache_lock:
+        if file_path not in _cache:
+            _cache[file_path] = MasterDark.load(file_path)
+        return _cache[file_path]
+
+
+def find(exposure_time: float, temperature: int, readout_mode: int, grating_grooves: int) -> MasterDark:
+    """
+    Returns
+    -------
+    MasterDark
+        the master dark taken with the given settings, or None if there isn't one
+    """
+    file_path = file_path_of(exposure_time, temperature, readout_mode, grating_grooves)
+    with _cache_lock:
+        if file_path in _cache:
+            return _cache[file_path]
+    if not os.path.exists(file_path):
+        return None
+    return load(file_path)
+
+
+def load_background(file_path: str) -> np.ndarray:
+    """
+    Load background counts from a master dark (.npz) or a text file loadable with numpy.loadtxt.
+
+    Returns
+    -------
+    ndarray
+        the counts of each pixel to subtract
+    """
+    if file_path.endswith(EXTENSION):
+        return load(file_path).mean
+    return np.loadtxt(file_path)
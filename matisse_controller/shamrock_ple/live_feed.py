@@ -0,0 +1,108 @@
+"""
+Provides a ring of CCD frames in shared memory, so a live feed can be plotted by another process without sending every
+frame through a pipe.
+"""
+
+import multiprocessing
+from ctypes import c_double, c_int32, c_longlong
+
+import numpy as np
+
+
+class FrameRing:
+    """
+    A fixed number of frame slots in shared memory, written in turn by a single producer and read by any number of
+    processes, along with the producer's frame rate and dropped frame counters.
+
+    Readers only ever ask for the latest frame, so a slow reader skips frames instead of holding up the producer. Pass
+    the ring to a process when creating it, so the shared memory is inherited rather than copied.
+    """
+
+    DEFAULT_NUM_SLOTS = 4
+
+    def __init__(self, frame_shape, num_slots=DEFAULT_NUM_SLOTS):
+        """
+        Parameters
+        ----------
+        frame_shape
+            the number of pixels in each frame, or the shape of each frame if it has several tracks
+        num_slots : int
+            the number of frames to keep, at least 2 so a frame can be read while the next is written
+        """
+        assert num_slots >= 2, 'A frame ring needs at least 2 slots.'
+        self.frame_shape = tuple(int(size) for size in np.atleast_1d(frame_shape))
+        self.num_slots = num_slots
+        self._frames = multiprocessing.RawArray(c_int32, num_slots * int(np.prod(self.frame_shape)))
+        self._frames_written = multiprocessing.RawValue(c_longlong, 0)
+        self._dropped_frames = multiprocessing.RawValue(c_longlong, 0)
+        self._frame_rate = multiprocessing.RawValue(c_double, 0)
+        self._stopped = multiprocessing.Event()
+
+    @property
+    def frames(self) -> np.ndarray:
+        """A (number of slots x frame shape) view of the shared frame slots."""
+        return np.frombuffer(self._frames, dtype=np.int32).reshape(self.num_slots, *self.frame_shape)
+
+    @property
+    def frames_written(self) -> int:
+        return self._frames_written.value
+
+    @property
+    def dropped_frames(self) -> int:
+        return self._dropped_frames.value
+
+    @property
+    def frame_rate(self) -> float:
+        return self._frame_rate.value
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def write(self, frame: np.ndarray, dropped_frames: int, frame_rate: float):
+        """
+        Copy a frame into the next slot and update the counters. Only one process may write to the ring.
+
+        Parameters
+        ----------
+        frame : ndarray
+            the counts for each pixel
+        dropped_frames : int
+            the number of frames the producer has lost so far
+        frame_rate : float
+            the number of frames the producer is currently acquiring per second
+        """
+        frames_written = self._frames_written.value
+        self.frames[frames_written % self.num_slots] = frame
+        self._dropped_frames.value = dropped_frames
+        self._frame_rate.value = frame_rate
+        # Only publish the frame once it has been completely written
+        self._frames_written.value = frames_written + 1
+
+    def read_latest(self, last_index: int = None):
+        """
+        Copy the most recently written frame, if there is a new one.
+
+        Parameters
+        ----------
+        last_index : int
+            the index of the last frame read, or None if nothing has been read yet
+
+        Returns
+        -------
+        (int, ndarray)
+            the index of the frame and a copy of its counts, or None if no frame has been written since last_index
+        """
+        while True:
+            frames_written = self._frames_written.value
+            if frames_written == 0 or frames_written - 1 == last_index:
+                return None
+            index = frames_written - 1
+            frame = self.frames[index % self.num_slots].copy()
+            # The producer only starts overwriting this slot once every other slot has been written again
+            if self._frames_written.value - index < self.num_slots:
+                return index, frame
+
+    def stop(self):
+        """Tell readers that no more frames will be written."""
+        self._stopped.set()
@@ -0,0 +1,66 @@
+"""Provides worker stages that take slow, non-critical work (like saving and plotting) off the PLE acquisition loop."""
+
+import threading
+from queue import Queue
+
+
+class PipelineStage(threading.Thread):
+    """
+    A thread that runs a function on each item placed in its bounded queue, in order.
+
+    If the queue is full, `PipelineStage.put` blocks until there is room, so a slow stage can never fall arbitrarily far
+    behind the acquisitions feeding it. Errors raised while processing an item are printed, and the stage moves on to
+    the next item. A critical stage, like saving, instead records the first error in `PipelineStage.error` and skips
+    every item after it, so the caller can stop feeding it.
+    """
+
+    DEFAULT_MAX_QUEUE_SIZE = 16
+
+    def __init__(self, name: str, function, max_queue_size=DEFAULT_MAX_QUEUE_SIZE, *args, critical=False, **kwargs):
+        """
+        Parameters
+        ----------
+        name : str
+            a short description of the stage, used in warnings
+        function
+            a function to call with each item
+        max_queue_size : int
+            the number of items that may wait to be processed
+        critical : bool
+            whether to stop processing items after the first error
+        *args
+            args to pass to `Thread.__init__`
+        **kwargs
+            kwargs to pass to `Thread.__init__`
+        """
+        super().__init__(*args, name=name, **kwargs)
+        self.function = function
+        self.items = Queue(maxsize=max_queue_size)
+        self.critical = critical
+        # The first error raised by a critical stage, after which it skips the remaining items
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.items.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.function(*item)
+            except Exception as err:
+                if self.critical:
+                    print(f"WARNING: PLE {self.name} stage failed, skipping the rest of its work. {err}")
+                    self.error = err
+                else:
+                    print(f"WARNING: PLE {self.name} stage failed. {err}")
+
+    def put(self, *item):
+        """Queue the given arguments to be passed to the stage's function."""
+        self.items.put(item)
+
+    def finish(self):
+        """Process all remaining items and wait for the thread to exit."""
+        self.items.put(None)
+        self.join()
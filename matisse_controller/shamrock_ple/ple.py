@@ -1,14 +1,23 @@
+import inspect
 import os
 import pickle
 import time
+from collections import deque
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from multiprocessing import Pipe
 
 import numpy as np
 
 import matisse_controller.config as cfg
+from matisse_controller.shamrock_ple import analysis, calibration, dark_frames
 from matisse_controller.shamrock_ple.ccd import CCD
+from matisse_controller.shamrock_ple.live_feed import FrameRing
+from matisse_controller.shamrock_ple.pipeline import PipelineStage
+from matisse_controller.shamrock_ple.ple_data import PLEData, DATA_EXTENSION
 from matisse_controller.shamrock_ple.plotting import *
 from matisse_controller.shamrock_ple.shamrock import Shamrock
+from matisse_controller.shamrock_ple.spectral_axis import SpectralAxis
 
 ccd: CCD = None
 shamrock: Shamrock = None
@@ -18,9 +27,18 @@ shamrock: Shamrock = None
 class PLE:
     """PLE scanning functionality with the Andor Shamrock and Newton CCD."""
 
+    # How often to check for the exit flag while waiting for the laser, in seconds
+    EXIT_CHECK_INTERVAL = 0.5
+    # How long to wait for the RefCell to reach a wavelength in a fine scan before retuning the laser, in seconds
+    FINE_SCAN_TIMEOUT = 30
+    # The number of recent frames over which to measure the frame rate of the live feed
+    LIVE_FEED_FRAME_RATE_WINDOW = 20
+
     def __init__(self, matisse):
         self.matisse = matisse
         self.ple_exit_flag = False
+        # The wavelength last set with Matisse.set_wavelength during a fine scan
+        self.fine_scan_segment_start = None
         self.analysis_plot_processes = []
         self.spectrum_plot_processes = []
 
@@ -51,12 +69,26 @@ class PLE:
 
     def start_ple_scan(self, scan_name: str, scan_location: str, initial_wavelength: float, final_wavelength: float,
                        step: float, center_wavelength: float, grating_grooves: int, *ccd_args, plot_analysis=False,
-                       integration_start=None, integration_end=None, **ccd_kwargs):
+                       integration_start=None, integration_end=None, adaptive=False, adaptive_resolution=None,
+                       adaptive_change_fraction=0.1, adaptive_threshold=None, fine_scan=False, **ccd_kwargs):
         """
         Perform a PLE scan using the Andor Shamrock spectrometer and Newton CCD.
 
-        Generates text files with data from each spectrum taken during the scan, and pickles the Python dictionary of
-        all data into {scan_name}.pickle.
+        Writes each spectrum to {scan_name}.npy as soon as it is acquired, along with the wavelength axis, acquisition
+        times and scan metadata (see `matisse_controller.shamrock_ple.ple_data.PLEData`).
+
+        Saving and plotting run on separate `matisse_controller.shamrock_ple.pipeline.PipelineStage` threads, so the
+        laser starts moving to the next wavelength as soon as each spectrum has been read out from the CCD.
+
+        In adaptive mode, the wavelengths from initial_wavelength to final_wavelength are only a first pass. Afterwards,
+        wavelengths are added halfway between neighboring ones wherever the integrated counts change quickly or exceed a
+        threshold (see `matisse_controller.shamrock_ple.analysis.find_refinement_wavelengths`), until no interval that
+        needs refining is wider than the resolution.
+
+        In fine scan mode, the laser stays locked, and wavelengths within cfg.SMALL_WAVELENGTH_DRIFT of the last one set
+        with `matisse_controller.matisse.matisse.Matisse.set_wavelength` are reached by moving the reference cell alone
+        (see `matisse_controller.matisse.matisse.Matisse.fine_tune_wavelength`). The laser is only fully retuned at the
+        end of each of these segments, or when the reference cell reaches a limit.
 
         Parameters
         ----------
@@ -80,6 +112,17 @@ class PLE:
             the wavelength at which to start integration for real-time analysis plotting
         integration_end : float
             the wavelength at which to stop integration for real-time analysis plotting
+        adaptive : bool
+            whether to refine the scan around resonances, using the integration region to find them
+        adaptive_resolution : float
+            the smallest wavelength step to refine to in adaptive mode
+        adaptive_change_fraction : float
+            the change in integrated counts between neighboring wavelengths, as a fraction of the full range of counts,
+            above which to refine in adaptive mode
+        adaptive_threshold : float
+            the integrated counts above which to refine in adaptive mode, or None to only refine where counts change
+        fine_scan : bool
+            whether to step between nearby wavelengths with the reference cell alone
         *ccd_args
             args to pass to `matisse_controller.shamrock_ple.ccd.CCD.setup`
         **ccd_kwargs
@@ -94,23 +137,105 @@ class PLE:
             print('WARNING: Location of PLE scan is required.')
             return
 
-        data_file_name = os.path.join(scan_location, f"{scan_name}.pickle")
+        data_base_path = os.path.join(scan_location, scan_name)
 
-        if os.path.exists(data_file_name):
+        if PLEData.exists(data_base_path) or os.path.exists(f"{data_base_path}.pickle"):
             print(f"WARNING: A PLE scan has already been run for '{scan_name}'. Choose a new name and try again.")
             return
 
+        wavelengths = np.append(np.arange(initial_wavelength, final_wavelength, step), final_wavelength)
+        wavelengths = np.round(wavelengths, cfg.get(cfg.WAVEMETER_PRECISION))
+        # The last step can round to the final wavelength, so drop repeats while keeping the scan order
+        _, first_indices = np.unique(wavelengths, return_index=True)
+        wavelengths = wavelengths[np.sort(first_indices)]
+
+        if adaptive:
+            if integration_start is None or integration_end is None:
+                print('WARNING: Adaptive PLE scans need an integration region to find resonances.')
+                return
+            if not adaptive_resolution or adaptive_resolution <= 0:
+                print('WARNING: Adaptive PLE scans need a positive resolution.')
+                return
+            # Leave room for a uniform scan at the target resolution, which refinement can never exceed
+            capacity = len(wavelengths) + int(np.ceil(abs(final_wavelength - initial_wavelength) / adaptive_resolution))
+        else:
+            capacity = None
+
+        settings = PLE.ccd_settings(ccd_args, ccd_kwargs)
+        frame_shape = CCD.frame_shape_of(settings['readout_mode'], settings['horizontal_binning'],
+                                         settings['vertical_binning'], settings['num_tracks'], settings['roi'])
+        ple_data = PLEData.create(data_base_path, wavelengths, frame_shape, capacity=capacity, scan_name=scan_name,
+                                  initial_wavelength=initial_wavelength, final_wavelength=final_wavelength, step=step,
+                                  center_wavelength=center_wavelength, grating_grooves=grating_grooves,
+                                  plot_analysis=plot_analysis, integration_start=integration_start,
+                                  integration_end=integration_end, adaptive=adaptive,
+                                  adaptive_resolution=adaptive_resolution,
+                                  adaptive_change_fraction=adaptive_change_fraction,
+                                  adaptive_threshold=adaptive_threshold, fine_scan=fine_scan,
+                                  horizontal_binning=settings['horizontal_binning'],
+                                  first_column=CCD.first_column_of(settings['readout_mode'], settings['roi']),
+                                  calibration_version=calibration.latest_version(grating_grooves, center_wavelength),
+                                  ccd_args=list(ccd_args), ccd_kwargs=ccd_kwargs)
+        self.run_ple_scan(ple_data)
+
+    def resume_ple_scan(self, scan_name: str, scan_location=''):
+        """
+        Continue a PLE scan that was stopped or interrupted, using the settings it was started with. Wavelengths that
+        were already acquired are skipped, and adaptive scans carry on refining from where they left off.
+
+        Parameters
+        ----------
+        scan_name
+            the name of the PLE measurement to resume, or the path to any of its data files
+        scan_location
+            the folder containing the scan data, if not included in scan_name
+        """
+        self.ple_exit_flag = False
+
+        data_base_path = os.path.join(scan_location, scan_name)
+        if not PLEData.exists(data_base_path):
+            print(f"WARNING: No PLE scan data found for '{scan_name}'.")
+            return
+
+        ple_data = PLEData(data_base_path, mode='r+')
+        num_remaining = ple_data.num_planned - ple_data.num_acquired
+        if num_remaining == 0 and not ple_data.metadata.get('adaptive', False):
+            print(f"PLE scan '{scan_name}' has already been completed.")
+            return
+        print(f"Resuming PLE scan '{scan_name}' with {num_remaining} acquisition(s) remaining.")
+        self.run_ple_scan(ple_data)
+
+    def run_ple_scan(self, ple_data: PLEData):
+        """
+        Acquire a spectrum at every wavelength of the given PLE data that has not been acquired yet, using the settings
+        stored in its metadata. Each spectrum is checkpointed to disk as soon as it is saved, so the scan can be resumed
+        with `PLE.resume_ple_scan` if it is interrupted.
+
+        Parameters
+        ----------
+        ple_data
+            the PLE data to fill in, opened for writing
+        """
+        metadata = ple_data.metadata
+        center_wavelength = metadata['center_wavelength']
+        grating_grooves = metadata['grating_grooves']
+        plot_analysis = metadata['plot_analysis']
+        adaptive = metadata.get('adaptive', False)
+        fine_scan = metadata.get('fine_scan', False)
+        self.fine_scan_segment_start = None
+
         PLE.load_andor_libs()
+        # The CCD cools and the spectrometer moves in the background while the laser is tuned to the first wavelength
+        PLE.start_cooling(metadata['ccd_args'], metadata['ccd_kwargs'])
         print(f"Setting spectrometer grating to {grating_grooves} grvs and center wavelength to {center_wavelength}...")
-        shamrock.set_grating_grooves(grating_grooves)
-        shamrock.set_center_wavelength(center_wavelength)
-        if self.ple_exit_flag:
+        spectrometer_moved = shamrock.move_to(grating_grooves, center_wavelength)
+        rows_to_acquire = ple_data.rows_to_acquire()
+        if len(rows_to_acquire) > 0:
+            self.lock_at_wavelength(float(ple_data.index['wavelength'][rows_to_acquire[0]]), fine_scan)
+        if not self.wait_for_future(spectrometer_moved):
             return
-        ccd.setup(*ccd_args, **ccd_kwargs)
-        wavelengths = np.append(np.arange(initial_wavelength, final_wavelength, step), final_wavelength)
-        wavelength_range = abs(round(final_wavelength - initial_wavelength, cfg.get(cfg.WAVEMETER_PRECISION)))
-        counter = 1
-        file_name = ''
+        spectrometer_moved.result()
+        ccd.setup(*metadata['ccd_args'], **metadata['ccd_kwargs'])
 
         pl_pipe_in, pl_pipe_out = Pipe()
         pl_plot_process = SpectrumPlotProcess(pipe=pl_pipe_out, daemon=True)
@@ -123,50 +248,198 @@ class PLE:
             self.analysis_plot_processes.append(analysis_plot_process)
             analysis_plot_process.start()
 
-        data = {
-            'grating_grooves': grating_grooves,
-            'center_wavelength': center_wavelength
-        }
-        for wavelength in wavelengths:
-            print(f"Starting acquisition {counter}/{len(wavelengths)}.")
-            wavelength = round(float(wavelength), cfg.get(cfg.WAVEMETER_PRECISION))
-            self.lock_at_wavelength(wavelength)
-            if self.ple_exit_flag:
-                print('Received exit signal, saving PLE data.')
-                break
-            acquisition_data = ccd.take_acquisition()  # FVB mode bins into each column, so this only grabs points along width
-            file_name = os.path.join(scan_location, f"{str(counter).zfill(3)}_{scan_name}_{wavelength}nm"
-                                                    f"_StepSize_{step}nm_Range_{wavelength_range}nm.txt")
-            np.savetxt(file_name, acquisition_data)
-
-            acq_wavelengths = self.pixels_to_wavelengths(range(len(acquisition_data)), center_wavelength, grating_grooves)
-            pl_pipe_in.send((acq_wavelengths, acquisition_data))
-
+        spectral_axis = SpectralAxis.get(center_wavelength, grating_grooves, ple_data.calibration_version,
+                                         num_pixels=ple_data.num_pixels,
+                                         horizontal_binning=ple_data.horizontal_binning,
+                                         first_column=ple_data.first_column)
+        acq_wavelengths = spectral_axis.wavelengths
+        # The raw spectra are saved, but live plots and adaptive refinement have background subtracted
+        master_dark = PLE.find_master_dark(metadata, ple_data.frame_shape)
+        background = None
+        if master_dark is not None:
+            print(f"Subtracting master dark of {master_dark.num_frames} frame(s) from live analysis.")
+            background = master_dark.mean
+        # The integrated counts of every track at each wavelength, for plotting and for finding where to refine
+        # adaptive scans
+        integrated_counts = None
+        # The estimated noise of the integrated counts at each wavelength, so adaptive scans don't refine noise
+        integrated_noise = None
+        if plot_analysis or adaptive:
+            start_pixel, end_pixel = spectral_axis.integration_window(metadata['integration_start'],
+                                                                      metadata['integration_end'])
+            background_counts = 0 if background is None else np.sum(background[..., start_pixel:end_pixel])
+            previous_counts = np.sum(ple_data.track_spectra()[:, start_pixel:end_pixel], axis=1) - background_counts
+            integrated_counts = dict(zip(ple_data.wavelengths.tolist(), previous_counts.tolist()))
+            if adaptive:
+                integrated_noise = {wavelength: analysis.integration_noise(spectrum, start_pixel, end_pixel)
+                                    for wavelength, spectrum in zip(integrated_counts, ple_data.track_spectra())}
             if plot_analysis:
-                start_pixel, end_pixel = self.find_integration_endpoints(integration_start, integration_end,
-                                                                         center_wavelength, grating_grooves)
-                analysis_pipe_in.send((wavelength, sum(acquisition_data[start_pixel:end_pixel])))
+                # Show anything acquired before the scan was resumed
+                for wavelength, counts in integrated_counts.items():
+                    analysis_pipe_in.send((wavelength, counts))
 
-            data[wavelength] = acquisition_data
-            counter += 1
+        def plot_acquisition(wavelength, acquisition_data, counts):
+            if background is not None:
+                acquisition_data = acquisition_data - background
+            pl_pipe_in.send((acq_wavelengths, acquisition_data))
+            if plot_analysis:
+                analysis_pipe_in.send((wavelength, counts))
+
+        # Every acquisition waiting in a stage, being processed by one, or being taken needs its own buffer
+        ccd.allocate_buffers(2 * (PipelineStage.DEFAULT_MAX_QUEUE_SIZE + 1) + 1)
+        saving_stage = PipelineStage('saving', ple_data.write, daemon=True, critical=True)
+        plotting_stage = PipelineStage('plotting', plot_acquisition, daemon=True)
+        saving_stage.start()
+        plotting_stage.start()
+
+        def acquire(rows):
+            for row in rows:
+                if saving_stage.error is not None:
+                    # Don't keep acquiring spectra that can't be saved
+                    print('WARNING: PLE data could not be saved, stopping PLE scan.')
+                    self.ple_exit_flag = True
+                    return
+                print(f"Starting acquisition {row + 1}/{ple_data.num_planned}.")
+                wavelength = float(ple_data.index['wavelength'][row])
+                if not self.lock_at_wavelength(wavelength, fine_scan):
+                    if self.ple_exit_flag:
+                        print('Received exit signal, saving PLE data.')
+                    else:
+                        # Never acquire at a wavelength the laser isn't locked to
+                        print(f"WARNING: Could not lock at {wavelength} nm, stopping PLE scan.")
+                        self.ple_exit_flag = True
+                    return
+                acquisition_data = ccd.take_acquisition()
+                if acquisition_data is None or self.ple_exit_flag:
+                    # The acquisition was cut short, so leave this row to be acquired again when the scan is resumed
+                    print('Received exit signal during acquisition, saving PLE data.')
+                    return
+                saving_stage.put(row, acquisition_data, time.time())
+                counts = None
+                if integrated_counts is not None:
+                    counts = np.sum(acquisition_data[..., start_pixel:end_pixel]).item() - background_counts
+                    integrated_counts[wavelength] = counts
+                if integrated_noise is not None:
+                    integrated_noise[wavelength] = analysis.integration_noise(acquisition_data, start_pixel, end_pixel)
+                plotting_stage.put(wavelength, acquisition_data, counts)
+
+        try:
+            acquire(rows_to_acquire)
+            while adaptive and not self.ple_exit_flag:
+                new_wavelengths = analysis.find_refinement_wavelengths(
+                    list(integrated_counts.keys()), list(integrated_counts.values()), metadata['adaptive_resolution'],
+                    metadata['adaptive_change_fraction'], metadata['adaptive_threshold'],
+                    cfg.get(cfg.WAVEMETER_PRECISION),
+                    [integrated_noise[wavelength] for wavelength in integrated_counts])
+                rows = ple_data.plan(new_wavelengths)
+                if len(rows) == 0:
+                    break
+                if len(rows) < len(new_wavelengths):
+                    print(f"WARNING: PLE data is full, skipping {len(new_wavelengths) - len(rows)} refinement(s).")
+                print(f"Refining PLE scan with {len(rows)} more wavelength(s).")
+                acquire(rows)
+        finally:
+            saving_stage.finish()
+            plotting_stage.finish()
 
         pl_pipe_in.send(None)
-        if file_name:
-            self.plot_single_acquisition(center_wavelength, grating_grooves, data_file=file_name)
+        if ple_data.num_acquired > 0:
+            self.plot_single_acquisition(center_wavelength, grating_grooves,
+                                         data_file=ple_data.base_path + DATA_EXTENSION)
+        num_remaining = ple_data.num_planned - ple_data.num_acquired
+        if num_remaining > 0:
+            print(f"PLE scan stopped with {num_remaining} acquisition(s) remaining. "
+                  'Use Resume PLE Scan to continue it.')
+        elif adaptive and self.ple_exit_flag:
+            print('PLE scan stopped before refinement finished. Use Resume PLE Scan to continue it.')
+        else:
+            print(f"Finished PLE scan with {ple_data.num_acquired} acquisition(s).")
+
+    def lock_at_wavelength(self, wavelength: float, fine_scan=False) -> bool:
+        """
+        Try to lock the Matisse at a given wavelength, waiting to return until we're within a small tolerance.
 
-        with open(data_file_name, 'wb') as data_file:
-            pickle.dump(data, data_file, pickle.HIGHEST_PROTOCOL)
-        print('Finished PLE scan.')
+        Rather than polling, this waits on the handle returned by
+        `matisse_controller.matisse.matisse.Matisse.set_wavelength`, then on fresh snapshots from the Matisse state
+        poller, so it returns as soon as the wavelength is reached.
+
+        Parameters
+        ----------
+        wavelength : float
+            the desired wavelength
+        fine_scan : bool
+            whether to try reaching the wavelength with the reference cell alone, if it's close enough to the start of
+            the current fine scan segment
 
-    def lock_at_wavelength(self, wavelength: float):
-        """Try to lock the Matisse at a given wavelength, waiting to return until we're within a small tolerance."""
+        Returns
+        -------
+        bool
+            whether the wavelength was reached, which is False if the PLE exit flag was set or the wavelength setting
+            was cancelled or superseded first, like when Matisse tasks are reset
+        """
         tolerance = 10 ** -cfg.get(cfg.WAVEMETER_PRECISION)
-        self.matisse.set_wavelength(wavelength)
-        while abs(wavelength - self.matisse.wavemeter_wavelength()) >= tolerance or \
-                (self.matisse.is_setting_wavelength or self.matisse.is_scanning_bifi or self.matisse.is_scanning_thin_etalon):
+        # The laser may already be at this wavelength, like when it was tuned to it while the CCD cooled down
+        setting = self.matisse.wavelength_setting
+        if setting is None or setting.target_wavelength != wavelength or not setting.succeeded() or \
+                not self.matisse.is_stabilizing():
+            setting = None
+        if setting is None and fine_scan and self.fine_scan_segment_start is not None and \
+                abs(wavelength - self.fine_scan_segment_start) <= cfg.get(cfg.SMALL_WAVELENGTH_DRIFT):
+            setting = self.matisse.fine_tune_wavelength(wavelength)
+            if setting is not None and not self.wait_for_wavelength_setting(setting, PLE.FINE_SCAN_TIMEOUT):
+                if self.ple_exit_flag:
+                    return False
+                print(f"WARNING: RefCell did not reach {wavelength} nm in time, retuning the laser.")
+                setting.cancel()
+                setting = None
+        if setting is None:
+            setting = self.matisse.set_wavelength(wavelength)
+            self.fine_scan_segment_start = wavelength
+            if not self.wait_for_wavelength_setting(setting):
+                return False
+        if not setting.succeeded():
+            print(f"WARNING: Setting the wavelength to {wavelength} nm was cancelled before it finished.")
+            return False
+        # Stabilization tolerance may be wider than the wavemeter precision, so wait until the wavemeter agrees
+        state = self.matisse.latest_state()
+        while not abs(wavelength - state.wavelength) < tolerance:
             if self.ple_exit_flag:
-                break
-            time.sleep(3)
+                return False
+            state = self.matisse.latest_state(state.timestamp)
+        print(f"Reached {wavelength} nm in {setting.elapsed():.1f} s ({setting.describe_phases()}).")
+        return True
+
+    def wait_for_wavelength_setting(self, setting, timeout: float = None) -> bool:
+        """
+        Wait for a `matisse_controller.matisse.wavelength_setting.WavelengthSetting` to be done, giving up early if
+        the PLE exit flag is set.
+
+        Returns
+        -------
+        bool
+            whether the handle is done, which is False if the exit flag was set or the timeout passed first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not setting.wait(timeout=PLE.EXIT_CHECK_INTERVAL):
+            if self.ple_exit_flag or (deadline is not None and time.time() >= deadline):
+                return False
+        return True
+
+    def wait_for_future(self, future: futures.Future) -> bool:
+        """
+        Wait for a Future to be done, like a spectrometer move or the CCD cooling down, giving up early if the PLE exit
+        flag is set.
+
+        Returns
+        -------
+        bool
+            whether the future is done, which is False if the exit flag was set first
+        """
+        while not self.ple_exit_flag:
+            if future.done():
+                return True
+            futures.wait([future], timeout=PLE.EXIT_CHECK_INTERVAL)
+        return False
 
     def stop_ple_tasks(self):
         """Trigger the exit flags to stop running scans and PLE measurements."""
@@ -175,23 +448,30 @@ class PLE:
             ccd.exit_flag = True
 
     def analyze_ple_data(self, analysis_name: str, data_file_path: str, integration_start: float, integration_end: float,
-                         background_file_path=''):
+                         background_file_path='', track: int = None):
         """
-        Sum the counts of all spectra for a set of PLE measurements and plot them against wavelength.
+        Sum the counts of all spectra for a set of PLE measurements and plot them against wavelength. All spectra are
+        integrated at once using a prefix sum index that is saved next to the data (see
+        `matisse_controller.shamrock_ple.analysis.PrefixSumIndex`).
 
-        Loads PLE data from a .pickle file and pickles integrated counts for each wavelength into another .pickle file.
-        Optionally subtract background from given file name. The background file should be loadable with numpy.loadtxt.
+        Loads PLE data (or a legacy .pickle file) and pickles integrated counts for each wavelength into a .pickle file.
+        Optionally subtract background from given file name, which should be a master dark (see
+        `matisse_controller.shamrock_ple.dark_frames`) or loadable with numpy.loadtxt. If no background file is given,
+        the master dark taken with the same settings as the scan is subtracted, if there is one.
 
         Parameters
         ----------
         data_file_path
-            the path to the .pickle file containing the PLE measurement data
+            the path to the PLE data (see `matisse_controller.shamrock_ple.ple_data.PLEData`) or legacy .pickle file
+            containing the PLE measurement data
         integration_start
             start of integration region (nm) for tallying the counts
         integration_end
             end of integration region (nm) for tallying the counts
         background_file_path
-            the name of a file to use for subtracting background, should be loadable with numpy.loadtxt
+            the name of a master dark or text file to use for subtracting background
+        track
+            the track (or image row) to analyze in scans read out with several tracks, or None to add up every track
         """
         self.ple_exit_flag = False
 
@@ -209,27 +489,23 @@ class PLE:
             print(f"WARNING: An analysis called '{analysis_name}' already exists. Choose a new name and try again.")
             return
 
-        with open(data_file_path, 'rb') as full_data_file:
-            scans = pickle.load(full_data_file)
+        # Build the prefix sum index on the first analysis, so any later window is quick to integrate
+        prefix_sum_index = analysis.PrefixSumIndex.load(data_file_path, track)
 
+        background_data = None
         if background_file_path:
-            background_data = np.loadtxt(background_file_path)
-        else:
-            background_data = None
-
-        center_wavelength = scans.pop('center_wavelength')
-        grating_grooves = scans.pop('grating_grooves')
-        start_pixel, end_pixel = self.find_integration_endpoints(integration_start, integration_end,
-                                                                 center_wavelength, grating_grooves)
-        total_counts = {}
-        for wavelength in scans.keys():
-            if self.ple_exit_flag:
-                print('Received exit signal, saving PLE data.')
-                break
-            if background_data and background_data.any():
-                scans[wavelength] = scans[wavelength].astype(np.double)
-                scans[wavelength] -= background_data
-            total_counts[wavelength] = sum(scans[wavelength][start_pixel:end_pixel])
+            background_data = dark_frames.load_background(background_file_path)
+        elif PLEData.exists(data_file_path):
+            ple_data = PLEData(data_file_path)
+            master_dark = PLE.find_master_dark(ple_data.metadata, ple_data.frame_shape)
+            if master_dark is not None:
+                print(f"Subtracting master dark of {master_dark.num_frames} frame(s).")
+                background_data = master_dark.mean
+
+        start_pixel, end_pixel = prefix_sum_index.spectral_axis().integration_window(integration_start,
+                                                                                     integration_end)
+        results = prefix_sum_index.integrate([(start_pixel, end_pixel)], background_data)
+        total_counts = dict(zip(results['wavelength'].tolist(), results['counts'][:, 0].tolist()))
 
         with open(analysis_file_path, 'wb') as analysis_file:
             pickle.dump(total_counts, analysis_file, pickle.HIGHEST_PROTOCOL)
@@ -238,6 +514,267 @@ class PLE:
         self.analysis_plot_processes.append(plot_process)
         plot_process.start()
 
+    def batch_analyze_ple_data(self, analysis_name: str, data_path: str, integration_start: float,
+                               integration_end: float, background_file_path='', integration_windows=None,
+                               num_processes=None, track: int = None):
+        """
+        Integrate the counts of every PLE scan in a directory (or matching a glob pattern), using the same integration
+        windows and background for each. Scans are analyzed in parallel by a pool of processes.
+
+        Saves the combined results of all scans into {analysis_name}.npy in the directory of the data, as a
+        structured array with fields 'scan', 'wavelength', and 'counts' (one column per integration window).
+
+        Parameters
+        ----------
+        analysis_name
+            a unique name for the combined analysis
+        data_path
+            a directory containing PLE scans, or a glob pattern matching the data files of PLE scans
+        integration_start
+            start of integration region (nm) for tallying the counts
+        integration_end
+            end of integration region (nm) for tallying the counts
+        background_file_path
+            the name of a master dark or text file to use for subtracting background
+        integration_windows
+            a list of (start, end) integration regions (nm) to use instead of integration_start and integration_end
+        num_processes
+            the number of worker processes, defaults to the number of processors
+        track
+            the track (or image row) to analyze in scans read out with several tracks, or None to add up every track
+
+        Returns
+        -------
+        ndarray
+            the combined results
+        """
+        self.ple_exit_flag = False
+
+        if not data_path:
+            print('WARNING: No PLE data provided to analyze.')
+            return
+        if not analysis_name:
+            print('WARNING: Name of analysis is required.')
+            return
+
+        data_dir = data_path if os.path.isdir(data_path) else os.path.dirname(data_path)
+        analysis_file_path = os.path.join(os.path.abspath(data_dir), f"{analysis_name}.npy")
+        if os.path.exists(analysis_file_path):
+            print(f"WARNING: An analysis called '{analysis_name}' already exists. Choose a new name and try again.")
+            return
+
+        scan_paths = analysis.find_scan_files(data_path)
+        if not scan_paths:
+            print(f"WARNING: No PLE scans found in '{data_path}'.")
+            return
+
+        if integration_windows is None:
+            integration_windows = [(integration_start, integration_end)]
+        background_data = dark_frames.load_background(background_file_path) if background_file_path else None
+
+        print(f"Analyzing {len(scan_paths)} PLE scans.")
+        combined_results = []
+        num_finished = 0
+        start_time = time.time()
+        with ProcessPoolExecutor(max_workers=num_processes) as executor:
+            scan_futures = {executor.submit(analysis.analyze_scan_file, scan_path, integration_windows, background_data,
+                                            track): scan_path for scan_path in scan_paths}
+            for future in as_completed(scan_futures):
+                if self.ple_exit_flag:
+                    print('Received exit signal, saving PLE analysis.')
+                    for remaining_future in scan_futures:
+                        remaining_future.cancel()
+                    break
+                scan_path = scan_futures[future]
+                num_finished += 1
+                try:
+                    results = future.result()
+                except Exception as err:
+                    print(f"WARNING: Unable to analyze '{scan_path}'. {err}")
+                    continue
+                scan_results = np.empty(len(results), dtype=analysis.batch_results_dtype(len(integration_windows)))
+                scan_results['scan'] = os.path.basename(scan_path)
+                scan_results['wavelength'] = results['wavelength']
+                scan_results['counts'] = results['counts']
+                combined_results.append(scan_results)
+                elapsed_time = time.time() - start_time
+                print(f"Analyzed {num_finished}/{len(scan_paths)} PLE scans "
+                      f"({num_finished / elapsed_time:.2f} scans/s, {elapsed_time:.1f} s elapsed).")
+
+        if combined_results:
+            combined_results = np.concatenate(combined_results)
+        else:
+            combined_results = np.empty(0, dtype=analysis.batch_results_dtype(len(integration_windows)))
+        np.save(analysis_file_path, combined_results)
+        print(f"Saved batch PLE analysis to {analysis_file_path}.")
+        return combined_results
+
+    def take_master_dark(self, num_frames: int, exposure_time: float, grating_grooves: int, *ccd_args,
+                         **ccd_kwargs) -> dark_frames.MasterDark:
+        """
+        Take several acquisitions with the given settings and combine them into a master dark, which is added to the
+        dark frame library (see `matisse_controller.shamrock_ple.dark_frames`). Block the laser before running this.
+
+        Parameters
+        ----------
+        num_frames
+            the number of acquisitions to average
+        exposure_time
+            the exposure time of each acquisition
+        grating_grooves
+            the number of grooves to use for the spectrometer grating
+        *ccd_args
+            args to pass to `matisse_controller.shamrock_ple.ccd.CCD.setup`, after the exposure time
+        **ccd_kwargs
+            kwargs to pass to `matisse_controller.shamrock_ple.ccd.CCD.setup`
+
+        Returns
+        -------
+        MasterDark
+            the new master dark, or None if it was stopped early
+        """
+        self.ple_exit_flag = False
+        PLE.load_andor_libs()
+        PLE.start_cooling([exposure_time, *ccd_args], ccd_kwargs)
+        print(f"Setting spectrometer grating to {grating_grooves} grvs...")
+        spectrometer_moved = shamrock.move_grating_grooves(grating_grooves)
+        ccd.setup(exposure_time, *ccd_args, **ccd_kwargs)
+        if not self.wait_for_future(spectrometer_moved):
+            return
+        spectrometer_moved.result()
+
+        def acquire_frames():
+            print(f"Taking {num_frames} dark frames.")
+            for timestamp, frame in ccd.stream_acquisitions(num_frames):
+                yield frame
+            if ccd.num_dropped_frames > 0:
+                print(f"WARNING: {ccd.num_dropped_frames} dark frame(s) were overwritten before they could be read.")
+
+        settings = PLE.ccd_settings([exposure_time, *ccd_args], ccd_kwargs)
+        master_dark = dark_frames.MasterDark.reduce(acquire_frames(), settings['exposure_time'],
+                                                    settings['temperature'], settings['readout_mode'],
+                                                    grating_grooves)
+        if master_dark is None or self.ple_exit_flag or ccd.exit_flag:
+            print('Received exit signal, discarding dark frames.')
+            return
+        file_path = dark_frames.save(master_dark)
+        print(f"Saved master dark to {file_path}.")
+        return master_dark
+
+    def calibrate_spectrometer(self, reference_wavelengths, center_wavelength: float, grating_grooves: int, *ccd_args,
+                               num_frames=1, degree=calibration.DEFAULT_DEGREE,
+                               **ccd_kwargs) -> calibration.Calibration:
+        """
+        Take a spectrum of a reference lamp, locate its lines near where the latest calibration puts them, and fit a new
+        calibration for the given grating and center wavelength. The calibration is added to the calibration library
+        (see `matisse_controller.shamrock_ple.calibration`), and used for spectra taken at this center wavelength from
+        then on. Point the reference lamp at the spectrometer before running this.
+
+        Parameters
+        ----------
+        reference_wavelengths
+            the known wavelengths of the lamp lines to look for, in nm, like `calibration.ARGON_LINES_NM`
+        center_wavelength
+            the wavelength at which to set the spectrometer
+        grating_grooves
+            the number of grooves to use for the spectrometer grating
+        num_frames
+            the number of acquisitions to add up
+        degree
+            the degree of the polynomial to fit
+        *ccd_args
+            args to pass to `matisse_controller.shamrock_ple.ccd.CCD.setup`
+        **ccd_kwargs
+            kwargs to pass to `matisse_controller.shamrock_ple.ccd.CCD.setup`
+
+        Returns
+        -------
+        Calibration
+            the new calibration, or None if it was stopped early or too few lines were found
+        """
+        self.ple_exit_flag = False
+        PLE.load_andor_libs()
+        PLE.start_cooling(ccd_args, ccd_kwargs)
+        print(f"Setting spectrometer grating to {grating_grooves} grvs and center wavelength to {center_wavelength}...")
+        spectrometer_moved = shamrock.move_to(grating_grooves, center_wavelength)
+        ccd.setup(*ccd_args, **ccd_kwargs)
+        if not self.wait_for_future(spectrometer_moved):
+            return
+        spectrometer_moved.result()
+
+        print(f"Taking {num_frames} reference frame(s).")
+        frames = np.array([frame.copy() for timestamp, frame in ccd.stream_acquisitions(num_frames)])
+        if self.ple_exit_flag or ccd.exit_flag or len(frames) == 0:
+            print('Received exit signal, discarding reference frames.')
+            return
+        spectrum = np.sum(frames, axis=0, dtype=np.float64)
+        master_dark = PLE.find_master_dark({'ccd_args': list(ccd_args), 'ccd_kwargs': ccd_kwargs,
+                                            'grating_grooves': grating_grooves}, ccd.frame_shape)
+        if master_dark is not None:
+            spectrum -= len(frames) * master_dark.mean
+        # Add up every track (or image row), since they all see the same lines
+        spectrum = spectrum.reshape(-1, spectrum.shape[-1]).sum(axis=0)
+
+        current_axis = SpectralAxis.latest(center_wavelength, grating_grooves, num_pixels=len(spectrum),
+                                           horizontal_binning=ccd.horizontal_binning, first_column=ccd.first_column)
+        positions, wavelengths = calibration.find_reference_lines(spectrum, reference_wavelengths, current_axis)
+        try:
+            new_calibration = calibration.Calibration.fit(positions, wavelengths, center_wavelength, grating_grooves,
+                                                          degree)
+        except ValueError as err:
+            print(f"WARNING: Unable to calibrate the spectrometer. {err}")
+            return
+        shift = new_calibration.to_wavelengths(0) - current_axis.calibration.to_wavelengths(0, center_wavelength)
+        file_path = calibration.save(new_calibration)
+        print(f"Saved spectrometer calibration {new_calibration.describe()} to {file_path}. The center of the CCD is "
+              f"{shift * 1000:.1f} pm from where the {current_axis.calibration.describe()} put it.")
+        return new_calibration
+
+    @staticmethod
+    def start_cooling(ccd_args, ccd_kwargs):
+        """
+        Start cooling the CCD in the background, if the given args and kwargs for
+        `matisse_controller.shamrock_ple.ccd.CCD.setup` will wait for it to cool down.
+        """
+        settings = PLE.ccd_settings(ccd_args, ccd_kwargs)
+        if settings['cool_down']:
+            ccd.start_cooling(settings['temperature'])
+
+    @staticmethod
+    def ccd_settings(ccd_args, ccd_kwargs) -> dict:
+        """
+        Returns
+        -------
+        dict
+            every argument of `matisse_controller.shamrock_ple.ccd.CCD.setup` for the given args and kwargs, including
+            defaults
+        """
+        arguments = inspect.signature(CCD.setup).bind(None, *ccd_args, **ccd_kwargs)
+        arguments.apply_defaults()
+        return arguments.arguments
+
+    @staticmethod
+    def find_master_dark(metadata: dict, frame_shape=None) -> dark_frames.MasterDark:
+        """
+        Returns
+        -------
+        MasterDark
+            the master dark taken with the same CCD settings and grating as the PLE scan with the given metadata, or
+            None if there isn't one, or if its frames don't have the given shape (like when a different region or
+            binning was read out)
+        """
+        try:
+            settings = PLE.ccd_settings(metadata['ccd_args'], metadata['ccd_kwargs'])
+        except (KeyError, TypeError):
+            return None
+        master_dark = dark_frames.find(settings['exposure_time'], settings['temperature'], settings['readout_mode'],
+                                       metadata['grating_grooves'])
+        if master_dark is not None and frame_shape is not None and master_dark.mean.shape != tuple(frame_shape):
+            print(f"WARNING: Ignoring master dark with frame shape {master_dark.mean.shape}, "
+                  f"which does not match {tuple(frame_shape)}.")
+            return None
+        return master_dark
+
     def plot_ple_analysis_file(self, analysis_file_path: str):
         """Plot the PLE analysis data from the given .pickle file."""
         with open(analysis_file_path, 'rb') as analysis_file:
@@ -251,7 +788,7 @@ class PLE:
         """
         Plot a single acquisition from the CCD at the given center wavelength and using the grating with the given
         number of grooves. If a data file name is specified, this will skip reading the CCD and just plot the data
-        in that file.
+        in that file. For PLE data files, the most recent acquisition is plotted.
 
         Parameters
         ----------
@@ -260,34 +797,104 @@ class PLE:
         grating_grooves
             the number of grooves to use for the spectrometer grating
         data_file
-            file name containing data to plot - if None, will grab data from the CCD
+            file name containing data to plot (a text file, or PLE data) - if None, will grab data from the CCD
         *ccd_args
             args to pass to `matisse_controller.shamrock_ple.ccd.CCD.setup`
         **ccd_kwargs
             kwargs to pass to `matisse_controller.shamrock_ple.ccd.CCD.setup`
         """
         self.ple_exit_flag = False
-        if data_file:
+        # The CCD columns the data was read out from
+        readout = {}
+        # PLE data keeps the calibration it was taken with, anything else uses the latest one
+        calibration_version = None
+        if data_file and PLEData.exists(data_file):
+            ple_data = PLEData(data_file)
+            data = ple_data.last_spectrum()
+            readout = {'horizontal_binning': ple_data.horizontal_binning, 'first_column': ple_data.first_column}
+            calibration_version = ple_data.calibration_version
+        elif data_file:
             data = np.loadtxt(data_file)
         else:
             PLE.load_andor_libs()
             print(f"Setting spectrometer grating to {grating_grooves} grvs and center wavelength to {center_wavelength}...")
-            shamrock.set_grating_grooves(grating_grooves)
-            shamrock.set_center_wavelength(center_wavelength)
-            if self.ple_exit_flag:
-                return
+            spectrometer_moved = shamrock.move_to(grating_grooves, center_wavelength)
             ccd.setup(*ccd_args, **ccd_kwargs)
+            if not self.wait_for_future(spectrometer_moved):
+                return
+            spectrometer_moved.result()
             data = ccd.take_acquisition()
+            if data is None:
+                print('Received exit signal, discarding acquisition.')
+                return
+            readout = {'horizontal_binning': ccd.horizontal_binning, 'first_column': ccd.first_column}
 
-        wavelengths = self.pixels_to_wavelengths(range(len(data)), center_wavelength, grating_grooves)
+        if calibration_version is None:
+            calibration_version = calibration.latest_version(grating_grooves, center_wavelength)
+        wavelengths = SpectralAxis.get(center_wavelength, grating_grooves, calibration_version,
+                                       num_pixels=data.shape[-1], **readout).wavelengths
 
         plot_process = SpectrumPlotProcess(wavelengths, data, daemon=True)
         self.spectrum_plot_processes.append(plot_process)
         plot_process.start()
 
-    def pixels_to_wavelengths(self, pixels, center_wavelength: float, grating_grooves: int):
+    def start_live_feed(self, center_wavelength: float, grating_grooves: int, *ccd_args, **ccd_kwargs):
+        """
+        Continuously acquire frames from the CCD and plot the latest one, until PLE tasks are stopped or the plot is
+        closed. Useful for aligning the sample and spectrometer.
+
+        Frames are passed to the plot through a `matisse_controller.shamrock_ple.live_feed.FrameRing` in shared memory,
+        and the frame rate and number of frames dropped by the CCD are shown in the plot title.
+
+        Parameters
+        ----------
+        center_wavelength
+            the wavelength at which to set the spectrometer
+        grating_grooves
+            the number of grooves to use for the spectrometer grating
+        *ccd_args
+            args to pass to `matisse_controller.shamrock_ple.ccd.CCD.setup`
+        **ccd_kwargs
+            kwargs to pass to `matisse_controller.shamrock_ple.ccd.CCD.setup`
+        """
+        self.ple_exit_flag = False
+        PLE.load_andor_libs()
+        print(f"Setting spectrometer grating to {grating_grooves} grvs and center wavelength to {center_wavelength}...")
+        spectrometer_moved = shamrock.move_to(grating_grooves, center_wavelength)
+        ccd.setup(*ccd_args, **ccd_kwargs)
+        if not self.wait_for_future(spectrometer_moved):
+            return
+        spectrometer_moved.result()
+
+        frame_ring = FrameRing(ccd.frame_shape)
+        wavelengths = SpectralAxis.latest(center_wavelength, grating_grooves, num_pixels=ccd.frame_shape[-1],
+                                          horizontal_binning=ccd.horizontal_binning,
+                                          first_column=ccd.first_column).wavelengths
+        plot_process = LiveSpectrumPlotProcess(frame_ring, wavelengths, daemon=True)
+        self.spectrum_plot_processes.append(plot_process)
+        plot_process.start()
+
+        print('Starting live feed. Reset PLE tasks or close the plot to stop it.')
+        frame_times = deque(maxlen=PLE.LIVE_FEED_FRAME_RATE_WINDOW)
+        frames = ccd.stream_acquisitions()
+        try:
+            for timestamp, frame in frames:
+                if self.ple_exit_flag or not plot_process.is_alive():
+                    break
+                frame_times.append(time.time())
+                elapsed = frame_times[-1] - frame_times[0]
+                frame_rate = (len(frame_times) - 1) / elapsed if elapsed > 0 else 0
+                frame_ring.write(frame, ccd.num_dropped_frames, frame_rate)
+        finally:
+            frames.close()
+            frame_ring.stop()
+        print(f"Live feed stopped after {frame_ring.frames_written} frames, {ccd.num_dropped_frames} dropped.")
+
+    @staticmethod
+    def pixels_to_wavelengths(pixels, center_wavelength: float, grating_grooves: int, calibration_version=None):
         """
-        Convert pixels to nanometers using given spectrometer settings.
+        Convert pixels to nanometers using given spectrometer settings. See
+        `matisse_controller.shamrock_ple.spectral_axis.SpectralAxis`.
 
         Parameters
         ----------
@@ -297,23 +904,22 @@ class PLE:
             the center wavelength used to take the CCD data
         grating_grooves
             the number of grooves for the grating used to take the CCD data
+        calibration_version
+            the version of the spectrometer calibration to use, or None for the latest one
 
         Returns
         -------
         ndarray
             an array of wavelengths that each correspond to a pixel on the CCD screen
         """
-        nm_per_pixel = Shamrock.GRATINGS_NM_PER_PIXEL[grating_grooves]
-        offset = Shamrock.GRATINGS_OFFSET_NM[grating_grooves]
-        # Point-slope formula for calculating wavelengths from pixels
-        # Use pixel + 1 because indexes range from 0 to 1023, CCD center is at 512 but zero-indexing would put it at 511
-        wavelengths = [nm_per_pixel * (pixel + 1 - CCD.WIDTH / 2) + center_wavelength + offset for pixel in pixels]
-        return np.array(wavelengths)
+        return PLE.spectral_axis(center_wavelength, grating_grooves, calibration_version).to_wavelengths(pixels)
 
-    def find_integration_endpoints(self, start_wavelength: float, end_wavelength: float, center_wavelength: float,
-                                   grating_grooves: int):
+    @staticmethod
+    def find_integration_endpoints(start_wavelength: float, end_wavelength: float, center_wavelength: float,
+                                   grating_grooves: int, calibration_version=None):
         """
-        Convert a starting and ending wavelength to CCD pixels.
+        Convert a starting and ending wavelength to CCD pixels. See
+        `matisse_controller.shamrock_ple.spectral_axis.SpectralAxis`.
 
         Parameters
         ----------
@@ -325,15 +931,20 @@ class PLE:
             the wavelength at which the spectrometer was set
         grating_grooves
             the number of grooves used for the spectrometer grating
+        calibration_version
+            the version of the spectrometer calibration to use, or None for the latest one
 
         Returns
         -------
         (int, int)
             the start and end pixels corresponding to the given start and end wavelengths
         """
-        nm_per_pixel = Shamrock.GRATINGS_NM_PER_PIXEL[grating_grooves]
-        offset = Shamrock.GRATINGS_OFFSET_NM[grating_grooves]
-        # Invert pixel -> wavelength conversion
-        start_pixel = int(CCD.WIDTH / 2 - 1 + (start_wavelength - center_wavelength - offset) / nm_per_pixel)
-        end_pixel = int(CCD.WIDTH / 2 - 1 + (end_wavelength - center_wavelength - offset) / nm_per_pixel)
-        return start_pixel, end_pixel
+        return PLE.spectral_axis(center_wavelength, grating_grooves, calibration_version).integration_window(
+            start_wavelength, end_wavelength)
+
+    @staticmethod
+    def spectral_axis(center_wavelength: float, grating_grooves: int, calibration_version=None) -> SpectralAxis:
+        """The shared spectral axis of full, unbinned spectra, using the latest calibration if no version is given."""
+        if calibration_version is None:
+            return SpectralAxis.latest(center_wavelength, grating_grooves)
+        return SpectralAxis.get(center_wavelength, grating_grooves, calibration_version)
@@ -0,0 +1,271 @@
+"""
+Provides a binary container for the spectra taken during a PLE scan.
+
+A scan named `name` is stored as three files:
+
+- `name.npy`: a preallocated (number of wavelengths x number of pixels) int32 matrix of spectra, one row per wavelength.
+  Scans read out in multi-track or image mode keep every track (or image row) of each acquisition, so their spectra are
+  (number of wavelengths x number of tracks x number of pixels).
+- `name.index.npy`: the wavelength of each row (NaN if no wavelength has been planned for it yet), and the time at which
+  each row was acquired (NaN if not acquired yet)
+- `name.json`: scan metadata, like the grating, center wavelength, and CCD settings
+
+The .npy files are memory-mapped, so rows are written to disk as they are acquired, and large scans can be read back
+without loading every spectrum into memory.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+DATA_EXTENSION = '.npy'
+INDEX_EXTENSION = '.index.npy'
+METADATA_EXTENSION = '.json'
+
+INDEX_DTYPE = np.dtype([('wavelength', np.float64), ('timestamp', np.float64)])
+
+
+class PLEData:
+    """The spectra, wavelength axis, acquisition times and metadata of a single PLE scan."""
+
+    def __init__(self, base_path: str, mode='r'):
+        """
+        Open existing PLE data. Use `PLEData.create` to start a new scan.
+
+        Parameters
+        ----------
+        base_path : str
+            the path to any of the files making up the PLE data, or the path without any extension
+        mode : str
+            'r' to open the data read-only, 'r+' to allow writing acquisitions
+        """
+        self.base_path = PLEData.base_path_of(base_path)
+        with open(self.base_path + METADATA_EXTENSION) as metadata_file:
+            self.metadata = json.load(metadata_file)
+        self.spectra_store = np.load(self.base_path + DATA_EXTENSION, mmap_mode=mode)
+        self.index = np.load(self.base_path + INDEX_EXTENSION, mmap_mode=mode)
+
+    @staticmethod
+    def create(base_path: str, wavelengths, frame_shape, capacity: int = None, **metadata) -> 'PLEData':
+        """
+        Preallocate the files for a new PLE scan.
+
+        Parameters
+        ----------
+        base_path : str
+            the path of the new data, without any extension
+        wavelengths
+            every wavelength that will be measured, in order
+        frame_shape
+            the number of pixels in each spectrum, or the shape of each acquisition if it has several tracks
+        capacity : int
+            the number of rows to allocate, if more wavelengths may be planned later with `PLEData.plan`
+        **metadata
+            JSON-serializable scan metadata, like grating_grooves, center_wavelength, and the horizontal_binning and
+            first_column of the CCD readout
+
+        Returns
+        -------
+        PLEData
+            the new PLE data, opened for writing
+        """
+        base_path = PLEData.base_path_of(base_path)
+        num_rows = max(len(wavelengths), capacity or 0)
+        frame_shape = tuple(int(size) for size in np.atleast_1d(frame_shape))
+        spectra = np.lib.format.open_memmap(base_path + DATA_EXTENSION, mode='w+', dtype=np.int32,
+                                            shape=(num_rows, *frame_shape))
+        index = np.lib.format.open_memmap(base_path + INDEX_EXTENSION, mode='w+', dtype=INDEX_DTYPE,
+                                          shape=(num_rows,))
+        index['wavelength'] = np.nan
+        index['wavelength'][:len(wavelengths)] = wavelengths
+        index['timestamp'] = np.nan
+        spectra.flush()
+        index.flush()
+        del spectra, index
+        with open(base_path + METADATA_EXTENSION, 'w') as metadata_file:
+            json.dump({'format_version': FORMAT_VERSION, 'created': time.time(), **metadata}, metadata_file, indent=2)
+        return PLEData(base_path, mode='r+')
+
+    @staticmethod
+    def base_path_of(path: str) -> str:
+        """Strip any PLE data extension from the given path."""
+        for extension in [INDEX_EXTENSION, DATA_EXTENSION, METADATA_EXTENSION]:
+            if path.endswith(extension):
+                return path[:-len(extension)]
+        return path
+
+    @staticmethod
+    def exists(base_path: str) -> bool:
+        return os.path.exists(PLEData.base_path_of(base_path) + METADATA_EXTENSION)
+
+    def write(self, row: int, spectrum: np.ndarray, timestamp: float = None):
+        """
+        Store the spectrum acquired at the wavelength in the given row, and flush it to disk.
+
+        Parameters
+        ----------
+        row : int
+            the index of the wavelength at which the spectrum was acquired
+        spectrum : ndarray
+            the counts for each pixel
+        timestamp : float
+            the time of acquisition, in seconds since the epoch, defaults to the current time
+        """
+        self.spectra_store[row] = spectrum
+        self.spectra_store.flush()
+        # Only mark the row as acquired once the spectrum itself is on disk
+        self.index['timestamp'][row] = time.time() if timestamp is None else timestamp
+        self.index.flush()
+
+    def plan(self, wavelengths) -> np.ndarray:
+        """
+        Assign wavelengths to unused rows, so they will be acquired by the scan.
+
+        Parameters
+        ----------
+        wavelengths
+            the wavelengths to add
+
+        Returns
+        -------
+        ndarray
+            the rows assigned to the given wavelengths, which may be fewer than requested if the data is full
+        """
+        rows = np.flatnonzero(~self.planned)[:len(wavelengths)]
+        self.index['wavelength'][rows] = np.asarray(wavelengths)[:len(rows)]
+        self.index.flush()
+        return rows
+
+    def rows_to_acquire(self) -> np.ndarray:
+        """The rows that have a planned wavelength but have not been acquired, in the order they were planned."""
+        return np.flatnonzero(self.planned & ~self.acquired)
+
+    @property
+    def planned(self) -> np.ndarray:
+        """A boolean mask of the rows which have been assigned a wavelength."""
+        return ~np.isnan(self.index['wavelength'])
+
+    @property
+    def num_planned(self) -> int:
+        return np.count_nonzero(self.planned)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.index)
+
+    @property
+    def acquired(self) -> np.ndarray:
+        """A boolean mask of the rows which have been acquired."""
+        return ~np.isnan(self.index['timestamp'])
+
+    @property
+    def num_acquired(self) -> int:
+        return np.count_nonzero(self.acquired)
+
+    @property
+    def all_wavelengths(self) -> np.ndarray:
+        """Every planned wavelength in the scan, including those not acquired yet, in the order they were planned."""
+        return self.index['wavelength'][self.planned]
+
+    @property
+    def acquired_rows(self) -> np.ndarray:
+        """The acquired rows, sorted by wavelength."""
+        rows = np.flatnonzero(self.acquired)
+        return rows[np.argsort(self.index['wavelength'][rows], kind='stable')]
+
+    @property
+    def wavelengths(self) -> np.ndarray:
+        """The wavelengths of the acquired rows, in ascending order."""
+        return self.index['wavelength'][self.acquired_rows]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """The acquisition times of the acquired rows, in the same order as `PLEData.wavelengths`."""
+        return self.index['timestamp'][self.acquired_rows]
+
+    @property
+    def spectra(self) -> np.ndarray:
+        """The acquired spectra, one row per wavelength in `PLEData.wavelengths`."""
+        rows = self.acquired_rows
+        if len(rows) == len(self.spectra_store) and np.all(rows == np.arange(len(rows))):
+            # Avoid copying the whole scan into memory
+            return self.spectra_store
+        return self.spectra_store[rows]
+
+    def track_spectra(self, track: int = None) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        track : int
+            the track (or image row) to take the spectra of, or None to add up every track
+
+        Returns
+        -------
+        ndarray
+            the acquired spectra of the given track, one row per wavelength in `PLEData.wavelengths`
+        """
+        if self.num_tracks == 1:
+            return self.spectra
+        return select_track(self.spectra, track)
+
+    @property
+    def frame_shape(self) -> tuple:
+        return self.spectra_store.shape[1:]
+
+    @property
+    def num_tracks(self) -> int:
+        return self.frame_shape[0] if len(self.frame_shape) > 1 else 1
+
+    @property
+    def num_pixels(self) -> int:
+        return self.frame_shape[-1]
+
+    @property
+    def horizontal_binning(self) -> int:
+        return self.metadata.get('horizontal_binning', 1)
+
+    @property
+    def first_column(self) -> int:
+        return self.metadata.get('first_column', 0)
+
+    @property
+    def calibration_version(self) -> int:
+        """The version of the spectrometer calibration used for the scan, which is the built-in one for older scans."""
+        return self.metadata.get('calibration_version', 0)
+
+    @property
+    def center_wavelength(self) -> float:
+        return self.metadata['center_wavelength']
+
+    @property
+    def grating_grooves(self) -> int:
+        return self.metadata['grating_grooves']
+
+    def last_spectrum(self) -> np.ndarray:
+        """The most recently acquired spectrum, or None if nothing has been acquired."""
+        if self.num_acquired == 0:
+            return None
+        return np.array(self.spectra_store[np.nanargmax(self.index['timestamp'])])
+
+
+def select_track(frames: np.ndarray, track: int = None) -> np.ndarray:
+    """
+    Parameters
+    ----------
+    frames : ndarray
+        an array of counts whose last two axes are tracks (or image rows) and pixels, like a multi-track acquisition
+    track : int
+        the track to select, or None to add up every track
+
+    Returns
+    -------
+    ndarray
+        the counts of the given track, or the total counts of every track, without the track axis
+    """
+    if track is None:
+        return np.sum(frames, axis=-2, dtype=np.int64 if np.issubdtype(frames.dtype, np.integer) else None)
+    return frames[..., track, :]
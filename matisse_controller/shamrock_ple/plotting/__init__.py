@@ -1,2 +1,3 @@
+from .live_spectrum_plot_process import LiveSpectrumPlotProcess
 from .ple_analysis_plot_process import PLEAnalysisPlotProcess
 from .spectrum_plot_process import SpectrumPlotProcess
@@ -0,0 +1,49 @@
+from multiprocessing import Process
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+
+from matisse_controller.shamrock_ple.live_feed import FrameRing
+
+
+class LiveSpectrumPlotProcess(Process):
+    """
+    Plot the latest frame in a `matisse_controller.shamrock_ple.live_feed.FrameRing` until the feed stops, with one
+    line per track if frames have several.
+    """
+
+    # How often to redraw the plot, in seconds
+    REFRESH_INTERVAL = 0.05
+
+    def __init__(self, frame_ring: FrameRing, wavelengths, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_ring = frame_ring
+        self.wavelengths = wavelengths
+        self.figure: Figure = plt.figure('CCD Live Feed')
+        self.axes: Axes = plt.gca()
+        self.axes.set_xlabel('Wavelength (nm)')
+        self.axes.set_ylabel('Counts')
+        self.axes.set_xlim(wavelengths[0], wavelengths[-1])
+        num_tracks = frame_ring.frame_shape[0] if len(frame_ring.frame_shape) > 1 else 1
+        self.lines = self.axes.plot(wavelengths, np.zeros((len(wavelengths), num_tracks)))
+        self.set_title()
+
+    def run(self):
+        last_index = None
+        while not self.frame_ring.stopped and plt.fignum_exists(self.figure.number):
+            latest_frame = self.frame_ring.read_latest(last_index)
+            if latest_frame:
+                last_index, counts = latest_frame
+                for line, track_counts in zip(self.lines, np.atleast_2d(counts)):
+                    line.set_ydata(track_counts)
+                self.axes.relim()
+                self.axes.autoscale_view(scalex=False)
+                self.set_title()
+            plt.pause(LiveSpectrumPlotProcess.REFRESH_INTERVAL)
+        plt.show()
+
+    def set_title(self):
+        self.axes.set_title(f"Counts vs. Wavelength ({self.frame_ring.frame_rate:.1f} fps, "
+                            f"{self.frame_ring.dropped_frames} dropped)")
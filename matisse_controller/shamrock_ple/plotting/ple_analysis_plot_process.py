@@ -1,5 +1,6 @@
 """Provides a class to plot wavelengths and counts for PLE scans."""
 
+import bisect
 import multiprocessing
 from multiprocessing.connection import Connection
 
@@ -51,8 +52,10 @@ class PLEAnalysisPlotProcess(multiprocessing.Process):
         plt.pause(0.001)
 
     def add_point_to_plot(self, wavelength, counts):
-        self.wavelengths.append(wavelength)
-        self.counts.append(counts)
+        # Points may arrive out of order, like when an adaptive scan goes back to refine a resonance
+        index = bisect.bisect(self.wavelengths, wavelength)
+        self.wavelengths.insert(index, wavelength)
+        self.counts.insert(index, counts)
         self.axes.cla()
         self.setup_axes()
         self.plot_data(self.wavelengths, self.counts)
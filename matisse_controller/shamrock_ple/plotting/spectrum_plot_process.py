@@ -2,6 +2,7 @@ from multiprocessing import Process
 from multiprocessing.connection import Connection
 
 import matplotlib.pyplot as plt
+import numpy as np
 from matplotlib.axes import Axes
 from matplotlib.figure import Figure
 
@@ -37,6 +38,7 @@ class SpectrumPlotProcess(Process):
 
     def plot_data(self, wavelengths, counts):
         self.axes.set_xlim(wavelengths[0], wavelengths[-1])
-        self.axes.plot(wavelengths, counts)
+        # Acquisitions with several tracks are plotted as one line per track
+        self.axes.plot(wavelengths, np.transpose(counts))
         plt.draw()
         plt.pause(0.001)
@@ -1,11 +1,23 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from ctypes import *
 from bidict import bidict
 
+from matisse_controller.shamrock_ple.constants import ShamrockErrorCode
 from matisse_controller.shamrock_ple.utils import load_lib
 
 
 # TODO: Note that for some reason the Shamrock will not be found unless SOLIS is installed. Probably a driver issue :(
 class Shamrock:
+    """
+    The Andor Shamrock spectrometer.
+
+    Grating and center wavelength moves can take several seconds, so they run one at a time on a separate thread, and
+    the `move_*` methods return a Future that is done once the move has finished. The grating and center wavelength are
+    read from the device once and then cached, so moves to where the spectrometer already is (or will be, once the moves
+    before them finish) return right away without asking the device.
+    """
+
     LIBRARY_NAME = 'ShamrockCIF.dll'
     DEVICE_ID = c_int(0)
 
@@ -17,7 +29,8 @@ class Shamrock:
     }
 
     # The offset to add, in nanometers, to data in a spectrum taken with a given grating.
-    # These tend to change over time, so update accordingly. Offset is abs(pixel shift) * (nm per pixel)
+    # These tend to change over time, so calibrate the spectrometer with a reference lamp rather than updating them (see
+    # matisse_controller.shamrock_ple.calibration). Offset is abs(pixel shift) * (nm per pixel)
     GRATINGS_OFFSET_NM = {
         300: 1.325,  # -11.4 px, last calibrated Aug 2019
         1200: 0.109,  # -4 px, last calibrated Apr 2015
@@ -35,6 +48,13 @@ class Shamrock:
 
             self.gratings = bidict()
             self.setup_grating_info()
+
+            # Where the spectrometer will be once every move so far has finished, or None if it needs to be read
+            self._grating_grooves = None
+            self._center_wavelength = None
+            self._state_lock = threading.Lock()
+            self._move_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shamrock-move')
+            self.refresh_state()
         except OSError as err:
             raise RuntimeError('Unable to initialize Andor Shamrock API.') from err
 
@@ -59,7 +79,21 @@ class Shamrock:
         Returns
         -------
         int
-            the number of grooves in the current spectrometer grating
+            the number of grooves in the spectrometer grating, including any grating change that hasn't finished yet
+        """
+        with self._state_lock:
+            grating_grooves = self._grating_grooves
+        if grating_grooves is None:
+            self.refresh_state()
+            grating_grooves = self._grating_grooves
+        return grating_grooves
+
+    def read_grating_grooves(self) -> int:
+        """
+        Returns
+        -------
+        int
+            the number of grooves in the current spectrometer grating, as reported by the device
         """
         index = c_int()
         self.lib.ShamrockGetGrating(Shamrock.DEVICE_ID, pointer(index))
@@ -67,22 +101,69 @@ class Shamrock:
 
     def set_grating_grooves(self, num_grooves: int):
         """
-        Use the spectrometer grating with the specified number of grooves.
+        Use the spectrometer grating with the specified number of grooves, waiting until it's in place.
+
+        Parameters
+        ----------
+        num_grooves
+            the desired number of grooves
+        """
+        self.move_grating_grooves(num_grooves).result()
+
+    def move_grating_grooves(self, num_grooves: int) -> Future:
+        """
+        Start moving to the spectrometer grating with the specified number of grooves, after any pending moves.
 
         Parameters
         ----------
         num_grooves
             the desired number of grooves
+
+        Returns
+        -------
+        Future
+            a future that is done once the grating is in place, which raises a RuntimeError if the move failed
         """
-        if num_grooves != self.get_grating_grooves():
-            self.lib.ShamrockSetGrating(Shamrock.DEVICE_ID, c_int(self.gratings[num_grooves]))
+        assert num_grooves in self.gratings, f"No spectrometer grating with {num_grooves} grooves."
+        if num_grooves == self.get_grating_grooves():
+            return Shamrock.finished_move()
+        with self._state_lock:
+            self._grating_grooves = num_grooves
+            # The center wavelength can shift slightly when the grating changes, so read it again afterwards
+            self._center_wavelength = None
+            return self._move_executor.submit(self._set_grating, num_grooves)
+
+    def _set_grating(self, num_grooves: int):
+        result = self.lib.ShamrockSetGrating(Shamrock.DEVICE_ID, c_int(self.gratings[num_grooves]))
+        if result != ShamrockErrorCode.SHAMROCK_SUCCESS.value:
+            self.forget_state()
+            raise RuntimeError(f"Unable to move to the {num_grooves} grv spectrometer grating. Error code: {result}")
+        center_wavelength = self.read_center_wavelength()
+        with self._state_lock:
+            # Unless a wavelength move was queued in the meantime
+            if self._center_wavelength is None:
+                self._center_wavelength = center_wavelength
 
     def get_center_wavelength(self) -> float:
         """
         Returns
         -------
         float
-            the current center wavelength of the spectrometer
+            the center wavelength of the spectrometer, including any move that hasn't finished yet
+        """
+        with self._state_lock:
+            center_wavelength = self._center_wavelength
+        if center_wavelength is None:
+            self.refresh_state()
+            center_wavelength = self._center_wavelength
+        return center_wavelength
+
+    def read_center_wavelength(self) -> float:
+        """
+        Returns
+        -------
+        float
+            the current center wavelength of the spectrometer, as reported by the device
         """
         wavelength = c_float()
         self.lib.ShamrockGetWavelength(Shamrock.DEVICE_ID, pointer(wavelength))
@@ -90,16 +171,93 @@ class Shamrock:
 
     def set_center_wavelength(self, wavelength: float):
         """
-        Set the spectrometer wavelength at the specified value.
+        Set the spectrometer wavelength at the specified value, waiting until it's reached.
 
         Parameters
         ----------
         wavelength
             the desired center wavelength to set
         """
-        if wavelength != self.get_center_wavelength():
-            self.lib.ShamrockSetWavelength(Shamrock.DEVICE_ID, c_float(wavelength))
+        self.move_center_wavelength(wavelength).result()
+
+    def move_center_wavelength(self, wavelength: float) -> Future:
+        """
+        Start moving the spectrometer to the specified center wavelength, after any pending moves.
+
+        If the grating is still changing, the center wavelength it will end up at isn't known yet, so the move always
+        happens.
+
+        Parameters
+        ----------
+        wavelength
+            the desired center wavelength to set
+
+        Returns
+        -------
+        Future
+            a future that is done once the center wavelength is reached, which raises a RuntimeError if the move failed
+        """
+        with self._state_lock:
+            if wavelength == self._center_wavelength:
+                return Shamrock.finished_move()
+            self._center_wavelength = wavelength
+            return self._move_executor.submit(self._set_wavelength, wavelength)
+
+    def _set_wavelength(self, wavelength: float):
+        result = self.lib.ShamrockSetWavelength(Shamrock.DEVICE_ID, c_float(wavelength))
+        if result != ShamrockErrorCode.SHAMROCK_SUCCESS.value:
+            self.forget_state()
+            raise RuntimeError(f"Unable to move the spectrometer to {wavelength} nm. Error code: {result}")
+
+    def move_to(self, grating_grooves: int, center_wavelength: float) -> Future:
+        """
+        Start moving the spectrometer to the given grating and center wavelength, without waiting for either.
+
+        Returns
+        -------
+        Future
+            a future that is done once both moves have finished, which raises a RuntimeError if either failed
+        """
+        grating_moved = self.move_grating_grooves(grating_grooves)
+        wavelength_moved = self.move_center_wavelength(center_wavelength)
+        moved = Future()
+
+        # Moves run in order, so once the wavelength has moved, the grating has too
+        def finish(_):
+            for future in (grating_moved, wavelength_moved):
+                if future.exception() is not None:
+                    moved.set_exception(future.exception())
+                    return
+            moved.set_result(None)
+
+        wavelength_moved.add_done_callback(finish)
+        return moved
+
+    def wait_for_moves(self):
+        """Block until every pending move has finished."""
+        self._move_executor.submit(lambda: None).result()
+
+    def refresh_state(self):
+        """Read the grating and center wavelength from the device, once every pending move has finished."""
+        self.wait_for_moves()
+        grating_grooves, center_wavelength = self.read_grating_grooves(), self.read_center_wavelength()
+        with self._state_lock:
+            self._grating_grooves, self._center_wavelength = grating_grooves, center_wavelength
+
+    def forget_state(self):
+        """Read the grating and center wavelength from the device the next time they're needed."""
+        with self._state_lock:
+            self._grating_grooves = None
+            self._center_wavelength = None
+
+    @staticmethod
+    def finished_move() -> Future:
+        """A future for a move that didn't need to happen."""
+        moved = Future()
+        moved.set_result(None)
+        return moved
 
     def shutdown(self):
         """Run Shamrock-related cleanup and shutdown procedures."""
+        self._move_executor.shutdown(wait=True)
         self.lib.ShamrockClose()
@@ -0,0 +1,464 @@
+"""
+Provides simulated versions of the Andor CCD and Shamrock libraries, for developing, testing and profiling PLE code
+without the spectrometer.
+
+The simulated libraries implement the same functions as the real ones, taking and returning the same ctypes values, so
+`matisse_controller.shamrock_ple.ccd.CCD` and `matisse_controller.shamrock_ple.shamrock.Shamrock` run unchanged on top
+of them. They are used instead of the real libraries when cfg.PLE_BACKEND is set to 'simulated'.
+
+Both libraries share a `SimulatedBench`, which models the spectrometer position and the sample being measured. The CCD
+produces spectra of the sample's emission lines with shot noise, dark current and read noise, whose counts scale with
+the exposure time and binning. Acquisitions, grating changes and wavelength moves take about as long as on the real
+hardware. The time constants are class attributes, so they can be shortened to make simulations run faster.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from matisse_controller.shamrock_ple.constants import *
+
+_SUCCESS = CCDErrorCode.DRV_SUCCESS.value
+_SHAMROCK_SUCCESS = ShamrockErrorCode.SHAMROCK_SUCCESS.value
+
+
+class SimulatedBench:
+    """The spectrometer position, and the sample whose emission is imaged onto the CCD."""
+
+    def __init__(self):
+        self.grating_grooves = 300
+        self.center_wavelength = 750.0
+        # (wavelength in nm, standard deviation in nm, photons per second at the peak) of each emission line
+        self.emission_lines = [(737.1, 0.15, 20000.0), (745.5, 2.0, 1500.0), (765.0, 0.6, 5000.0)]
+        # (center row, standard deviation in rows, relative brightness) of each spot imaged onto the CCD
+        self.spots = [(128, 12.0, 1.0)]
+        # The laser wavelength, if PLE resonances should be simulated. Emission is brightest at a resonance.
+        self.excitation_wavelength = None
+        # (wavelength in nm, half width in nm) of each PLE resonance
+        self.resonances = [(738.023, 0.004)]
+        # The fraction of the peak emission seen when the laser is far from any resonance
+        self.off_resonance_fraction = 0.05
+        # Coefficients, lowest degree first, of a polynomial in columns from the center of the CCD which is added to the
+        # built-in calibration to give the true wavelength of each column, in nm, for simulating a stale calibration
+        self.calibration_error = [0.0]
+        self.lock = threading.Lock()
+
+    def column_wavelengths(self, width: int) -> np.ndarray:
+        """The true wavelength of each CCD column, in nm, from the built-in calibration and the calibration error."""
+        # Imported here to avoid a circular import, since the Shamrock loads its library through this module
+        from matisse_controller.shamrock_ple.shamrock import Shamrock
+        nm_per_pixel = Shamrock.GRATINGS_NM_PER_PIXEL[self.grating_grooves]
+        offset = Shamrock.GRATINGS_OFFSET_NM[self.grating_grooves]
+        positions = np.arange(width) + 1 - width / 2
+        return nm_per_pixel * positions + self.center_wavelength + offset + \
+            np.polynomial.polynomial.polyval(positions, self.calibration_error)
+
+    def excitation_efficiency(self) -> float:
+        if self.excitation_wavelength is None:
+            return 1.0
+        lorentzians = [width ** 2 / ((self.excitation_wavelength - center) ** 2 + width ** 2)
+                       for center, width in self.resonances]
+        return self.off_resonance_fraction + (1 - self.off_resonance_fraction) * min(sum(lorentzians), 1.0)
+
+    def photon_rates(self, width: int, height: int) -> np.ndarray:
+        """
+        Returns
+        -------
+        ndarray
+            a (height x width) array of the photons per second reaching each CCD pixel
+        """
+        wavelengths = self.column_wavelengths(width)
+        spectrum = np.zeros(width)
+        for center, sigma, peak_rate in self.emission_lines:
+            spectrum += peak_rate * np.exp(-0.5 * ((wavelengths - center) / sigma) ** 2)
+        rows = np.arange(height)
+        profile = np.zeros(height)
+        for center_row, sigma_rows, brightness in self.spots:
+            spot = np.exp(-0.5 * ((rows - center_row) / sigma_rows) ** 2)
+            profile += brightness * spot / spot.sum()
+        return self.excitation_efficiency() * np.outer(profile, spectrum)
+
+
+bench = SimulatedBench()
+
+
+class SimulatedCCDLib:
+    """A simulated Andor SDK (atmcd64d.dll) for a Newton CCD."""
+
+    WIDTH = 1024
+    HEIGHT = 256
+    MIN_TEMP = -120
+    MAX_TEMP = -10
+    AMBIENT_TEMPERATURE = 20.0
+    # How quickly the CCD approaches its target temperature, in seconds
+    COOLING_TIME_CONSTANT = 40.0
+    # Within this many degrees of the target, the temperature is reported as stabilized
+    STABILIZED_TOLERANCE = 0.5
+    # Readout speed, in pixels per second, and the time to shift the charge down by one row, in seconds
+    HORIZONTAL_READOUT_RATE = 2.5e6
+    VERTICAL_SHIFT_TIME = 12.9e-6
+    BIAS = 300
+    READ_NOISE = 4.0
+    # Dark counts per pixel per second at -70 °C, doubling every 6 °C warmer
+    DARK_CURRENT = 0.001
+    # The number of frames kept while streaming acquisitions
+    CIRCULAR_BUFFER_SIZE = 64
+
+    def __init__(self, bench: SimulatedBench = bench):
+        self.bench = bench
+        self.rng = np.random.default_rng()
+        self.cooler_on = False
+        self.target_temperature = self.AMBIENT_TEMPERATURE
+        self.temperature = self.AMBIENT_TEMPERATURE
+        self.temperature_time = time.time()
+        self.exposure_time = 0.01
+        self.acquisition_mode = ACQ_MODE_SINGLE
+        self.readout_mode = READ_MODE_FVB
+        self.num_kinetics = 1
+        self.kinetic_cycle_time = 0.0
+        self.fvb_binning = self.single_track_binning = self.multi_track_binning = 1
+        self.single_track = (self.HEIGHT // 2 + 1, self.HEIGHT)
+        self.multi_track = (1, self.HEIGHT, 0)
+        self.image = (1, 1, 1, self.WIDTH, 1, self.HEIGHT)
+        self.start_time = None
+        self.aborted = False
+        self.frames = {}
+
+    # Initialization and temperature
+
+    def Initialize(self, *args):
+        return _SUCCESS
+
+    def GetAvailableCameras(self, num_cameras):
+        num_cameras.contents.value = 1
+        return _SUCCESS
+
+    def SetTemperature(self, temperature):
+        self.update_temperature()
+        self.target_temperature = temperature.value
+        return _SUCCESS
+
+    def CoolerON(self):
+        self.update_temperature()
+        self.cooler_on = True
+        return _SUCCESS
+
+    def CoolerOFF(self):
+        self.update_temperature()
+        self.cooler_on = False
+        return _SUCCESS
+
+    def GetTemperatureRange(self, min_temp, max_temp):
+        min_temp.contents.value = self.MIN_TEMP
+        max_temp.contents.value = self.MAX_TEMP
+        return _SUCCESS
+
+    def update_temperature(self):
+        now = time.time()
+        goal = self.target_temperature if self.cooler_on else self.AMBIENT_TEMPERATURE
+        decay = np.exp(-(now - self.temperature_time) / self.COOLING_TIME_CONSTANT)
+        self.temperature = goal + (self.temperature - goal) * decay
+        self.temperature_time = now
+
+    def GetTemperatureF(self, temperature):
+        self.update_temperature()
+        temperature.contents.value = self.temperature
+        if not self.cooler_on:
+            return CCDErrorCode.DRV_TEMPERATURE_OFF.value
+        if abs(self.temperature - self.target_temperature) < self.STABILIZED_TOLERANCE:
+            return CCDErrorCode.DRV_TEMPERATURE_STABILIZED.value
+        return CCDErrorCode.DRV_TEMPERATURE_NOT_REACHED.value
+
+    # Acquisition settings
+
+    def SetAcquisitionMode(self, mode):
+        self.acquisition_mode = mode.value
+        return _SUCCESS
+
+    def SetReadMode(self, mode):
+        self.readout_mode = mode.value
+        return _SUCCESS
+
+    def SetFVBHBin(self, binning):
+        self.fvb_binning = binning.value
+        return _SUCCESS
+
+    def SetSingleTrack(self, center, height):
+        self.single_track = (center.value, height.value)
+        return _SUCCESS
+
+    def SetSingleTrackHBin(self, binning):
+        self.single_track_binning = binning.value
+        return _SUCCESS
+
+    def SetMultiTrack(self, number, height, offset, bottom, gap):
+        number, height, offset = number.value, height.value, offset.value
+        self.multi_track = (number, height, offset)
+        gap_rows = (self.HEIGHT - number * height) // (number + 1)
+        bottom.contents.value = gap_rows + 1 + offset
+        gap.contents.value = gap_rows
+        return _SUCCESS
+
+    def SetMultiTrackHBin(self, binning):
+        self.multi_track_binning = binning.value
+        return _SUCCESS
+
+    def SetImage(self, horizontal_binning, vertical_binning, first_column, last_column, first_row, last_row):
+        self.image = (horizontal_binning.value, vertical_binning.value, first_column.value, last_column.value,
+                      first_row.value, last_row.value)
+        return _SUCCESS
+
+    def SetVSSpeed(self, index):
+        return _SUCCESS
+
+    def SetTriggerMode(self, mode):
+        return _SUCCESS
+
+    def SetExposureTime(self, exposure_time):
+        self.exposure_time = exposure_time.value
+        return _SUCCESS
+
+    def SetNumberAccumulations(self, number):
+        return _SUCCESS
+
+    def SetNumberKinetics(self, number):
+        self.num_kinetics = number.value
+        return _SUCCESS
+
+    def SetKineticCycleTime(self, cycle_time):
+        self.kinetic_cycle_time = cycle_time.value
+        return _SUCCESS
+
+    def readout_regions(self) -> (list, int):
+        """
+        Returns
+        -------
+        (list, int)
+            the (rows, horizontal binning, first column, last column) of each group of rows binned together, and how
+            many groups of rows are binned together into each output row in image mode
+        """
+        full_width = (1, self.WIDTH)
+        if self.readout_mode == READ_MODE_FVB:
+            return [(np.arange(self.HEIGHT), self.fvb_binning, *full_width)], 1
+        elif self.readout_mode == READ_MODE_SINGLE_TRACK:
+            center, height = self.single_track
+            first_row = max(center - height // 2, 1)
+            return [(np.arange(first_row - 1, min(first_row - 1 + height, self.HEIGHT)), self.single_track_binning,
+                     *full_width)], 1
+        elif self.readout_mode == READ_MODE_MULTI_TRACK:
+            number, height, offset = self.multi_track
+            gap = (self.HEIGHT - number * height) // (number + 1)
+            regions = []
+            for track in range(number):
+                first_row = np.clip(gap + track * (height + gap) + offset, 0, self.HEIGHT - height)
+                regions.append((np.arange(first_row, first_row + height), self.multi_track_binning, *full_width))
+            return regions, 1
+        else:
+            horizontal_binning, vertical_binning, first_column, last_column, first_row, last_row = self.image
+            return [(np.array([row]), horizontal_binning, first_column, last_column)
+                    for row in range(first_row - 1, last_row)], vertical_binning
+
+    def frame_shape(self) -> tuple:
+        regions, vertical_binning = self.readout_regions()
+        _, horizontal_binning, first_column, last_column = regions[0]
+        return len(regions) // vertical_binning, (last_column - first_column + 1) // horizontal_binning
+
+    def readout_time(self) -> float:
+        num_rows, num_pixels = self.frame_shape()
+        return self.HEIGHT * self.VERTICAL_SHIFT_TIME + num_rows * num_pixels / self.HORIZONTAL_READOUT_RATE
+
+    def GetReadOutTime(self, readout_time):
+        readout_time.contents.value = self.readout_time()
+        return _SUCCESS
+
+    def cycle_time(self) -> float:
+        return max(self.kinetic_cycle_time, self.exposure_time + self.readout_time())
+
+    def GetAcquisitionTimings(self, exposure, accumulate, kinetic):
+        exposure.contents.value = self.exposure_time
+        accumulate.contents.value = self.exposure_time + self.readout_time()
+        kinetic.contents.value = self.cycle_time()
+        return _SUCCESS
+
+    # Acquisition
+
+    def simulate_frame(self) -> np.ndarray:
+        """Produce a frame with the current settings, as it would be read out (with columns in reverse order)."""
+        with self.bench.lock:
+            photon_rates = self.bench.photon_rates(self.WIDTH, self.HEIGHT)
+        self.update_temperature()
+        dark_current = self.DARK_CURRENT * 2 ** ((self.temperature + 70) / 6)
+        regions, vertical_binning = self.readout_regions()
+        rows = []
+        for region_rows, horizontal_binning, first_column, last_column in regions:
+            rates = photon_rates[region_rows, first_column - 1:last_column].sum(axis=0) + dark_current * len(region_rows)
+            rows.append(rates.reshape(-1, horizontal_binning).sum(axis=1))
+        rates = np.array(rows)
+        rates = rates[:len(rates) // vertical_binning * vertical_binning]
+        rates = rates.reshape(-1, vertical_binning, rates.shape[1]).sum(axis=1)
+        counts = self.rng.poisson(rates * self.exposure_time) + self.rng.normal(self.BIAS, self.READ_NOISE, rates.shape)
+        frame = np.round(counts).astype(np.int32)[:, ::-1]
+        return frame[0] if self.readout_mode in (READ_MODE_FVB, READ_MODE_SINGLE_TRACK) else frame
+
+    def StartAcquisition(self):
+        self.start_time = time.time()
+        self.aborted = False
+        self.frames = {}
+        return _SUCCESS
+
+    def AbortAcquisition(self):
+        self.aborted = True
+        return _SUCCESS
+
+    def num_frames_taken(self) -> int:
+        """The number of frames completely read out since the acquisition started."""
+        if self.start_time is None:
+            return 0
+        elapsed = time.time() - self.start_time
+        if self.acquisition_mode in (ACQ_MODE_KINETICS, ACQ_MODE_UNTIL_ABORT):
+            num_frames = int((elapsed - self.exposure_time - self.readout_time()) / self.cycle_time()) + 1
+            num_frames = max(num_frames, 0)
+            if self.acquisition_mode == ACQ_MODE_KINETICS:
+                num_frames = min(num_frames, self.num_kinetics)
+        else:
+            num_frames = 1 if elapsed >= self.exposure_time + self.readout_time() else 0
+        return num_frames
+
+    def GetStatus(self, status):
+        if self.start_time is None or self.aborted:
+            status.contents.value = CCDErrorCode.DRV_IDLE.value
+        elif self.acquisition_mode == ACQ_MODE_UNTIL_ABORT:
+            status.contents.value = CCDErrorCode.DRV_ACQUIRING.value
+        else:
+            total = self.num_kinetics if self.acquisition_mode == ACQ_MODE_KINETICS else 1
+            done = self.num_frames_taken() >= total
+            status.contents.value = CCDErrorCode.DRV_IDLE.value if done else CCDErrorCode.DRV_ACQUIRING.value
+        return _SUCCESS
+
+    def frame(self, index: int) -> np.ndarray:
+        """The frame with the given index (counting from 1), simulated the first time it is read."""
+        if index not in self.frames:
+            self.frames[index] = self.simulate_frame()
+            # Forget frames that have left the circular buffer
+            self.frames.pop(index - self.CIRCULAR_BUFFER_SIZE, None)
+        return self.frames[index]
+
+    @staticmethod
+    def copy_out(frames, array, size) -> int:
+        data = np.ravel(frames)
+        if data.size > size.value:
+            return CCDErrorCode.DRV_P2INVALID.value
+        np.ctypeslib.as_array(array, (data.size,))[:] = data
+        return _SUCCESS
+
+    def GetAcquiredData(self, array, size):
+        if self.num_frames_taken() == 0:
+            return CCDErrorCode.DRV_NO_NEW_DATA.value
+        return self.copy_out(self.frame(self.num_frames_taken()), array, size)
+
+    def valid_frames(self) -> (int, int):
+        last = self.num_frames_taken() if self.start_time is not None else 0
+        return max(1, last - self.CIRCULAR_BUFFER_SIZE + 1), last
+
+    def GetNumberNewImages(self, first, last):
+        first_index, last_index = self.valid_frames()
+        if last_index == 0:
+            return CCDErrorCode.DRV_NO_NEW_DATA.value
+        first.contents.value, last.contents.value = first_index, last_index
+        return _SUCCESS
+
+    def GetImages(self, first, last, array, size, valid_first, valid_last):
+        first_index, last_index = self.valid_frames()
+        if first.value < first_index or last.value > last_index:
+            return CCDErrorCode.DRV_P2INVALID.value
+        valid_first.contents.value, valid_last.contents.value = first.value, last.value
+        return self.copy_out([self.frame(index) for index in range(first.value, last.value + 1)], array, size)
+
+    def GetMostRecentImage(self, array, size):
+        last_index = self.valid_frames()[1]
+        if last_index == 0:
+            return CCDErrorCode.DRV_NO_NEW_DATA.value
+        return self.copy_out(self.frame(last_index), array, size)
+
+
+class SimulatedShamrockLib:
+    """A simulated Andor Shamrock SDK (ShamrockCIF.dll)."""
+
+    GRATINGS = [(300, '500'), (1200, '750'), (1799, '500')]
+    # The time to rotate the turret to another grating, in seconds
+    GRATING_MOVE_TIME = 10.0
+    # The time to start moving the grating to a new wavelength, in seconds, and how fast it moves, in nm per second
+    WAVELENGTH_MOVE_OVERHEAD = 0.5
+    WAVELENGTH_MOVE_RATE = 100.0
+
+    def __init__(self, bench: SimulatedBench = bench):
+        self.bench = bench
+
+    def ShamrockInitialize(self, *args):
+        return _SHAMROCK_SUCCESS
+
+    def ShamrockClose(self):
+        return _SHAMROCK_SUCCESS
+
+    def ShamrockGetNumberDevices(self, num_devices):
+        num_devices.contents.value = 1
+        return _SHAMROCK_SUCCESS
+
+    def ShamrockGetNumberGratings(self, device, number):
+        number.contents.value = len(self.GRATINGS)
+        return _SHAMROCK_SUCCESS
+
+    def ShamrockGetGratingInfo(self, device, index, lines, blaze, home, offset):
+        if not 1 <= index.value <= len(self.GRATINGS):
+            return ShamrockErrorCode.SHAMROCK_P2INVALID.value
+        grooves, blaze_wavelength = self.GRATINGS[index.value - 1]
+        lines.contents.value = grooves
+        blaze.value = blaze_wavelength.encode()
+        home.contents.value = 0
+        offset.contents.value = 0
+        return _SHAMROCK_SUCCESS
+
+    def ShamrockGetGrating(self, device, index):
+        index.contents.value = [grooves for grooves, _ in self.GRATINGS].index(self.bench.grating_grooves) + 1
+        return _SHAMROCK_SUCCESS
+
+    def ShamrockSetGrating(self, device, index):
+        if not 1 <= index.value <= len(self.GRATINGS):
+            return ShamrockErrorCode.SHAMROCK_P2INVALID.value
+        grooves = self.GRATINGS[index.value - 1][0]
+        if grooves != self.bench.grating_grooves:
+            time.sleep(self.GRATING_MOVE_TIME)
+            with self.bench.lock:
+                self.bench.grating_grooves = grooves
+        return _SHAMROCK_SUCCESS
+
+    def ShamrockGetWavelength(self, device, wavelength):
+        wavelength.contents.value = self.bench.center_wavelength
+        return _SHAMROCK_SUCCESS
+
+    def ShamrockSetWavelength(self, device, wavelength):
+        distance = abs(wavelength.value - self.bench.center_wavelength)
+        if distance > 0:
+            time.sleep(self.WAVELENGTH_MOVE_OVERHEAD + distance / self.WAVELENGTH_MOVE_RATE)
+            with self.bench.lock:
+                self.bench.center_wavelength = wavelength.value
+        return _SHAMROCK_SUCCESS
+
+
+SIMULATED_LIBRARIES = {
+    'atmcd64d.dll': SimulatedCCDLib,
+    'ShamrockCIF.dll': SimulatedShamrockLib
+}
+
+
+def load_lib(name: str):
+    """
+    Returns
+    -------
+    SimulatedCCDLib or SimulatedShamrockLib
+        a new simulated library standing in for the Andor library with the given name, sharing the global bench
+    """
+    if name not in SIMULATED_LIBRARIES:
+        raise OSError(f"No simulated version of '{name}' is available.")
+    return SIMULATED_LIBRARIES[name]()
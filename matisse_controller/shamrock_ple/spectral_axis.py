@@ -0,0 +1,136 @@
+"""Provides a cached conversion between CCD pixels and wavelengths for a given spectrometer configuration."""
+
+from functools import lru_cache
+
+import numpy as np
+
+from matisse_controller.shamrock_ple import calibration
+from matisse_controller.shamrock_ple.ccd import CCD
+
+# The calibration made of the constants in Shamrock.GRATINGS_NM_PER_PIXEL and Shamrock.GRATINGS_OFFSET_NM
+BUILT_IN_CALIBRATION = calibration.BUILT_IN_VERSION
+
+
+class SpectralAxis:
+    """
+    The wavelength of each CCD pixel for a spectrometer center wavelength and grating, with vectorized conversions
+    between pixels and wavelengths.
+
+    Use `SpectralAxis.get` rather than creating these directly, so that each axis is only computed once.
+    """
+
+    def __init__(self, center_wavelength: float, grating_grooves: int, calibration_version=BUILT_IN_CALIBRATION,
+                 num_pixels=CCD.WIDTH, horizontal_binning=1, first_column=0):
+        """
+        Parameters
+        ----------
+        center_wavelength : float
+            the wavelength at which the spectrometer was set
+        grating_grooves : int
+            the number of grooves of the spectrometer grating
+        calibration_version : int
+            which version of the spectrometer calibration to use (see `matisse_controller.shamrock_ple.calibration`)
+        num_pixels : int
+            the number of pixels along the wavelength axis of each acquisition
+        horizontal_binning : int
+            the number of CCD columns binned into each pixel
+        first_column : int
+            the first CCD column read out, counting from 0
+        """
+        self.center_wavelength = center_wavelength
+        self.grating_grooves = grating_grooves
+        self.calibration_version = calibration_version
+        self.num_pixels = num_pixels
+        self.horizontal_binning = horizontal_binning
+        self.first_column = first_column
+        # Columns are always counted from the center of the whole CCD, however much of it was read out
+        self.sensor_width = CCD.WIDTH
+        self.calibration = calibration.find(grating_grooves, center_wavelength, calibration_version)
+        self.wavelengths = self.to_wavelengths(np.arange(num_pixels))
+        self.wavelengths.flags.writeable = False
+
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def get(center_wavelength: float, grating_grooves: int, calibration_version=BUILT_IN_CALIBRATION,
+            num_pixels=CCD.WIDTH, horizontal_binning=1, first_column=0) -> 'SpectralAxis':
+        """
+        Returns
+        -------
+        SpectralAxis
+            the shared axis for the given spectrometer configuration (see `SpectralAxis.__init__`), which is computed
+            once and kept until it is one of the least recently used
+        """
+        return SpectralAxis(center_wavelength, grating_grooves, calibration_version, num_pixels, horizontal_binning,
+                            first_column)
+
+    @staticmethod
+    def latest(center_wavelength: float, grating_grooves: int, **kwargs) -> 'SpectralAxis':
+        """
+        Returns
+        -------
+        SpectralAxis
+            the shared axis for the given spectrometer configuration, using the latest calibration for it (see
+            `matisse_controller.shamrock_ple.calibration.latest_version`). Any other kwargs are passed to
+            `SpectralAxis.get`.
+        """
+        calibration_version = calibration.latest_version(grating_grooves, center_wavelength)
+        return SpectralAxis.get(center_wavelength, grating_grooves, calibration_version, **kwargs)
+
+    def centered_columns(self, pixels) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        pixels
+            a pixel index, or an array of them, which may be fractional
+
+        Returns
+        -------
+        ndarray
+            the position of each pixel in CCD columns from the center of the CCD, which calibrations are defined on
+        """
+        # Use pixel + 1 because indexes range from 0 to 1023, CCD center is at 512 but zero-indexing would put it at 511
+        pixels = np.asarray(pixels, dtype=np.float64)
+        # Binned pixels are at the center of the columns they cover
+        columns = self.first_column + (pixels + 0.5) * self.horizontal_binning - 0.5
+        return columns + 1 - self.sensor_width / 2
+
+    def to_wavelengths(self, pixels) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        pixels
+            a pixel index, or an array of them
+
+        Returns
+        -------
+        ndarray
+            the wavelength of each pixel, in nanometers
+        """
+        return self.calibration.to_wavelengths(self.centered_columns(pixels), self.center_wavelength)
+
+    def to_pixels(self, wavelengths) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        wavelengths
+            a wavelength in nanometers, or an array of them
+
+        Returns
+        -------
+        ndarray
+            the index of the pixel at each wavelength (which may fall outside the CCD)
+        """
+        # Invert pixel -> wavelength conversion
+        columns = self.calibration.to_positions(wavelengths, self.center_wavelength) + self.sensor_width / 2 - 1
+        pixels = (columns - self.first_column + 0.5) / self.horizontal_binning - 0.5
+        return np.trunc(pixels).astype(np.intp)
+
+    def integration_window(self, start_wavelength: float, end_wavelength: float) -> (int, int):
+        """
+        Returns
+        -------
+        (int, int)
+            the start and end pixels corresponding to the given start and end wavelengths
+        """
+        start_pixel, end_pixel = self.to_pixels([start_wavelength, end_wavelength])
+        return int(start_pixel), int(end_pixel)
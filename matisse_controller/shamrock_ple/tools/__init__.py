@@ -1 +1,2 @@
-from .background import take_background, read_background, smooth
+from .background import take_background, take_master_dark, read_background, smooth
+from .calibration import calibrate_spectrometer
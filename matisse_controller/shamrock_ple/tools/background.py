@@ -12,9 +12,19 @@ def take_background(number):
 
     for i in range(number):
         data = ple.ccd.take_acquisition()
+        if data is None:
+            break
         np.savetxt(f"{str(i + 1).zfill(3)}_background_0.1s.txt.gz", data)
 
 
+def take_master_dark(number, exposure_time=0.1, grating_grooves=None):
+    """Average the given number of dark frames into a master dark, using the current grating if none is given."""
+    ple.PLE.load_andor_libs()
+    if grating_grooves is None:
+        grating_grooves = ple.shamrock.get_grating_grooves()
+    return ple.PLE(None).take_master_dark(number, exposure_time, grating_grooves)
+
+
 def read_background(number):
     total = np.zeros(1024)
     for i in range(number):
@@ -0,0 +1,17 @@
+import matisse_controller.shamrock_ple.ple as ple
+from matisse_controller.shamrock_ple.calibration import DEFAULT_DEGREE
+
+
+def calibrate_spectrometer(reference_wavelengths, exposure_time=0.1, center_wavelength=None, grating_grooves=None,
+                           num_frames=1, degree=DEFAULT_DEGREE):
+    """
+    Fit a new spectrometer calibration to a reference lamp spectrum, using the current center wavelength and grating if
+    none are given.
+    """
+    ple.PLE.load_andor_libs()
+    if center_wavelength is None:
+        center_wavelength = ple.shamrock.get_center_wavelength()
+    if grating_grooves is None:
+        grating_grooves = ple.shamrock.get_grating_grooves()
+    return ple.PLE(None).calibrate_spectrometer(reference_wavelengths, center_wavelength, grating_grooves,
+                                                exposure_time, num_frames=num_frames, degree=degree)
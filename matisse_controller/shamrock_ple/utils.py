@@ -1,23 +1,43 @@
+import ctypes
 import os
-from ctypes import WinDLL, windll
 from os import path
 
+import matisse_controller.config as cfg
 
-def load_lib(name: str) -> WinDLL:
+ANDOR_BACKEND = 'andor'
+SIMULATED_BACKEND = 'simulated'
+BACKENDS = [ANDOR_BACKEND, SIMULATED_BACKEND]
+
+
+def load_lib(name: str):
     """
     Load the specified dynamic link library using ctypes. Library functions may be called just like Python functions,
     but any data passed to these functions must be C-compatible types from the ctypes module.
 
-    Only loads libraries located inside the 'lib' folder.
+    Only loads libraries located inside the 'lib' folder. If cfg.PLE_BACKEND is set to the simulated backend, a
+    simulated library is returned instead (see `matisse_controller.shamrock_ple.simulation`), which works on any
+    platform.
 
     Returns
     -------
     WinDLL
-        an instance of WinDLL representing access to the library
+        an instance of WinDLL representing access to the library, or a simulated library with the same functions
     """
+    backend = cfg.get(cfg.PLE_BACKEND)
+    if backend == SIMULATED_BACKEND:
+        from matisse_controller.shamrock_ple import simulation
+        return simulation.load_lib(name)
+    elif backend != ANDOR_BACKEND:
+        raise OSError(f"Unknown PLE hardware backend '{backend}'. Use one of {', '.join(BACKENDS)}.")
+    if not hasattr(ctypes, 'windll'):
+        raise OSError(f"The Andor libraries can only be loaded on Windows. Set the PLE backend to "
+                      f"'{SIMULATED_BACKEND}' to use simulated hardware instead.")
+
     old_dir = os.getcwd()
     lib_dir = path.join(path.abspath(path.dirname(__file__)), 'lib')
     os.chdir(lib_dir)
-    lib = windll.LoadLibrary(name)
-    os.chdir(old_dir)
+    try:
+        lib = ctypes.windll.LoadLibrary(name)
+    finally:
+        os.chdir(old_dir)
     return lib